@@ -0,0 +1,357 @@
+import heapq
+import unittest
+from SearchSpace import SearchSpace
+import MovementProfile
+from helpers import SQRT2, euclidean
+
+"""
+ A* over the flat index layout of a SearchSpace, based on:
+  https://www.redblobgames.com/pathfinding/a-star/implementation.html
+"""
+
+
+def search(space, start, goal, profile=MovementProfile.DEFAULT, visited=None):
+    """ Finds the cheapest path between two flat indices of a search space.
+
+        Steps cost what the movement profile says, and the profile's
+        heuristic estimates the rest of the way. Stale heap entries are
+        skipped when popped rather than removed, and each cell is only
+        expanded once. Ties in priority go to the cell closest to the goal,
+        then to the lowest index, so the same query always gives the same
+        path.
+
+        If visited is a set, every cell the search looked at is added to it.
+
+        @return a list of flat indices from start to goal, or None if the
+        goal can't be reached"""
+
+    astar = AStarSearch(space, start, goal, profile, visited)
+    astar.step()
+    return astar.path
+
+
+class AStarSearch:
+    """ An A* search that can be run a few cells at a time.
+
+        Each call to step expands at most budget cells and returns, keeping
+        the frontier for the next call, so many searches can share the time
+        of a frame. Until it is done bestPath gives the path to the most
+        promising cell of the frontier, which units can start along. """
+
+    def __init__(self, space, start, goal, profile=MovementProfile.DEFAULT,
+                 visited=None):
+        self.space = space
+        self.start = start
+        self.goal = goal
+        self.profile = profile
+        self.visited = visited
+
+        (x, y) = divmod(start, space.height)
+        (goalX, goalY) = divmod(goal, space.height)
+        h = profile.heuristic(abs(x - goalX), abs(y - goalY))
+        self.frontier = [(h, h, start)]
+        self.costSoFar = {start: 0}
+        self.cameFrom = {start: None}
+        self.closed = set()
+
+        self.done = False
+        self.path = None
+        self.expanded = 0
+
+    def __repr__(self):
+        return 'AStarSearch({}, {}, {} expanded{})'.format(
+            self.start, self.goal, self.expanded, ', done' if self.done else '')
+
+    def step(self, budget=None):
+        """ Expands up to budget cells, or until the search ends if budget
+            is None.
+
+            @return True once the search is done, path is then the path
+            found or None if there isn't one"""
+
+        if self.done:
+            return True
+
+        space = self.space
+        passable = space.passable
+        cost = space.cost
+        width = space.width
+        height = space.height
+        profile = self.profile
+        heuristic = profile.heuristic
+        cutCorners = profile.cutCorners
+        goal = self.goal
+        (goalX, goalY) = divmod(goal, height)
+
+        frontier = self.frontier
+        costSoFar = self.costSoFar
+        cameFrom = self.cameFrom
+        closed = self.closed
+
+        expanded = 0
+        while frontier:
+            if budget is not None and expanded >= budget:
+                self.expanded += expanded
+                return False
+
+            current = heapq.heappop(frontier)[2]
+
+            if current in closed:
+                continue
+
+            if current == goal:
+                self.path = reconstruct(cameFrom, goal)
+                break
+
+            closed.add(current)
+            expanded += 1
+            currentCost = costSoFar[current]
+            (x, y) = divmod(current, height)
+
+            if (x + y) % 2 == 0:
+                offsets = profile.offsetsReversed
+            else:
+                offsets = profile.offsets
+
+            for (dx, dy, distance) in offsets:
+                nextX = x + dx
+                nextY = y + dy
+                if not (0 <= nextX < width and 0 <= nextY < height):
+                    continue
+
+                nextCell = current + dx * height + dy
+                if nextCell in closed or not passable[nextCell]:
+                    continue
+
+                if (dx and dy and not cutCorners and
+                        not (passable[current + dx * height] and
+                             passable[current + dy])):
+                    continue
+
+                newCost = currentCost + distance * (1 + cost[nextCell])
+                if nextCell not in costSoFar or newCost < costSoFar[nextCell]:
+                    costSoFar[nextCell] = newCost
+                    cameFrom[nextCell] = current
+                    h = heuristic(abs(nextX - goalX), abs(nextY - goalY))
+                    heapq.heappush(frontier, (newCost + h, h, nextCell))
+
+        self.expanded += expanded
+        self.done = True
+        if self.visited is not None:
+            self.visited.update(costSoFar)
+
+        return True
+
+    def bestPath(self):
+        """ Returns the path found if done, or else the path to the cell at
+            the front of the frontier. None if the goal can't be reached """
+
+        if self.done:
+            return self.path
+
+        frontier = self.frontier
+        while frontier and frontier[0][2] in self.closed:
+            heapq.heappop(frontier)
+
+        if not frontier:
+            return reconstruct(self.cameFrom, self.start)
+
+        return reconstruct(self.cameFrom, frontier[0][2])
+
+
+def reconstruct(cameFrom, goal):
+    """ Follows cameFrom back from the goal, returns the path start first """
+
+    path = []
+    current = goal
+    while current is not None:
+        path.append(current)
+        current = cameFrom[current]
+
+    path.reverse()
+    return path
+
+
+def dijkstra(space, sources, profile=MovementProfile.DEFAULT, reverse=False):
+    """ Finds the cost of the cheapest path from the nearest source to every
+        cell that can be reached.
+
+        If reverse is True the costs are of the paths from every cell to the
+        nearest source instead, which differ as a step costs more when the
+        cell it enters costs more.
+
+        @return a dict of flat index to cost"""
+
+    passable = space.passable
+    cost = space.cost
+    width = space.width
+    height = space.height
+    cutCorners = profile.cutCorners
+
+    frontier = [(0, source) for source in sources]
+    heapq.heapify(frontier)
+    costSoFar = dict.fromkeys(sources, 0)
+    closed = set()
+
+    while frontier:
+        current = heapq.heappop(frontier)[1]
+
+        if current in closed:
+            continue
+
+        closed.add(current)
+        currentCost = costSoFar[current]
+        (x, y) = divmod(current, height)
+
+        # going backwards, the step from a neighbour enters this cell
+        if reverse:
+            enterCost = 1 + cost[current]
+
+        for (dx, dy, distance) in profile.offsets:
+            nextX = x + dx
+            nextY = y + dy
+            if not (0 <= nextX < width and 0 <= nextY < height):
+                continue
+
+            nextCell = current + dx * height + dy
+            if nextCell in closed or not passable[nextCell]:
+                continue
+
+            if (dx and dy and not cutCorners and
+                    not (passable[current + dx * height] and
+                         passable[current + dy])):
+                continue
+
+            if reverse:
+                newCost = currentCost + distance * enterCost
+            else:
+                newCost = currentCost + distance * (1 + cost[nextCell])
+
+            if nextCell not in costSoFar or newCost < costSoFar[nextCell]:
+                costSoFar[nextCell] = newCost
+                heapq.heappush(frontier, (newCost, nextCell))
+
+    return costSoFar
+
+
+# unit testing
+class testAStar(unittest.TestCase):
+    def makeSpace(self, rows):
+        """ Makes a search space from rows of text, # is impassable and a
+            digit is the cost of the cell """
+
+        width = len(rows[0])
+        height = len(rows)
+        passable = [rows[y][x] != '#' for x in range(width)
+                    for y in range(height)]
+        cost = [int(rows[y][x]) if rows[y][x].isdigit() else 0
+                for x in range(width) for y in range(height)]
+        return SearchSpace(passable, cost, width, height)
+
+    def pathCost(self, space, path):
+        total = 0
+        for (previous, current) in zip(path, path[1:]):
+            (x0, y0) = space.position(previous)
+            (x1, y1) = space.position(current)
+            step = SQRT2 if (x0 != x1 and y0 != y1) else 1
+            total += step * (1 + space.cost[current])
+        return total
+
+    def test_straight(self):
+        space = self.makeSpace(["....",
+                                "....",
+                                "...."])
+        path = search(space, space.index(0, 1), space.index(3, 1))
+
+        self.assertEqual([space.position(i) for i in path],
+                         [(0, 1), (1, 1), (2, 1), (3, 1)])
+
+    def test_wall(self):
+        space = self.makeSpace(["..#..",
+                                "..#..",
+                                "....."])
+        path = search(space, space.index(0, 0), space.index(4, 0))
+
+        self.assertEqual(path[0], space.index(0, 0))
+        self.assertEqual(path[-1], space.index(4, 0))
+        for i in path:
+            self.assertTrue(space.passable[i])
+
+    def test_unreachable(self):
+        space = self.makeSpace(["..#..",
+                                "..#..",
+                                "..#.."])
+
+        self.assertIsNone(search(space, space.index(0, 0), space.index(4, 0)))
+
+    def test_optimal(self):
+        space = self.makeSpace(["......",
+                                ".####.",
+                                "......",
+                                "......"])
+        start = space.index(0, 0)
+        goal = space.index(5, 3)
+
+        self.assertAlmostEqual(self.pathCost(space, search(space, start, goal)),
+                               6 + SQRT2)
+
+        profile = MovementProfile.MovementProfile(euclidean)
+        self.assertAlmostEqual(
+            self.pathCost(space, search(space, start, goal, profile)),
+            6 + SQRT2)
+
+    def test_terrainCost(self):
+        space = self.makeSpace(["...",
+                                ".9.",
+                                "..."])
+        path = search(space, space.index(0, 1), space.index(2, 1))
+
+        self.assertNotIn(space.index(1, 1), path)
+
+    def test_cutCorners(self):
+        space = self.makeSpace([".#",
+                                "#."])
+        start = space.index(0, 0)
+        goal = space.index(1, 1)
+
+        self.assertIsNone(search(space, start, goal))
+
+        profile = MovementProfile.MovementProfile(cutCorners=True)
+        self.assertEqual(search(space, start, goal, profile), [start, goal])
+
+    def test_dijkstra(self):
+        space = self.makeSpace(["..#",
+                                ".3.",
+                                "..."])
+        start = space.index(0, 0)
+        costs = dijkstra(space, [start])
+        backwards = dijkstra(space, [start], reverse=True)
+
+        self.assertNotIn(space.index(2, 0), costs)
+        self.assertAlmostEqual(costs[space.index(1, 1)], 5)
+        self.assertAlmostEqual(backwards[space.index(1, 1)], SQRT2)
+        for goal in costs:
+            path = search(space, start, goal)
+            self.assertAlmostEqual(costs[goal], self.pathCost(space, path))
+
+    def test_timeSliced(self):
+        space = self.makeSpace(["..........",
+                                ".########.",
+                                "..........",
+                                ".........."])
+        start = space.index(0, 3)
+        goal = space.index(9, 0)
+        astar = AStarSearch(space, start, goal)
+
+        self.assertFalse(astar.step(3))
+        partial = astar.bestPath()
+        self.assertEqual(partial[0], start)
+        self.assertEqual(astar.expanded, 3)
+
+        while not astar.step(3):
+            pass
+        self.assertEqual(astar.path, search(space, start, goal))
+        self.assertEqual(astar.bestPath(), astar.path)
+
+if __name__ == "__main__":
+    unittest.main()
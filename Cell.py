@@ -1,28 +1,43 @@
 from GameEntity import GameEntity
 import pygame
-from Vector import Vec2d
+from pygame import Rect
 import sys
 
 import config
+from Tileset import Tileset
+
+# shared by every cell that isn't given a tileset, so the terrain images are
+# only loaded once
+defaultTileset = None
+
+
+def getDefaultTileset():
+    global defaultTileset
+
+    if defaultTileset is None:
+        defaultTileset = Tileset()
+
+    return defaultTileset
 
 
 class Cell(GameEntity):
-    def __init__(self, position, perlin):
-        self.x = position.x
-        self.y = position.y
-        self.cost = 0
-        self.passable = True
+    """ A view of one cell of a Grid.
 
-        GameEntity.__init__(self)
+        Cells are created on demand and hold no terrain data themselves,
+        reading and writing it through to the grid's arrays."""
 
-        self.setPosition(Vec2d(position.x * config.CELL_WIDTH,
-                               position.y * config.CELL_HEIGHT))
-        self.setDimensions(config.CELL_WIDTH, config.CELL_HEIGHT)
+    def __init__(self, grid, x, y, tileset=None):
+        self.grid = grid
+        self.x = x
+        self.y = y
 
-        self.dirty = True
-        self.terrainHeight = perlin
+        if tileset is None:
+            tileset = getDefaultTileset()
+        self.tileset = tileset
 
-        self.getType()
+        self._rect = Rect(x * config.CELL_WIDTH, y * config.CELL_HEIGHT,
+                          config.CELL_WIDTH, config.CELL_HEIGHT)
+        self._image = None
 
     def __hash__(self):
         return hash((self.x, self.y))
@@ -30,31 +45,53 @@ class Cell(GameEntity):
     def __eq__(self, other):
         return (self.x, self.y) == (other.x, other.y)
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        return (self.x, self.y) < (other.x, other.y)
+
     def __repr__(self):
         return 'Cell({}, {})'.format(self.x,
                                      self.y)
 
-    def getType(self):
-        if (self.terrainHeight > 20):
-            image = pygame.image.load('./img/grass_1.png')
+    @property
+    def cost(self):
+        return int(self.grid.cost[self.x, self.y])
+
+    @cost.setter
+    def cost(self, cost):
+        self.grid.setCost(self.x, self.y, cost)
+
+    @property
+    def passable(self):
+        return bool(self.grid.passable[self.x, self.y])
+
+    @passable.setter
+    def passable(self, passable):
+        self.grid.setPassable(self.x, self.y, passable)
 
-        else:
-            self.passable = False
-            image = pygame.image.load('./img/water_1.png')
+    @property
+    def terrain(self):
+        return int(self.grid.terrain[self.x, self.y])
+
+    @property
+    def terrainHeight(self):
+        return float(self.grid.terrainHeight[self.x, self.y])
+
+    def getType(self):
+        return self.terrain
 
-        try:
-            # convert loaded image to display surface
-            image.convert()
+    def setTileset(self, tileset):
+        self.tileset = tileset
 
-        except pygame.error:
-            # there will be an error if display mode is not set i.e. if the
-            # module is imported by itself, there will be no screen
-            pass
+    def getImage(self):
+        """ Returns the tileset's shared image for this cell's terrain """
 
-        self.setImage(image)
+        return self.tileset.getImage(self.terrain)
 
     def setDirty(self, isDirty):
-        self.dirty = isDirty
+        self.grid.setDirty(self.x, self.y, isDirty)
 
     def getDirty(self):
-        return self.dirty
+        return bool(self.grid.dirty[self.x, self.y])
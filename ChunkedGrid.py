@@ -0,0 +1,322 @@
+import collections
+import unittest
+import numpy
+
+import config
+from Grid import Grid
+from Terrain import TerrainGenerator
+
+# the layers whose edits are kept when a chunk is evicted, the dirty flags
+# are not kept as a regenerated chunk has to be drawn again anyway
+PERSISTENT_LAYERS = ('terrainHeight', 'terrain', 'cost', 'passable')
+LAYERS = PERSISTENT_LAYERS + ('dirty',)
+
+
+class ChunkedGrid:
+    """ A grid that is generated a chunk at a time, as it is used.
+
+        Chunks are small Grids that are generated from the terrain generator
+        the first time any of their cells are read or written. When the
+        loaded chunks go over the memory budget the least recently used ones
+        are dropped, and regenerated the same way if they are used again.
+        Edits to dropped chunks are kept and applied again on regeneration.
+        They are kept per chunk, as a mask of the edited cells and an array
+        of their values for each layer edited, so they take at most
+        chunkSize * chunkSize * (1 + itemsize) bytes a layer for each chunk
+        that has ever been edited, however many cells of it were.
+
+        The layers (passable, cost...) can be indexed with [x, y] or
+        [x_min:x_max, y_min:y_max] like the arrays of a Grid, slices return
+        a copy.
+
+        stored can be where chunks were saved, such as a MapFile's, with a
+        getChunk(chunkX, chunkY) that returns {layer name: array} of a
+        stored chunk or None. Stored chunks are read from it instead of
+        being generated."""
+
+    def __init__(self, width=config.WORLD_WIDTH, height=config.WORLD_HEIGHT,
+                 chunkSize=config.CHUNK_SIZE, memory=config.CHUNK_MEMORY,
+                 generator=None, stored=None):
+        self.width = width
+        self.height = height
+        self.chunkSize = chunkSize
+
+        if generator is None:
+            generator = TerrainGenerator()
+        self.generator = generator
+        self.stored = stored
+
+        self.chunks = collections.OrderedDict()
+        self.edits = {}
+        self.listeners = []
+
+        chunkBytes = Grid(chunkSize, chunkSize).nbytes()
+        self.maxChunks = max(1, memory // chunkBytes)
+
+        for name in LAYERS:
+            setattr(self, name, ChunkedLayer(self, name))
+
+    def __repr__(self):
+        return 'ChunkedGrid({}, {}, {} chunks loaded)'.format(
+            self.width, self.height, len(self.chunks))
+
+    def inBounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def index(self, x, y):
+        return x * self.height + y
+
+    def position(self, index):
+        return divmod(index, self.height)
+
+    def addListener(self, listener):
+        """ Adds a function to be called with (x_min, x_max, y_min, y_max)
+            whenever cells in that range are edited. Generating a chunk is
+            not a change, it always gives the same terrain """
+
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        self.listeners.remove(listener)
+
+    def changed(self, x_min, x_max, y_min, y_max):
+        for listener in self.listeners:
+            listener(x_min, x_max, y_min, y_max)
+
+    def generate(self, generator):
+        """ Sets the terrain generator, chunks are made as they are used """
+
+        self.generator = generator
+        self.stored = None
+        self.chunks.clear()
+        self.edits.clear()
+        self.changed(0, self.width, 0, self.height)
+
+    def getChunk(self, chunkX, chunkY):
+        """ Returns the chunk at a chunk index, generating it if needed """
+
+        key = (chunkX, chunkY)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+
+        layers = None
+        if self.stored is not None:
+            layers = self.stored.getChunk(chunkX, chunkY)
+
+        if layers is not None:
+            chunk = Grid(self.chunkSize, self.chunkSize,
+                         dict((name, numpy.array(layers[name]))
+                              for name in PERSISTENT_LAYERS))
+        else:
+            chunk = Grid(self.chunkSize, self.chunkSize)
+            chunk.setBlock(0, 0, self.generator.heights(
+                chunkX * self.chunkSize, chunkY * self.chunkSize,
+                self.chunkSize, self.chunkSize))
+
+        for (name, (mask, values)) in self.edits.get(key, {}).items():
+            getattr(chunk, name)[mask] = values[mask]
+
+        self.chunks[key] = chunk
+        while len(self.chunks) > self.maxChunks:
+            self.chunks.popitem(last=False)
+
+        return chunk
+
+    def loadedChunks(self):
+        return list(self.chunks)
+
+    def setTerrainHeight(self, x, y, terrainHeight):
+        key = (x // self.chunkSize, y // self.chunkSize)
+        cell = (x % self.chunkSize, y % self.chunkSize)
+        chunk = self.getChunk(*key)
+        chunk.setTerrainHeight(cell[0], cell[1], terrainHeight)
+
+        for name in PERSISTENT_LAYERS:
+            self._recordEdit(key, name, cell, getattr(chunk, name)[cell])
+
+        self.changed(x, x + 1, y, y + 1)
+
+    def setPassable(self, x, y, passable):
+        self.passable[x, y] = passable
+
+    def setCost(self, x, y, cost):
+        self.cost[x, y] = cost
+
+    def setDirty(self, x, y, isDirty):
+        self.dirty[x, y] = isDirty
+
+    def nbytes(self):
+        """ Returns the memory used by the loaded chunks """
+
+        return sum(chunk.nbytes() for chunk in self.chunks.values())
+
+    def editBytes(self):
+        """ Returns the memory used to keep the edits """
+
+        return sum(mask.nbytes + values.nbytes
+                   for edits in self.edits.values()
+                   for (mask, values) in edits.values())
+
+    def _recordEdit(self, key, name, part, value):
+        """ Records an edit of a cell or block, part, of a layer of the
+            chunk at key """
+
+        edits = self.edits.setdefault(key, {})
+        if name not in edits:
+            shape = (self.chunkSize, self.chunkSize)
+            edits[name] = (numpy.zeros(shape, numpy.bool_),
+                           numpy.zeros(shape, getattr(self, name).dtype))
+
+        (mask, values) = edits[name]
+        mask[part] = True
+        values[part] = value
+
+
+class ChunkedLayer:
+    """ One layer of a ChunkedGrid, indexed like a 2D array """
+
+    def __init__(self, grid, name):
+        self.grid = grid
+        self.name = name
+        self.dtype = getattr(Grid(1, 1), name).dtype
+
+    def _ranges(self, key):
+        (x, y) = key
+        if isinstance(x, slice) or isinstance(y, slice):
+            if not isinstance(x, slice):
+                x = slice(x, x + 1)
+            if not isinstance(y, slice):
+                y = slice(y, y + 1)
+            return (x.indices(self.grid.width)[:2],
+                    y.indices(self.grid.height)[:2])
+
+        return None
+
+    def _blocks(self, xRange, yRange):
+        """ Yields each chunk overlapping a range, with the part of the chunk
+            and the part of the range that overlap """
+
+        size = self.grid.chunkSize
+        for chunkX in range(xRange[0] // size, (xRange[1] - 1) // size + 1):
+            x0 = max(xRange[0], chunkX * size)
+            x1 = min(xRange[1], (chunkX + 1) * size)
+            for chunkY in range(yRange[0] // size,
+                                (yRange[1] - 1) // size + 1):
+                y0 = max(yRange[0], chunkY * size)
+                y1 = min(yRange[1], (chunkY + 1) * size)
+
+                chunk = self.grid.getChunk(chunkX, chunkY)
+                yield ((chunkX, chunkY), getattr(chunk, self.name),
+                       (slice(x0 - chunkX * size, x1 - chunkX * size),
+                        slice(y0 - chunkY * size, y1 - chunkY * size)),
+                       (slice(x0 - xRange[0], x1 - xRange[0]),
+                        slice(y0 - yRange[0], y1 - yRange[0])))
+
+    def __getitem__(self, key):
+        ranges = self._ranges(key)
+        if ranges is None:
+            (x, y) = key
+            size = self.grid.chunkSize
+            chunk = self.grid.getChunk(x // size, y // size)
+            return getattr(chunk, self.name)[x % size, y % size]
+
+        (xRange, yRange) = ranges
+        result = numpy.empty((max(0, xRange[1] - xRange[0]),
+                              max(0, yRange[1] - yRange[0])), self.dtype)
+        if result.size:
+            for (key, layer, chunkPart, resultPart) in self._blocks(xRange,
+                                                                    yRange):
+                result[resultPart] = layer[chunkPart]
+
+        return result
+
+    def __setitem__(self, key, value):
+        ranges = self._ranges(key)
+        if ranges is None:
+            (x, y) = key
+            size = self.grid.chunkSize
+            chunkKey = (x // size, y // size)
+            cell = (x % size, y % size)
+            chunk = self.grid.getChunk(*chunkKey)
+            getattr(chunk, self.name)[cell] = value
+
+            if self.name in PERSISTENT_LAYERS:
+                self.grid._recordEdit(chunkKey, self.name, cell, value)
+                self.grid.changed(x, x + 1, y, y + 1)
+            return
+
+        (xRange, yRange) = ranges
+        if xRange[1] <= xRange[0] or yRange[1] <= yRange[0]:
+            return
+
+        value = numpy.broadcast_to(numpy.asarray(value, self.dtype),
+                                   (xRange[1] - xRange[0],
+                                    yRange[1] - yRange[0]))
+        persistent = self.name in PERSISTENT_LAYERS
+        for (key, layer, chunkPart, resultPart) in self._blocks(xRange, yRange):
+            layer[chunkPart] = value[resultPart]
+            if persistent:
+                self.grid._recordEdit(key, self.name, chunkPart,
+                                      value[resultPart])
+
+        if persistent:
+            self.grid.changed(xRange[0], xRange[1], yRange[0], yRange[1])
+
+
+# unit testing
+class testChunkedGrid(unittest.TestCase):
+    def test_matchesGrid(self):
+        generator = TerrainGenerator(seed=2)
+        grid = Grid(40, 40)
+        generator.generate(grid)
+        chunked = ChunkedGrid(40, 40, 16, generator=generator)
+
+        self.assertTrue(numpy.array_equal(chunked.passable[0:40, 0:40],
+                                          grid.passable))
+        self.assertEqual(chunked.terrain[17, 33], grid.terrain[17, 33])
+
+    def test_eviction(self):
+        chunkBytes = Grid(16, 16).nbytes()
+        chunked = ChunkedGrid(1000, 1000, 16, memory=chunkBytes * 4)
+
+        before = chunked.terrainHeight[5, 5]
+        chunked.setPassable(5, 5, False)
+        for chunkX in range(1, 10):
+            chunked.getChunk(chunkX, 0)
+
+        self.assertEqual(len(chunked.loadedChunks()), 4)
+        self.assertNotIn((0, 0), chunked.loadedChunks())
+        self.assertEqual(chunked.terrainHeight[5, 5], before)
+        self.assertFalse(chunked.passable[5, 5])
+
+    def test_setSlice(self):
+        chunked = ChunkedGrid(100, 100, 16)
+        chunked.dirty[10:40, 10:20] = False
+
+        self.assertFalse(chunked.dirty[10:40, 10:20].any())
+        self.assertTrue(chunked.dirty[40, 10])
+
+    def test_editsKept(self):
+        chunkBytes = Grid(16, 16).nbytes()
+        chunked = ChunkedGrid(1000, 1000, 16, memory=chunkBytes * 2)
+        chunked.passable[0:20, 0:20] = False
+        chunked.cost[3, 3] = 7
+        chunked.dirty[0:20, 0:20] = False
+
+        # a mask and a value for each cell of an edited chunk and layer
+        self.assertEqual(chunked.editBytes(), 4 * 16 * 16 * 2 + 16 * 16 * 2)
+
+        for chunkX in range(2, 6):
+            chunked.getChunk(chunkX, 5)
+        self.assertEqual(chunked.loadedChunks(), [(4, 5), (5, 5)])
+
+        self.assertFalse(chunked.passable[0:20, 0:20].any())
+        self.assertTrue(chunked.dirty[0:20, 0:20].all())
+        self.assertEqual(chunked.cost[3, 3], 7)
+        self.assertEqual(chunked.passable[20, 20],
+                         chunked.terrain[20, 20] != config.TERRAIN_WATER)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,258 @@
+import math
+import unittest
+import numpy
+
+from Grid import Grid
+
+"""
+ Connected component labelling of the passable cells, done a column of runs
+ at a time rather than a cell at a time, see:
+  https://en.wikipedia.org/wiki/Connected-component_labeling
+"""
+
+
+class Connectivity:
+    """ Labels each group of passable cells that can reach each other.
+
+        Two cells with the same label are connected, so a path query
+        between different labels can be turned down straight away instead
+        of searching everything that can be reached first. Impassable cells
+        have label 0.
+
+        With diagonal moves that can cut corners cells touching at a corner
+        are connected, otherwise only cells sharing a side are, as a
+        diagonal step that can't cut a corner can always go round it.
+
+        When the grid changes, the groups of cells around the change are
+        labelled again the next time a label is asked for.
+
+        labels and nextLabel can be given from a saved labelling of the same
+        grid, such as a MapFile's, instead of labelling it again. """
+
+    def __init__(self, grid, diagonal=False, labels=None, nextLabel=None):
+        self.grid = grid
+        self.diagonal = diagonal
+        self.changes = []
+        grid.addListener(self.cellsChanged)
+
+        if labels is not None:
+            self.labels = labels
+            self.nextLabel = nextLabel
+            return
+
+        self.labels = numpy.zeros((grid.width, grid.height), numpy.int32)
+        self.nextLabel = 1
+        self._label(0, grid.width, 0, grid.height,
+                    numpy.asarray(grid.passable, numpy.bool_))
+
+    def __repr__(self):
+        return 'Connectivity({} groups)'.format(
+            len(numpy.unique(self.labels)) - 1)
+
+    def cellsChanged(self, x_min, x_max, y_min, y_max):
+        self.changes.append((x_min, x_max, y_min, y_max))
+
+    def label(self, x, y):
+        """ Returns the label of the cell at x, y, 0 if it is impassable """
+
+        self.update()
+        return int(self.labels[x, y])
+
+    def connected(self, a, b):
+        """ Checks if there is a way between two positions """
+
+        labelA = self.label(a[0], a[1])
+        return labelA != 0 and labelA == self.label(b[0], b[1])
+
+    def nearest(self, position, origin):
+        """ Returns the position nearest to position that can be reached from
+            origin, or None if origin is impassable """
+
+        label = self.label(origin[0], origin[1])
+        if label == 0:
+            return None
+
+        (x, y) = (position[0], position[1])
+        if self.labels[x, y] == label:
+            return (x, y)
+
+        # look in squares twice as big each time, then once more in the
+        # square the nearest one found could be beaten in
+        radius = 1
+        size = max(self.grid.width, self.grid.height)
+        found = None
+        while found is None:
+            found = self._nearestWithin(x, y, radius, label)
+            radius *= 2
+            if radius > size * 2:
+                return None
+
+        distance = math.hypot(found[0] - x, found[1] - y)
+        return self._nearestWithin(x, y, int(math.ceil(distance)), label)
+
+    def _nearestWithin(self, x, y, radius, label):
+        x_min = max(0, x - radius)
+        y_min = max(0, y - radius)
+        window = self.labels[x_min:x + radius + 1, y_min:y + radius + 1]
+
+        (xs, ys) = numpy.nonzero(window == label)
+        if not len(xs):
+            return None
+
+        xs += x_min
+        ys += y_min
+        best = numpy.argmin((xs - x) ** 2 + (ys - y) ** 2)
+        return (int(xs[best]), int(ys[best]))
+
+    def update(self):
+        """ Labels the groups of cells around changes since the last update """
+
+        if not self.changes:
+            return
+
+        grid = self.grid
+        changes = self.changes
+        self.changes = []
+
+        changed = numpy.zeros(self.labels.shape, numpy.bool_)
+        dirty = set()
+        for (x_min, x_max, y_min, y_max) in changes:
+            passable = numpy.asarray(grid.passable[x_min:x_max, y_min:y_max],
+                                     numpy.bool_)
+            flipped = passable != (self.labels[x_min:x_max, y_min:y_max] > 0)
+            if not flipped.any():
+                continue
+
+            changed[x_min:x_max, y_min:y_max] |= flipped
+
+            # the groups a flipped cell was in, or now joins up
+            around = self.labels[max(0, x_min - 1):x_max + 1,
+                                 max(0, y_min - 1):y_max + 1]
+            dirty.update(numpy.unique(around).tolist())
+
+        dirty.discard(0)
+        if not changed.any():
+            return
+
+        mask = changed | numpy.isin(self.labels, list(dirty))
+        (xs, ys) = numpy.nonzero(mask)
+        (x_min, x_max) = (int(xs.min()), int(xs.max()) + 1)
+        (y_min, y_max) = (int(ys.min()), int(ys.max()) + 1)
+
+        self.labels[mask] = 0
+        passable = numpy.asarray(grid.passable[x_min:x_max, y_min:y_max],
+                                 numpy.bool_)
+        self._label(x_min, x_max, y_min, y_max,
+                    passable & mask[x_min:x_max, y_min:y_max])
+
+    def _label(self, x_min, x_max, y_min, y_max, passable):
+        """ Gives new labels to the passable cells of a block, joining up the
+            runs of passable cells in each column with the runs they touch
+            in the next """
+
+        reach = 1 if self.diagonal else 0
+        parents = []
+        columns = []
+
+        def find(run):
+            while parents[run] != run:
+                parents[run] = parents[parents[run]]
+                run = parents[run]
+            return run
+
+        for x in range(x_max - x_min):
+            column = passable[x]
+            padded = numpy.concatenate(([False], column, [False]))
+            edges = numpy.flatnonzero(padded[1:] != padded[:-1])
+            runs = list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+            first = len(parents)
+            parents.extend(range(first, first + len(runs)))
+
+            if columns:
+                (previousFirst, previousRuns) = columns[-1]
+                i = j = 0
+                while i < len(previousRuns) and j < len(runs):
+                    (a0, a1) = previousRuns[i]
+                    (b0, b1) = runs[j]
+                    if a0 < b1 + reach and b0 < a1 + reach:
+                        rootA = find(previousFirst + i)
+                        rootB = find(first + j)
+                        if rootA != rootB:
+                            parents[rootB] = rootA
+
+                    if a1 < b1:
+                        i += 1
+                    else:
+                        j += 1
+
+            columns.append((first, runs))
+
+        roots = {}
+        labels = self.labels
+        for (x, (first, runs)) in enumerate(columns):
+            for (i, (y0, y1)) in enumerate(runs):
+                root = find(first + i)
+                if root not in roots:
+                    roots[root] = self.nextLabel
+                    self.nextLabel += 1
+                labels[x_min + x, y_min + y0:y_min + y1] = roots[root]
+
+
+# unit testing
+class testConnectivity(unittest.TestCase):
+    def makeGrid(self, rows):
+        """ Makes a grid from rows of text, # is impassable """
+
+        grid = Grid(len(rows[0]), len(rows))
+        for (y, row) in enumerate(rows):
+            for (x, char) in enumerate(row):
+                grid.passable[x, y] = char != '#'
+        return grid
+
+    def test_label(self):
+        grid = self.makeGrid(["..#..",
+                              "..#..",
+                              "###.#",
+                              "#.#.."])
+        connectivity = Connectivity(grid)
+
+        self.assertTrue(connectivity.connected((0, 0), (1, 1)))
+        self.assertTrue(connectivity.connected((3, 0), (4, 3)))
+        self.assertFalse(connectivity.connected((0, 0), (3, 0)))
+        self.assertFalse(connectivity.connected((1, 3), (0, 0)))
+        self.assertEqual(connectivity.label(2, 0), 0)
+
+    def test_diagonal(self):
+        grid = self.makeGrid([".#",
+                              "#."])
+
+        self.assertFalse(Connectivity(grid).connected((0, 0), (1, 1)))
+        self.assertTrue(Connectivity(grid, True).connected((0, 0), (1, 1)))
+
+    def test_update(self):
+        grid = self.makeGrid(["..#..",
+                              "..#..",
+                              "....."])
+        connectivity = Connectivity(grid)
+        self.assertTrue(connectivity.connected((0, 0), (4, 0)))
+
+        grid.setPassable(2, 2, False)
+        self.assertFalse(connectivity.connected((0, 0), (4, 0)))
+
+        grid.setPassable(2, 0, True)
+        self.assertTrue(connectivity.connected((0, 0), (4, 0)))
+        self.assertTrue(connectivity.connected((0, 2), (3, 2)))
+
+    def test_nearest(self):
+        grid = self.makeGrid(["....#...",
+                              "....#...",
+                              "....#..."])
+        connectivity = Connectivity(grid)
+
+        self.assertEqual(connectivity.nearest((6, 1), (0, 0)), (3, 1))
+        self.assertEqual(connectivity.nearest((4, 1), (0, 0)), (3, 1))
+        self.assertEqual(connectivity.nearest((1, 1), (0, 0)), (1, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,330 @@
+import heapq
+import unittest
+
+import AStar
+import MovementProfile
+from SearchSpace import SearchSpace
+from Path import Path
+from helpers import SQRT2
+
+"""
+ D* Lite, from:
+  Koenig and Likhachev, D* Lite
+ searching back from the goal, so the costs it keeps stay right as the unit
+ moves and only the ones a change affects have to be worked out again
+"""
+
+INFINITY = float('inf')
+
+
+class DStarLite:
+    """ Keeps the path of one unit to its goal up to date as the map changes.
+
+        The search runs back from the goal and remembers the cost to the
+        goal of every cell it looked at. When cells change only those costs
+        that depend on them are repaired, rather than searching again from
+        scratch, and the unit can move along the way without that
+        invalidating anything.
+
+        Made by Map.planPath. Changes to the map are picked up from the
+        grid's listeners and applied the next time a path is asked for,
+        call close when the planner isn't needed any more. """
+
+    def __init__(self, theMap, start, goal, profile=MovementProfile.DEFAULT):
+        self.theMap = theMap
+        self.profile = profile
+
+        self.space = SearchSpace.around(theMap.grid, start, goal)
+        self.start = self.space.index(start.x, start.y)
+        self.goal = self.space.index(goal.x, goal.y)
+        self.last = self.start
+
+        self.g = {}
+        self.rhs = {self.goal: 0}
+        self.queue = []
+        self.queued = {}
+        self.km = 0
+        self.expanded = 0
+
+        self.changes = []
+        theMap.grid.addListener(self.cellsChanged)
+
+        self._push(self.goal)
+
+    def __repr__(self):
+        return 'DStarLite({}, {}, {} expanded)'.format(
+            self.space.position(self.start), self.space.position(self.goal),
+            self.expanded)
+
+    def close(self):
+        """ Stops listening to the map for changes """
+
+        self.theMap.grid.removeListener(self.cellsChanged)
+
+    def cellsChanged(self, x_min, x_max, y_min, y_max):
+        self.changes.append((x_min, x_max, y_min, y_max))
+
+    def hasChanges(self):
+        """ Checks if cells have changed since the path was last worked out,
+            so getPath would give a different one """
+
+        return bool(self.changes)
+
+    def heuristic(self, a, b):
+        (ax, ay) = divmod(a, self.space.height)
+        (bx, by) = divmod(b, self.space.height)
+        return self.profile.heuristic(abs(ax - bx), abs(ay - by))
+
+    def successors(self, node):
+        """ Yields (cell, cost) for each cell that can be moved to from node """
+
+        space = self.space
+        passable = space.passable
+        cost = space.cost
+        height = space.height
+        (x, y) = divmod(node, height)
+
+        if not passable[node]:
+            return
+
+        for (dx, dy, distance) in self.profile.offsets:
+            if not (0 <= x + dx < space.width and 0 <= y + dy < height):
+                continue
+
+            nextCell = node + dx * height + dy
+            if not passable[nextCell]:
+                continue
+
+            if (dx and dy and not self.profile.cutCorners and
+                    not (passable[node + dx * height] and
+                         passable[node + dy])):
+                continue
+
+            yield (nextCell, distance * (1 + cost[nextCell]))
+
+    def neighbours(self, node):
+        """ Yields the cells next to node, whatever their passability """
+
+        space = self.space
+        (x, y) = divmod(node, space.height)
+        for (dx, dy, distance) in self.profile.offsets:
+            if 0 <= x + dx < space.width and 0 <= y + dy < space.height:
+                yield node + dx * space.height + dy
+
+    def _key(self, node):
+        best = min(self.g.get(node, INFINITY), self.rhs.get(node, INFINITY))
+        return (best + self.heuristic(self.start, node) + self.km, best)
+
+    def _push(self, node):
+        key = self._key(node)
+        self.queued[node] = key
+        heapq.heappush(self.queue, key + (node,))
+
+    def _updateVertex(self, node):
+        """ Works out the best cost to the goal through node's successors,
+            and queues node if it is now inconsistent """
+
+        if node != self.goal:
+            self.rhs[node] = min([stepCost + self.g.get(nextCell, INFINITY)
+                                  for (nextCell, stepCost)
+                                  in self.successors(node)] or [INFINITY])
+
+        self.queued.pop(node, None)
+        if self.g.get(node, INFINITY) != self.rhs.get(node, INFINITY):
+            self._push(node)
+
+    def _topKey(self):
+        queue = self.queue
+        while queue and self.queued.get(queue[0][2]) != queue[0][:2]:
+            heapq.heappop(queue)
+
+        if queue:
+            return queue[0][:2]
+
+        return (INFINITY, INFINITY)
+
+    def computeShortestPath(self):
+        """ Repairs the costs until the start's is right """
+
+        start = self.start
+        while (self._topKey() < self._key(start) or
+               self.rhs.get(start, INFINITY) != self.g.get(start, INFINITY)):
+            (k1, k2, node) = heapq.heappop(self.queue)
+            if self.queued.get(node) != (k1, k2):
+                continue
+
+            self.expanded += 1
+            newKey = self._key(node)
+            if (k1, k2) < newKey:
+                # the key was from before km went up
+                self._push(node)
+                continue
+
+            del self.queued[node]
+            g = self.g.get(node, INFINITY)
+            rhs = self.rhs.get(node, INFINITY)
+            if g > rhs:
+                self.g[node] = rhs
+                for previous in self.neighbours(node):
+                    self._updateVertex(previous)
+            else:
+                self.g[node] = INFINITY
+                self._updateVertex(node)
+                for previous in self.neighbours(node):
+                    self._updateVertex(previous)
+
+    def _applyChanges(self):
+        """ Updates the cells around every cell that has changed, as the
+            steps out of them, into them, or past their corners have """
+
+        if not self.changes:
+            return
+
+        space = self.space
+        grid = self.theMap.grid
+        self.km += self.heuristic(self.last, self.start)
+        self.last = self.start
+
+        touched = set()
+        for (x_min, x_max, y_min, y_max) in self.changes:
+            x_min = max(x_min, space.originX)
+            x_max = min(x_max, space.originX + space.width)
+            y_min = max(y_min, space.originY)
+            y_max = min(y_max, space.originY + space.height)
+            if x_min >= x_max or y_min >= y_max:
+                continue
+
+            # a window of a chunked world is a copy, so it is updated too
+            passable = grid.passable[x_min:x_max, y_min:y_max]
+            cost = grid.cost[x_min:x_max, y_min:y_max]
+            for x in range(x_min, x_max):
+                for y in range(y_min, y_max):
+                    index = space.index(x, y)
+                    space.passable[index] = bool(passable[x - x_min,
+                                                          y - y_min])
+                    space.cost[index] = int(cost[x - x_min, y - y_min])
+                    touched.add(index)
+                    touched.update(self.neighbours(index))
+
+        self.changes = []
+        for node in touched:
+            self._updateVertex(node)
+
+    def moveTo(self, cell):
+        """ Tells the planner the unit is now at cell """
+
+        self.start = self.space.index(cell.x, cell.y)
+
+    def nextStep(self):
+        """ Returns the flat index to step to from the start, or None at the
+            goal or if it can't be reached """
+
+        self._applyChanges()
+        self.computeShortestPath()
+
+        if self.start == self.goal:
+            return None
+
+        best = None
+        bestCost = INFINITY
+        for (nextCell, stepCost) in self.successors(self.start):
+            total = stepCost + self.g.get(nextCell, INFINITY)
+            if total < bestCost:
+                (best, bestCost) = (nextCell, total)
+
+        return best
+
+    def advance(self):
+        """ Moves the planner's start one step along the path
+
+            @return the Cell stepped to, or None if it didn't move """
+
+        nextCell = self.nextStep()
+        if nextCell is None:
+            return None
+
+        self.start = nextCell
+        return self.theMap.getCell(*self.space.position(nextCell))
+
+    def getPath(self):
+        """ Returns the Path from the start to the goal, just the start if the
+            goal can't be reached """
+
+        self._applyChanges()
+        self.computeShortestPath()
+
+        indices = [self.start]
+        if self.g.get(self.start, INFINITY) < INFINITY:
+            current = self.start
+            while current != self.goal:
+                current = min(self.successors(current),
+                              key=lambda step: step[1] +
+                              self.g.get(step[0], INFINITY))[0]
+                indices.append(current)
+
+        return Path.fromSpace(self.space, indices, self.theMap.grid,
+                              self.theMap.tileset)
+
+
+# unit testing
+class testDStarLite(unittest.TestCase):
+    def setUp(self):
+        import Map
+        self.theMap = Map.Map()
+        self.theMap.grid.passable[:] = True
+        self.theMap.grid.cost[:] = 0
+
+    def cost(self, path):
+        space = SearchSpace.fromGrid(self.theMap.grid)
+        total = 0
+        for (previous, current) in zip(path, path[1:]):
+            step = SQRT2 if (current.x != previous.x and
+                             current.y != previous.y) else 1
+            total += step * (1 + space.cost[space.index(current.x,
+                                                        current.y)])
+        return total
+
+    def optimal(self, start, goal):
+        space = SearchSpace.fromGrid(self.theMap.grid)
+        costs = AStar.dijkstra(space, [space.index(start.x, start.y)])
+        return costs.get(space.index(goal.x, goal.y))
+
+    def test_matchesAStar(self):
+        m = self.theMap
+        for y in range(0, 15):
+            m.grid.setPassable(8, y, False)
+
+        planner = DStarLite(m, m[2][2], m[14][3])
+        path = planner.getPath()
+        self.assertEqual((path[-1].x, path[-1].y), (14, 3))
+        self.assertAlmostEqual(self.cost(path),
+                               self.optimal(m[2][2], m[14][3]))
+        planner.close()
+
+    def test_replan(self):
+        m = self.theMap
+        planner = DStarLite(m, m[0][5], m[20][5])
+        planner.getPath()
+        for i in range(4):
+            planner.advance()
+        expanded = planner.expanded
+
+        # a wall goes up in front of the unit
+        for y in range(0, 12):
+            m.grid.setPassable(10, y, False)
+        m.grid.setCost(15, 5, 9)
+
+        path = planner.getPath()
+        self.assertEqual((path[0].x, path[0].y), (4, 5))
+        self.assertAlmostEqual(self.cost(path),
+                               self.optimal(m[4][5], m[20][5]))
+        self.assertGreater(planner.expanded, expanded)
+
+        for y in range(12, m.grid.height):
+            m.grid.setPassable(10, y, False)
+        self.assertEqual(len(planner.getPath()), 1)
+        self.assertIsNone(planner.nextStep())
+        planner.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,329 @@
+import unittest
+import numpy
+from pygame import Rect
+
+import config
+from GameEntity import GameEntity
+
+# slots the arrays start with, they double in size when full
+INITIAL_CAPACITY = 64
+
+
+class EntityStore:
+    """ Keeps the movement of many entities in arrays, one row an entity.
+
+        Positions, velocities, the steering force on each entity, its max
+        speed and its mass are numpy arrays, so update moves every entity
+        in one step: the steering is added to the velocity over the mass,
+        the velocity is cut down to the max speed, and the position moves
+        by it.
+
+        Positions in the store are floats and the entities' rects are only
+        written to when asked for, with sync for one entity, syncRect for
+        the entities in a rect like the viewport, or syncAll. Entities whose
+        rects are synced keep any SpatialIndex they are in up to date as
+        usual. The positions before the last update are kept too, so the
+        rects can be written part way between them and the positions now,
+        for drawing between the ticks of a GameLoop.
+
+        When an entity is removed its row is swapped with the last one, so
+        the rows in use are always 0 to len(store). Other systems can keep
+        their own arrays in step with the rows with addColumn. """
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.count = 0
+        self.capacity = 0
+        self.entities = []
+        self.slots = {}
+
+        # name -> (row shape, dtype, fill) of every array with a row an entity
+        self.columns = {}
+        for name in ('position', 'previous', 'velocity', 'steering', 'size'):
+            self.columns[name] = ((2,), numpy.float64, 0)
+        self.columns['maxSpeed'] = ((), numpy.float64, 0)
+        self.columns['mass'] = ((), numpy.float64, 1)
+        # rows that have moved since their entity's rect was written
+        self.columns['stale'] = ((), numpy.bool_, False)
+
+        self._allocate(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, entity):
+        return entity in self.slots
+
+    def __iter__(self):
+        return iter(self.entities)
+
+    def __repr__(self):
+        return 'EntityStore({} entities)'.format(self.count)
+
+    def _allocate(self, capacity):
+        """ Makes the arrays capacity rows long, keeping the rows in use """
+
+        for (name, (shape, dtype, fill)) in self.columns.items():
+            self._grow(name, (capacity,) + shape, dtype, fill)
+        self.capacity = capacity
+
+    def _grow(self, name, shape, dtype, fill):
+        array = numpy.full(shape, fill, dtype)
+        old = getattr(self, name, None)
+        if old is not None:
+            array[:self.count] = old[:self.count]
+        setattr(self, name, array)
+
+    def addColumn(self, name, shape=(), dtype=numpy.float64, fill=0):
+        """ Adds an array self.name with a row of shape for each entity,
+            which grows and has its rows moved along with the store's own.
+            New rows are set to fill. The array is replaced when the store
+            grows, so look it up again after adding entities """
+
+        if name in self.columns:
+            raise Exception("The store already has a column " + name)
+
+        self.columns[name] = (tuple(shape), dtype, fill)
+        self._grow(name, (self.capacity,) + tuple(shape), dtype, fill)
+
+    def add(self, entity, velocity=(0, 0), maxSpeed=config.ENTITY_MAX_SPEED,
+            mass=config.ENTITY_MASS):
+        """ Adds an entity at the position of its rect
+
+            @return the entity's row """
+
+        if entity in self.slots:
+            raise Exception("Entity is already in the store")
+
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+
+        slot = self.count
+        for (name, (shape, dtype, fill)) in self.columns.items():
+            getattr(self, name)[slot] = fill
+
+        rect = GameEntity.getRect(entity)
+        self.position[slot] = (rect.x, rect.y)
+        self.previous[slot] = (rect.x, rect.y)
+        self.velocity[slot] = (velocity[0], velocity[1])
+        self.size[slot] = (rect.width, rect.height)
+        self.maxSpeed[slot] = maxSpeed
+        self.mass[slot] = mass
+
+        self.entities.append(entity)
+        self.slots[entity] = slot
+        self.count += 1
+        return slot
+
+    def remove(self, entity):
+        """ Removes an entity, writing its position to its rect first """
+
+        self.sync(entity)
+        slot = self.slots.pop(entity)
+        last = self.count - 1
+
+        if slot != last:
+            for name in self.columns:
+                array = getattr(self, name)
+                array[slot] = array[last]
+
+            moved = self.entities[last]
+            self.entities[slot] = moved
+            self.slots[moved] = slot
+
+        self.entities.pop()
+        self.count = last
+
+    def slotOf(self, entity):
+        return self.slots[entity]
+
+    def setPosition(self, entity, x, y):
+        slot = self.slots[entity]
+        self.position[slot] = (x, y)
+        self.previous[slot] = (x, y)
+        self.stale[slot] = True
+
+    def getPosition(self, entity):
+        """ Returns the exact position of an entity, as an (x, y) tuple """
+
+        (x, y) = self.position[self.slots[entity]].tolist()
+        return (x, y)
+
+    def setVelocity(self, entity, velocity):
+        self.velocity[self.slots[entity]] = (velocity[0], velocity[1])
+
+    def getVelocity(self, entity):
+        (x, y) = self.velocity[self.slots[entity]].tolist()
+        return (x, y)
+
+    def setMaxSpeed(self, entity, maxSpeed):
+        self.maxSpeed[self.slots[entity]] = maxSpeed
+
+    def setMass(self, entity, mass):
+        self.mass[self.slots[entity]] = mass
+
+    def addSteering(self, entity, force):
+        """ Adds a force to what steers an entity in the next update """
+
+        self.steering[self.slots[entity]] += (force[0], force[1])
+
+    def update(self, dt=1.0):
+        """ Moves every entity by dt ticks, in one go, and clears the
+            steering for the next update """
+
+        n = self.count
+        if not n:
+            return
+
+        velocity = self.velocity[:n]
+        steering = self.steering[:n]
+
+        velocity += steering / self.mass[:n, None]
+
+        # cut the speeds over the max down to it
+        speed = numpy.hypot(velocity[:, 0], velocity[:, 1])
+        maxSpeed = self.maxSpeed[:n]
+        over = speed > maxSpeed
+        if over.any():
+            velocity[over] *= (maxSpeed[over] / speed[over])[:, None]
+
+        moving = speed > 0
+        self.previous[:n] = self.position[:n]
+        self.position[:n] += velocity * dt
+        self.stale[:n] |= moving
+        steering[:] = 0
+
+    def sync(self, entity, alpha=1.0):
+        """ Writes an entity's position to its rect, if it has moved. With
+            alpha under 1 the position written is that far from the one
+            before the last update to the one now """
+
+        slot = self.slots[entity]
+        if self.stale[slot]:
+            self._write(numpy.array([slot]), alpha)
+
+    def syncRect(self, rect, alpha=1.0):
+        """ Writes the positions of the entities overlapping rect, such as
+            the viewport's, to their rects, as sync does
+
+            @return the entities overlapping rect """
+
+        rect = Rect(rect)
+        n = self.count
+        position = self.position[:n]
+        size = self.size[:n]
+        inside = ((position[:, 0] < rect.right) &
+                  (position[:, 0] + size[:, 0] > rect.left) &
+                  (position[:, 1] < rect.bottom) &
+                  (position[:, 1] + size[:, 1] > rect.top))
+
+        slots = numpy.flatnonzero(inside)
+        self._write(slots[self.stale[slots]], alpha)
+        return [self.entities[slot] for slot in slots.tolist()]
+
+    def syncAll(self, alpha=1.0):
+        self._write(numpy.flatnonzero(self.stale[:self.count]), alpha)
+
+    def _write(self, slots, alpha=1.0):
+        if not len(slots):
+            return
+
+        positions = self.position[slots]
+        if alpha < 1:
+            previous = self.previous[slots]
+            positions = previous + (positions - previous) * alpha
+        positions = numpy.floor(positions).astype(numpy.int64)
+        for (slot, (x, y)) in zip(slots.tolist(), positions.tolist()):
+            # the GameEntity method, as an entity in a store can read its
+            # position from the store when it's asked for
+            GameEntity.setPosition(self.entities[slot], x, y)
+
+        if alpha >= 1:
+            self.stale[slots] = False
+
+
+# unit testing
+class testEntityStore(unittest.TestCase):
+    def makeEntity(self, x, y, size=10):
+        entity = GameEntity()
+        entity.setPosition(x, y)
+        entity.setDimensions(size, size)
+        return entity
+
+    def test_update(self):
+        store = EntityStore(2)
+        entities = [self.makeEntity(i * 100, 0) for i in range(5)]
+        for entity in entities:
+            store.add(entity, maxSpeed=5, mass=2)
+
+        store.setVelocity(entities[0], (3, 4))
+        store.addSteering(entities[1], (4, 0))
+        store.addSteering(entities[2], (100, 0))
+        store.update()
+
+        self.assertEqual(store.getPosition(entities[0]), (3, 4))
+        self.assertEqual(store.getPosition(entities[1]), (102, 0))
+        # cut down to the max speed
+        self.assertEqual(store.getPosition(entities[2]), (205, 0))
+        self.assertEqual(store.getVelocity(entities[1]), (2, 0))
+
+        # the steering is used up
+        store.update()
+        self.assertEqual(store.getPosition(entities[1]), (104, 0))
+
+    def test_sync(self):
+        store = EntityStore()
+        near = self.makeEntity(0, 0)
+        far = self.makeEntity(1000, 1000)
+        store.add(near, (1.5, 1.5))
+        store.add(far, (1.5, 1.5))
+        store.update()
+
+        # rects are only written when asked for
+        self.assertEqual(near.getRect().topleft, (0, 0))
+        self.assertEqual(store.syncRect(Rect(0, 0, 100, 100)), [near])
+        self.assertEqual(near.getRect().topleft, (1, 1))
+        self.assertEqual(far.getRect().topleft, (1000, 1000))
+
+        store.sync(far)
+        self.assertEqual(far.getRect().topleft, (1001, 1001))
+
+        # drawn part way between the last two updates
+        store.update()
+        store.sync(near, 0.5)
+        self.assertEqual(near.getRect().topleft, (2, 2))
+        store.sync(near)
+        self.assertEqual(near.getRect().topleft, (3, 3))
+
+    def test_remove(self):
+        store = EntityStore()
+        entities = [self.makeEntity(i, 0) for i in range(3)]
+        for entity in entities:
+            store.add(entity, (1, 0))
+
+        store.update()
+        store.remove(entities[0])
+        self.assertEqual(len(store), 2)
+        self.assertEqual(entities[0].getRect().x, 1)
+        self.assertEqual(store.slotOf(entities[2]), 0)
+        self.assertEqual(store.getPosition(entities[2]), (3, 0))
+
+        store.update()
+        store.syncAll()
+        self.assertEqual([e.getRect().x for e in entities], [1, 3, 4])
+
+    def test_addColumn(self):
+        store = EntityStore(1)
+        store.addColumn('target', (2,), fill=-1)
+        entities = [self.makeEntity(i, 0) for i in range(3)]
+        for (i, entity) in enumerate(entities):
+            slot = store.add(entity)
+            store.target[slot] = (i, i)
+
+        store.remove(entities[0])
+        self.assertEqual(store.target[:2].tolist(), [[2, 2], [1, 1]])
+
+        store.add(entities[0])
+        self.assertEqual(store.target[2].tolist(), [-1, -1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+import unittest
+import numpy
+
+import AStar
+import MovementProfile
+from SearchSpace import SearchSpace
+
+# the direction of a cell with nowhere to go, a goal or an unreachable cell
+NO_DIRECTION = -1
+
+
+class FlowField:
+    """ The cheapest way to a goal from every cell of a search space.
+
+        One Dijkstra search out from the goals gives the cost of getting to
+        the nearest goal from every cell (the integration field), then the
+        best neighbour to step to from each cell is worked out for the
+        whole space at once. Any number of units can then follow the field
+        with one lookup per step, instead of a path search each.
+
+        Positions are in map co-ords, the field works out where they fall
+        in its search space."""
+
+    def __init__(self, space, goals, profile=MovementProfile.DEFAULT):
+        """ goals are flat indices of the search space, impassable ones are
+            left out as nothing can arrive at them """
+
+        self.space = space
+        self.goals = tuple(goal for goal in goals if space.passable[goal])
+        self.profile = profile
+
+        shape = (space.width, space.height)
+        self.costs = numpy.full(shape[0] * shape[1], numpy.inf)
+        reached = AStar.dijkstra(space, self.goals, profile, reverse=True)
+        self.costs[numpy.fromiter(reached, numpy.int64, len(reached))] = \
+            numpy.fromiter(reached.values(), numpy.float64, len(reached))
+        self.costs = self.costs.reshape(shape)
+
+        self.directions = self._directions()
+
+    def __repr__(self):
+        return 'FlowField({} goals, {} cells reached)'.format(
+            len(self.goals), self.reachedCount())
+
+    def reachedCount(self):
+        return int(numpy.isfinite(self.costs).sum())
+
+    def reached(self):
+        """ Returns the flat indices of the cells that can reach a goal """
+
+        return numpy.flatnonzero(numpy.isfinite(self.costs))
+
+    def _local(self, x, y):
+        if self.space.contains(x, y):
+            return (x - self.space.originX, y - self.space.originY)
+
+        return None
+
+    def getCost(self, x, y):
+        """ Returns the cost of getting from x, y to the nearest goal, or
+            infinity if it can't """
+
+        local = self._local(x, y)
+        if local is None:
+            return numpy.inf
+
+        return float(self.costs[local])
+
+    def getNext(self, x, y):
+        """ Returns the x, y to step to from x, y, or None at a goal or where
+            no goal can be reached """
+
+        local = self._local(x, y)
+        if local is None:
+            return None
+
+        direction = self.directions[local]
+        if direction == NO_DIRECTION:
+            return None
+
+        (dx, dy, distance) = self.profile.offsets[direction]
+        return (x + dx, y + dy)
+
+    def getPath(self, x, y):
+        """ Returns the x, y positions from x, y to the nearest goal, or just
+            x, y if it can't reach one """
+
+        path = [(x, y)]
+        seen = set(path)
+        position = self.getNext(x, y)
+        while position is not None and position not in seen:
+            path.append(position)
+            seen.add(position)
+            position = self.getNext(*position)
+
+        return path
+
+    def _directions(self):
+        """ Finds the best neighbour of every cell, as an index into the
+            profile's offsets """
+
+        space = self.space
+        shape = (space.width, space.height)
+        passable = numpy.asarray(space.passable, numpy.bool_).reshape(shape)
+        cost = numpy.asarray(space.cost, numpy.float64).reshape(shape)
+
+        candidates = numpy.full((len(self.profile.offsets),) + shape, numpy.inf)
+        for (k, (dx, dy, distance)) in enumerate(self.profile.offsets):
+            ahead = shifted(passable, dx, dy, False)
+            if dx and dy and not self.profile.cutCorners:
+                ahead &= shifted(passable, dx, 0, False)
+                ahead &= shifted(passable, 0, dy, False)
+
+            # the cost from a cell is the step onto the neighbour plus the
+            # neighbour's cost to the goal
+            step = distance * (1 + shifted(cost, dx, dy, 0))
+            candidates[k][ahead] = (step + shifted(self.costs, dx, dy,
+                                                   numpy.inf))[ahead]
+
+        directions = candidates.argmin(axis=0).astype(numpy.int8)
+        stuck = (numpy.isinf(candidates.min(axis=0)) | (self.costs == 0) |
+                 ~passable)
+        directions[stuck] = NO_DIRECTION
+        return directions
+
+
+def shifted(array, dx, dy, fill):
+    """ Returns an array where [x, y] is array[x + dx, y + dy], or fill off
+        the edge """
+
+    result = numpy.full_like(array, fill)
+    (width, height) = array.shape
+    result[max(0, -dx):width - max(0, dx), max(0, -dy):height - max(0, dy)] = \
+        array[max(0, dx):width - max(0, -dx), max(0, dy):height - max(0, -dy)]
+    return result
+
+
+# unit testing
+class testFlowField(unittest.TestCase):
+    def makeSpace(self, rows):
+        """ Makes a search space from rows of text, # is impassable and a
+            digit is the cost of the cell """
+
+        width = len(rows[0])
+        height = len(rows)
+        passable = [rows[y][x] != '#' for x in range(width)
+                    for y in range(height)]
+        cost = [int(rows[y][x]) if rows[y][x].isdigit() else 0
+                for x in range(width) for y in range(height)]
+        return SearchSpace(passable, cost, width, height)
+
+    def test_matchesAStar(self):
+        space = self.makeSpace(["......",
+                                ".####.",
+                                "...9#.",
+                                "..#...",
+                                "......"])
+        goal = space.index(5, 2)
+        field = FlowField(space, [goal])
+
+        for start in ((0, 0), (0, 4), (3, 3)):
+            path = AStar.search(space, space.index(*start), goal)
+            best = AStar.dijkstra(space, [space.index(*start)])[goal]
+            self.assertAlmostEqual(field.getCost(*start), best)
+            self.assertEqual(field.getPath(*start)[-1], (5, 2))
+            self.assertEqual(len(field.getPath(*start)), len(path))
+
+        self.assertIsNone(field.getNext(5, 2))
+
+    def test_nearestGoal(self):
+        space = self.makeSpace([".........."])
+        field = FlowField(space, [space.index(0, 0), space.index(9, 0)])
+
+        self.assertEqual(field.getNext(2, 0), (1, 0))
+        self.assertEqual(field.getNext(7, 0), (8, 0))
+
+    def test_unreachable(self):
+        space = self.makeSpace(["..#.."])
+        field = FlowField(space, [space.index(0, 0)])
+
+        self.assertIsNone(field.getNext(4, 0))
+        self.assertEqual(field.getPath(4, 0), [(4, 0)])
+        self.assertEqual(field.getCost(4, 0), numpy.inf)
+        self.assertEqual(field.reachedCount(), 2)
+
+    def test_impassableGoal(self):
+        space = self.makeSpace(["......",
+                                "......",
+                                "..#...",
+                                "......"])
+        field = FlowField(space, [space.index(2, 2)])
+
+        self.assertEqual(field.goals, ())
+        self.assertEqual(field.reachedCount(), 0)
+        self.assertIsNone(field.getNext(1, 1))
+        self.assertEqual(field.getPath(0, 0), [(0, 0)])
+
+        # the passable goals of a list are still used
+        field = FlowField(space, [space.index(2, 2), space.index(5, 3)])
+        self.assertEqual(field.getPath(3, 3)[-1], (5, 3))
+
+if __name__ == "__main__":
+    unittest.main()
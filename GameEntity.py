@@ -1,3 +1,4 @@
+import math
 import pygame
 import pygame.locals as locals
 import unittest
@@ -5,10 +6,16 @@ from Vector import Vec2d
 
 
 class GameEntity:
+    # the SpatialIndex the entity is in, if any, told when it moves
+    _spatialIndex = None
+
     def __init__(self):
         self._rect = locals.Rect(0, 0, 0, 0)
         self._image = None
 
+    def setSpatialIndex(self, index):
+        self._spatialIndex = index
+
     def setPosition(self, xOrVec, y=None):
         """ Set the position of the game entity, in global co-ords. _
         Can supply x and y, or a Vector """
@@ -20,20 +27,40 @@ class GameEntity:
             self._rect.x = xOrVec
             self._rect.y = y
 
+        if (self._spatialIndex is not None):
+            self._spatialIndex.update(self)
+
     def move(self, xOrVec, y=None):
         """ Moves the position of the game entity by the given offset. _
         Can supply x and y, or a Vector """
 
         if (y is None):
-            self.setPosition(self.getPosition() + xOrVec)
+            self.translate(xOrVec[0], xOrVec[1])
         else:
-            self._rect.x += xOrVec
-            self._rect.y += y
+            self.translate(xOrVec, y)
+
+    def translate(self, dx, dy):
+        """ Moves the game entity by dx, dy, changing its rect in place """
+
+        rect = self._rect
+        rect.x += dx
+        rect.y += dy
+
+        if (self._spatialIndex is not None):
+            self._spatialIndex.update(self)
 
     def getPosition(self):
         """ Gets the current position of the game entity, as a Vector2D """
         return Vec2d(self._rect.x, self._rect.y)
 
+    def getX(self):
+        """ Gets the x of the position, without making a Vector """
+        return self._rect.x
+
+    def getY(self):
+        """ Gets the y of the position, without making a Vector """
+        return self._rect.y
+
     def getCentre(self):
         """ returns the centre point of the cell as a vector """
 
@@ -49,6 +76,9 @@ class GameEntity:
         if height:
             self._rect.height = height
 
+        if (self._spatialIndex is not None):
+            self._spatialIndex.update(self)
+
     def getRect(self):
         """ Returns a rect representing the game entity """
 
@@ -72,25 +102,16 @@ class GameEntity:
     def draw(self, viewport):
         """ blits and image to the passed viewport, to its current position """
 
-        viewport.draw(self.getImage(), self.getPosition())
+        # a rect indexes as x, y so it can be passed as the position as is
+        viewport.draw(self.getImage(), self._rect)
 
     def distanceTo(self, other):
-        vec = None
-
-        if (hasattr(other, 'getPosition')):
+        if (hasattr(other, 'getRect')):
             # other is a GameEntity
-            vec = other.getPosition()
-        elif (hasattr(other, '__slots__')):
-            # other is a Vec2d
-            vec = other
-        else:
-            # other is a tuple
-            vec = Vec2d(other[0], other[1])
-
-        if (vec is None):
-            raise AttributeError
+            other = other.getRect()
 
-        return (vec - self.getPosition()).get_length()
+        # a Vec2d, tuple or rect all index as x, y
+        return math.hypot(other[0] - self._rect.x, other[1] - self._rect.y)
 
 
 # unit testing
@@ -147,6 +168,10 @@ class testGameEntity(unittest.TestCase):
         vp.move(10, 10)
         self.assertEqual(vp.getPosition(), Vec2d(10, 10))
 
+        vp.move(Vec2d(-5, 2))
+        vp.translate(1, 1)
+        self.assertEqual((vp.getX(), vp.getY()), (6, 13))
+
     def test_setImage(self):
         ge = GameEntity()
         ge.setImage("mario.png")
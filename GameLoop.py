@@ -0,0 +1,280 @@
+import time
+import unittest
+
+import config
+
+"""
+ A fixed timestep loop with interpolated rendering, see:
+  https://gafferongames.com/post/fix_your_timestep/
+"""
+
+
+class System:
+    """ Something the GameLoop runs, with the time it has taken so far """
+
+    def __init__(self, name, update, every=1, phase=0, budget=None,
+                 sliced=False):
+        self.name = name
+        self.update = update
+        self.every = every
+        self.phase = phase
+        self.budget = budget
+        self.sliced = sliced
+
+        self.calls = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.overruns = 0
+
+    def __repr__(self):
+        return 'System({}, every {}, {} calls)'.format(self.name, self.every,
+                                                      self.calls)
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        self.worst = max(self.worst, elapsed)
+        if self.budget is not None and elapsed > self.budget:
+            self.overruns += 1
+
+    def stats(self):
+        return {'calls': self.calls,
+                'total': self.total,
+                'mean': self.total / self.calls if self.calls else 0.0,
+                'worst': self.worst,
+                'overruns': self.overruns}
+
+
+class GameLoop:
+    """ Runs the simulation in fixed ticks, however long frames take.
+
+        Each frame the real time since the last one is added up and as
+        many ticks of 1 / tickRate seconds as fit in it are run, up to
+        maxTicks, so the simulation runs at the same speed at any frame
+        rate. Then the renderers draw once, given alpha, how far the time
+        left over is into the next tick, so they can draw between the last
+        two ticks' positions.
+
+        Systems run on ticks, and slow ones like pathfinding or AI can run
+        every few ticks instead of every one; systems with the same every
+        are given different phases so they don't all land on the same
+        tick. Each system can have a budget in seconds. A sliced system is
+        given a deadline to stop by, the others just count the times they
+        go over. The time each system and each frame takes is kept, see
+        stats and report."""
+
+    def __init__(self, tickRate=config.TICK_RATE,
+                 maxTicks=config.MAX_TICKS_PER_FRAME,
+                 frameLimit=config.FRAME_RATE_LIMIT, timer=time.perf_counter):
+        self.dt = 1.0 / tickRate
+        self.maxTicks = maxTicks
+        self.frameLimit = frameLimit
+        self.timer = timer
+
+        self.systems = []
+        self.renderers = []
+
+        self.tick = 0
+        self.accumulator = 0.0
+        self.lastTime = None
+        self.alpha = 0.0
+        self.running = False
+
+        # the time of whole frames, and the ticks dropped when frames are
+        # too slow to catch up
+        self.frames = System('frame', None)
+        self.dropped = 0
+
+    def __repr__(self):
+        return 'GameLoop({} ticks a second, tick {})'.format(
+            int(round(1 / self.dt)), self.tick)
+
+    def addSystem(self, name, update, every=1, budget=None, sliced=False):
+        """ Adds a system run every few ticks as update(dt), where dt is the
+            simulation time in seconds since it last ran. A sliced system
+            is run as update(dt, deadline), and should stop once
+            loop.timer() passes deadline. Without a budget the deadline is
+            None, for no limit
+
+            @return the System """
+
+        phase = sum(1 for system in self.systems
+                    if system.every == every) % every
+        system = System(name, update, every, phase, budget, sliced)
+        self.systems.append(system)
+        return system
+
+    def addRenderer(self, name, draw, budget=None):
+        """ Adds something that draws each frame, as draw(alpha) """
+
+        renderer = System(name, draw, budget=budget)
+        self.renderers.append(renderer)
+        return renderer
+
+    def step(self):
+        """ Runs one tick of the systems that are due """
+
+        for system in self.systems:
+            if (self.tick - system.phase) % system.every == 0:
+                self._run(system, self.dt * system.every)
+
+        self.tick += 1
+
+    def _run(self, system, argument):
+        start = self.timer()
+        if system.sliced:
+            deadline = None
+            if system.budget is not None:
+                deadline = start + system.budget
+            system.update(argument, deadline)
+        else:
+            system.update(argument)
+        system.record(self.timer() - start)
+
+    def frame(self):
+        """ Runs the ticks that are due and draws once
+
+            @return the number of ticks run """
+
+        start = self.timer()
+        if self.lastTime is None:
+            self.lastTime = start
+        self.accumulator += start - self.lastTime
+        self.lastTime = start
+
+        ticks = 0
+        while self.accumulator >= self.dt and ticks < self.maxTicks:
+            self.step()
+            self.accumulator -= self.dt
+            ticks += 1
+
+        if self.accumulator >= self.dt:
+            # too far behind to catch up, the simulation slows down instead
+            behind = int(self.accumulator // self.dt)
+            self.dropped += behind
+            self.accumulator -= behind * self.dt
+
+        self.alpha = self.accumulator / self.dt
+        for renderer in self.renderers:
+            self._run(renderer, self.alpha)
+
+        self.frames.record(self.timer() - start)
+        return ticks
+
+    def run(self):
+        """ Runs frames until stop is called, no more than frameLimit a
+            second """
+
+        self.running = True
+        while self.running:
+            start = self.timer()
+            self.frame()
+
+            if self.frameLimit:
+                wait = 1.0 / self.frameLimit - (self.timer() - start)
+                if wait > 0:
+                    time.sleep(wait)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        """ Returns the time taken by each system and renderer, and by the
+            frames as a whole """
+
+        result = dict((system.name, system.stats())
+                      for system in self.systems + self.renderers)
+        result['frame'] = self.frames.stats()
+        result['frame']['dropped'] = self.dropped
+        return result
+
+    def report(self):
+        """ Returns a line for each system of where the frames' time went """
+
+        lines = []
+        for system in [self.frames] + self.systems + self.renderers:
+            stats = system.stats()
+            lines.append('{:<12} {:>6} calls {:8.3f}ms mean {:8.3f}ms worst '
+                         '{:>4} over'.format(system.name, stats['calls'],
+                                             stats['mean'] * 1000,
+                                             stats['worst'] * 1000,
+                                             stats['overruns']))
+        return '\n'.join(lines)
+
+
+# unit testing
+class testGameLoop(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.loop = GameLoop(10, 3, timer=lambda: self.now)
+
+    def test_fixedTicks(self):
+        loop = self.loop
+        ticks = []
+        alphas = []
+        loop.addSystem('sim', lambda dt: ticks.append(dt))
+        loop.addRenderer('draw', alphas.append)
+
+        loop.frame()
+        for delta in (0.25, 0.1, 0.02):
+            self.now += delta
+            loop.frame()
+
+        self.assertEqual(len(ticks), 3)
+        self.assertAlmostEqual(ticks[0], 0.1)
+        self.assertEqual(len(alphas), 4)
+        self.assertAlmostEqual(alphas[-1], 0.7)
+
+    def test_every(self):
+        loop = self.loop
+        calls = {'a': [], 'b': [], 'c': []}
+        for name in 'abc':
+            loop.addSystem(name, lambda dt, name=name:
+                           calls[name].append(loop.tick), every=2)
+
+        for tick in range(6):
+            loop.step()
+
+        self.assertEqual(calls['a'], [0, 2, 4])
+        self.assertEqual(calls['b'], [1, 3, 5])
+        self.assertEqual(calls['c'], [0, 2, 4])
+
+    def test_catchUp(self):
+        loop = self.loop
+        loop.addSystem('sim', lambda dt: None)
+        loop.frame()
+        self.now += 1.0
+
+        self.assertEqual(loop.frame(), 3)
+        self.assertEqual(loop.stats()['frame']['dropped'], 7)
+
+    def test_budget(self):
+        loop = self.loop
+        deadlines = []
+
+        def slow(dt):
+            self.now += 0.05
+
+        loop.addSystem('slow', slow, budget=0.01)
+        loop.addSystem('sliced', lambda dt, deadline: deadlines.append(
+            deadline - self.now), budget=0.02, sliced=True)
+        loop.step()
+
+        stats = loop.stats()
+        self.assertEqual(stats['slow']['overruns'], 1)
+        self.assertAlmostEqual(stats['slow']['worst'], 0.05)
+        self.assertAlmostEqual(deadlines[0], 0.02)
+        self.assertIn('slow', loop.report())
+
+    def test_slicedWithoutBudget(self):
+        loop = self.loop
+        deadlines = []
+        loop.addSystem('sliced', lambda dt, deadline: deadlines.append(
+            deadline), sliced=True)
+        loop.step()
+
+        self.assertEqual(deadlines, [None])
+        self.assertEqual(loop.stats()['sliced']['overruns'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,207 @@
+import unittest
+import numpy
+
+import config
+from Terrain import classify
+
+# the arrays that hold the terrain, the dirty flags are only for drawing
+LAYERS = ('terrainHeight', 'terrain', 'cost', 'passable')
+
+class Grid:
+    """ Stores the terrain of a map in contiguous arrays, indexed by (x, y).
+
+        Each cell takes six bytes (height, terrain type, cost, passable and
+        dirty flags), so a 4096x4096 map is around 100MB instead of a
+        python object with a rect and a vector per cell.
+
+        layers can give the terrainHeight, terrain, cost and passable arrays
+        to use instead of new ones, such as memory maps of a MapFile."""
+
+    def __init__(self, width, height, layers=None):
+        self.width = width
+        self.height = height
+
+        shape = (width, height)
+        if layers is None:
+            self.terrainHeight = numpy.zeros(shape, numpy.float16)
+            self.terrain = numpy.full(shape, config.TERRAIN_GRASS,
+                                      numpy.uint8)
+            self.cost = numpy.zeros(shape, numpy.uint8)
+            self.passable = numpy.ones(shape, numpy.bool_)
+        else:
+            for name in LAYERS:
+                setattr(self, name, layers[name])
+        self.dirty = numpy.ones(shape, numpy.bool_)
+
+        # the cost + 1 of each passable cell, 0 for impassable ones, and how
+        # many cells have each, made the first time uniformCost is asked
+        self._costLevels = None
+        self._costCounts = None
+
+        self.listeners = []
+
+    def __repr__(self):
+        return 'Grid({}, {})'.format(self.width, self.height)
+
+    def inBounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def index(self, x, y):
+        """ Returns the flat index of a cell, as used by the raveled arrays """
+
+        return x * self.height + y
+
+    def position(self, index):
+        """ Returns the (x, y) of a flat index """
+
+        return divmod(index, self.height)
+
+    def addListener(self, listener):
+        """ Adds a function to be called with (x_min, x_max, y_min, y_max)
+            whenever the terrain, passability or cost of cells in that range
+            changes """
+
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+        self.listeners.remove(listener)
+
+    def changed(self, x_min, x_max, y_min, y_max):
+        """ Tells the listeners that a range of cells has changed """
+
+        if self._costLevels is not None:
+            block = (slice(x_min, x_max), slice(y_min, y_max))
+            levels = self._levels(block)
+            self._costCounts -= numpy.bincount(
+                self._costLevels[block].ravel(), minlength=257)
+            self._costCounts += numpy.bincount(levels.ravel(), minlength=257)
+            self._costLevels[block] = levels
+
+        for listener in self.listeners:
+            listener(x_min, x_max, y_min, y_max)
+
+    def uniformCost(self):
+        """ Checks if every passable cell costs the same. The costs are
+            counted the first time, then kept up to date as cells change """
+
+        if self._costLevels is None:
+            self._costLevels = self._levels((slice(None), slice(None)))
+            self._costCounts = numpy.bincount(self._costLevels.ravel(),
+                                              minlength=257)
+
+        return numpy.count_nonzero(self._costCounts[1:]) <= 1
+
+    def _levels(self, block):
+        return numpy.where(self.passable[block],
+                           self.cost[block].astype(numpy.uint16) + 1,
+                           numpy.uint16(0))
+
+    def generate(self, generator):
+        """ Fills the whole grid from a terrain generator """
+
+        generator.generate(self)
+
+    def setTerrainHeight(self, x, y, terrainHeight):
+        """ Sets the height of a cell, and the terrain type that goes with it """
+
+        (terrain, passable, cost) = classify(terrainHeight)
+
+        self.terrainHeight[x, y] = terrainHeight
+        self.terrain[x, y] = terrain
+        self.passable[x, y] = passable
+        self.cost[x, y] = cost
+        self.changed(x, x + 1, y, y + 1)
+
+    def setBlock(self, x, y, terrainHeights):
+        """ Sets the heights of a block of cells starting at x, y, and
+            classifies the whole block at once """
+
+        (width, height) = terrainHeights.shape
+        block = (slice(x, x + width), slice(y, y + height))
+        (terrain, passable, cost) = classify(terrainHeights)
+
+        self.terrainHeight[block] = terrainHeights
+        self.terrain[block] = terrain
+        self.passable[block] = passable
+        self.cost[block] = cost
+        self.dirty[block] = True
+        self.changed(x, x + width, y, y + height)
+
+    def setPassable(self, x, y, passable):
+        self.passable[x, y] = passable
+        self.changed(x, x + 1, y, y + 1)
+
+    def setCost(self, x, y, cost):
+        self.cost[x, y] = cost
+        self.changed(x, x + 1, y, y + 1)
+
+    def setDirty(self, x, y, isDirty):
+        self.dirty[x, y] = isDirty
+
+    def nbytes(self):
+        """ Returns the memory used by the grid's arrays """
+
+        return (self.terrainHeight.nbytes + self.terrain.nbytes +
+                self.cost.nbytes + self.passable.nbytes + self.dirty.nbytes)
+
+
+# unit testing
+class testGrid(unittest.TestCase):
+    def test_index(self):
+        grid = Grid(10, 20)
+
+        self.assertEqual(grid.index(3, 4), 64)
+        self.assertEqual(grid.position(64), (3, 4))
+        self.assertEqual(grid.passable.ravel()[grid.index(3, 4)],
+                         grid.passable[3, 4])
+
+    def test_setTerrainHeight(self):
+        grid = Grid(2, 2)
+        grid.setTerrainHeight(0, 1, 25)
+        grid.setTerrainHeight(1, 0, 15)
+
+        self.assertTrue(grid.passable[0, 1])
+        self.assertEqual(grid.terrain[0, 1], config.TERRAIN_GRASS)
+        self.assertFalse(grid.passable[1, 0])
+        self.assertEqual(grid.terrain[1, 0], config.TERRAIN_WATER)
+
+    def test_listeners(self):
+        grid = Grid(4, 4)
+        changes = []
+        grid.addListener(lambda *change: changes.append(change))
+
+        grid.setPassable(1, 2, False)
+        grid.setDirty(3, 3, False)
+        grid.setBlock(0, 2, numpy.zeros((2, 2)))
+
+        self.assertEqual(changes, [(1, 2, 2, 3), (0, 2, 2, 4)])
+
+    def test_uniformCost(self):
+        grid = Grid(4, 4)
+        self.assertTrue(grid.uniformCost())
+
+        grid.setCost(1, 1, 3)
+        self.assertFalse(grid.uniformCost())
+
+        # impassable cells don't count
+        grid.setPassable(1, 1, False)
+        self.assertTrue(grid.uniformCost())
+
+        grid.setBlock(0, 0, numpy.full((4, 4), 25.0))
+        self.assertTrue(grid.uniformCost())
+
+    def test_setBlock(self):
+        grid = Grid(3, 3)
+        grid.setBlock(1, 1, numpy.array([[25.0, 15.0], [15.0, 25.0]]))
+
+        self.assertEqual(grid.passable.tolist(), [[True, True, True],
+                                                  [True, True, False],
+                                                  [True, False, True]])
+
+    def test_nbytes(self):
+        grid = Grid(4096, 4096)
+
+        self.assertEqual(grid.nbytes(), 4096 * 4096 * 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,488 @@
+import heapq
+import unittest
+import numpy
+
+import config
+import AStar
+import MovementProfile
+from Grid import Grid
+from SearchSpace import SearchSpace
+from helpers import octile
+
+"""
+ Hierarchical pathfinding (HPA*), from:
+  Botea, Muller and Schaeffer, Near Optimal Hierarchical Path-Finding
+"""
+
+# entrances wider than this get a transition at each end, narrower ones get
+# one in the middle
+MAX_ENTRANCE_WIDTH = 6
+
+
+class HierarchicalPathfinder:
+    """ Finds long paths on an abstract graph of the map first.
+
+        The grid is split into square clusters. Where two clusters touch
+        and both sides are passable there is an entrance, and each entrance
+        has one or two transitions, pairs of cells either side of the border
+        that become nodes of the abstract graph. Inside each cluster the
+        cost between every pair of its nodes is worked out in advance.
+
+        A query links the start and goal into the graph, searches the graph,
+        then only refines the parts of it that are used into cells, each
+        with a small search inside one cluster. The paths are within a few
+        percent of the shortest.
+
+        When cells change only the clusters around them are rebuilt, the
+        next time a path is asked for. The graph can be saved as arrays with
+        toArrays, and given back as arrays to skip building it again."""
+
+    def __init__(self, grid, clusterSize=config.CLUSTER_SIZE,
+                 profile=MovementProfile.DEFAULT, arrays=None):
+        self.grid = grid
+        self.clusterSize = clusterSize
+        self.profile = profile
+
+        self.clustersWide = -(-grid.width // clusterSize)
+        self.clustersHigh = -(-grid.height // clusterSize)
+
+        # (cx, cy, 'x' or 'y') -> list of (node, node) transitions across the
+        # border with the next cluster along x or y
+        self.borders = {}
+        # node -> list of (node, cost) across the borders
+        self.inter = {}
+        # cluster -> {node: {node: cost}} within the cluster
+        self.intra = {}
+
+        self.dirty = set((cx, cy) for cx in range(self.clustersWide)
+                         for cy in range(self.clustersHigh))
+        self.rebuilt = 0
+
+        grid.addListener(self.cellsChanged)
+        if arrays is None:
+            self.update()
+        else:
+            self._restore(arrays)
+
+    def __repr__(self):
+        return 'HierarchicalPathfinder({} clusters, {} nodes)'.format(
+            self.clustersWide * self.clustersHigh,
+            sum(len(nodes) for nodes in self.intra.values()))
+
+    def cellsChanged(self, x_min, x_max, y_min, y_max):
+        """ Marks the clusters a change can affect as needing a rebuild, a
+            cell on a cluster's edge changes the entrances next to it too """
+
+        size = self.clusterSize
+        for cx in range(max(0, (x_min - 1) // size),
+                        min(self.clustersWide, x_max // size + 1)):
+            for cy in range(max(0, (y_min - 1) // size),
+                            min(self.clustersHigh, y_max // size + 1)):
+                self.dirty.add((cx, cy))
+
+    def toArrays(self):
+        """ Returns the graph as arrays, after any rebuilds that are due:
+
+            borders, (cx, cy, 0 across x or 1 across y, node, node) for each
+            transition; nodes, (cx, cy, node) for each node of a cluster;
+            edges, (node, node) for each cost worked out within a cluster,
+            and costs, the costs of the edges """
+
+        self.update()
+
+        borders = [(cx, cy, 0 if axis == 'x' else 1, node, other)
+                   for ((cx, cy, axis), transitions) in self.borders.items()
+                   for (node, other) in transitions]
+        nodes = [(cx, cy, node)
+                 for ((cx, cy), edges) in self.intra.items()
+                 for node in edges]
+        edges = [(node, other, cost)
+                 for clusterEdges in self.intra.values()
+                 for (node, costs) in clusterEdges.items()
+                 for (other, cost) in costs.items()]
+
+        return {'borders': numpy.array(borders, numpy.int64).reshape(-1, 5),
+                'nodes': numpy.array(nodes, numpy.int64).reshape(-1, 3),
+                'edges': numpy.array([edge[:2] for edge in edges],
+                                     numpy.int64).reshape(-1, 2),
+                'costs': numpy.array([edge[2] for edge in edges],
+                                     numpy.float64)}
+
+    def _restore(self, arrays):
+        """ Sets the graph from the arrays of toArrays """
+
+        for (cx, cy, axis, node, other) in arrays['borders'].tolist():
+            key = (cx, cy, 'x' if axis == 0 else 'y')
+            self.borders.setdefault(key, []).append((node, other))
+            self._link(node, other)
+            self._link(other, node)
+
+        for (cx, cy, node) in arrays['nodes'].tolist():
+            self.intra.setdefault((cx, cy), {})[node] = {}
+
+        for ((node, other), cost) in zip(arrays['edges'].tolist(),
+                                         arrays['costs'].tolist()):
+            self.intra[self.clusterOf(node)][node][other] = cost
+
+        self.dirty = set()
+
+    def clusterOf(self, index):
+        (x, y) = divmod(index, self.grid.height)
+        return (x // self.clusterSize, y // self.clusterSize)
+
+    def clusterSpace(self, cluster):
+        """ Returns a search space of just the cells of a cluster """
+
+        (cx, cy) = cluster
+        size = self.clusterSize
+        return SearchSpace.fromWindow(self.grid, cx * size, (cx + 1) * size,
+                                      cy * size, (cy + 1) * size)
+
+    def update(self):
+        """ Rebuilds the clusters that have changed since the last update """
+
+        if not self.dirty:
+            return
+
+        dirty = self.dirty
+        self.dirty = set()
+
+        # the borders of changed clusters, and everything on either side
+        borders = set()
+        for (cx, cy) in dirty:
+            borders.update(((cx, cy, 'x'), (cx - 1, cy, 'x'),
+                            (cx, cy, 'y'), (cx, cy - 1, 'y')))
+
+        affected = set(dirty)
+        for (cx, cy, axis) in borders:
+            if cx < 0 or cy < 0:
+                continue
+
+            if axis == 'x' and cx + 1 < self.clustersWide:
+                transitions = self._findTransitions(cx, cy, 1, 0)
+                affected.update(((cx, cy), (cx + 1, cy)))
+            elif axis == 'y' and cy + 1 < self.clustersHigh:
+                transitions = self._findTransitions(cx, cy, 0, 1)
+                affected.update(((cx, cy), (cx, cy + 1)))
+            else:
+                continue
+
+            # a node can be on more than one border, so only the links
+            # across this one are replaced
+            for (node, other) in self.borders.get((cx, cy, axis), ()):
+                self._unlink(node, other)
+                self._unlink(other, node)
+
+            self.borders[(cx, cy, axis)] = transitions
+            for (node, other) in transitions:
+                self._link(node, other)
+                self._link(other, node)
+
+        for cluster in affected:
+            self._buildCluster(cluster)
+
+    def _findTransitions(self, cx, cy, dx, dy):
+        """ Returns the transitions across the border between a cluster and
+            the next one along dx, dy """
+
+        size = self.clusterSize
+        grid = self.grid
+        if dx:
+            x = (cx + 1) * size - 1
+            y0 = cy * size
+            y1 = min((cy + 1) * size, grid.height)
+            open = grid.passable[x, y0:y1] & grid.passable[x + 1, y0:y1]
+            cells = [(x, y) for y in range(y0, y1)]
+        else:
+            y = (cy + 1) * size - 1
+            x0 = cx * size
+            x1 = min((cx + 1) * size, grid.width)
+            open = grid.passable[x0:x1, y] & grid.passable[x0:x1, y + 1]
+            cells = [(x, y) for x in range(x0, x1)]
+
+        transitions = []
+        for (start, end) in runs(open):
+            if end - start < MAX_ENTRANCE_WIDTH:
+                positions = [(start + end) // 2]
+            else:
+                positions = [start, end - 1]
+
+            for position in positions:
+                (x, y) = cells[position]
+                transitions.append((grid.index(x, y),
+                                    grid.index(x + dx, y + dy)))
+
+        return transitions
+
+    def _link(self, node, other):
+        (x, y) = self.grid.position(other)
+        cost = 1 + int(self.grid.cost[x, y])
+        self.inter.setdefault(node, []).append((other, cost))
+
+    def _unlink(self, node, other):
+        links = [link for link in self.inter.get(node, ()) if link[0] != other]
+        if links:
+            self.inter[node] = links
+        else:
+            self.inter.pop(node, None)
+
+    def _buildCluster(self, cluster):
+        """ Works out the costs between every pair of a cluster's nodes """
+
+        nodes = set()
+        (cx, cy) = cluster
+        for key in ((cx, cy, 'x'), (cx - 1, cy, 'x'),
+                    (cx, cy, 'y'), (cx, cy - 1, 'y')):
+            for transition in self.borders.get(key, ()):
+                for node in transition:
+                    if self.clusterOf(node) == cluster:
+                        nodes.add(node)
+
+        space = self.clusterSpace(cluster)
+        edges = {}
+        for node in nodes:
+            local = self._toLocal(space, node)
+            costs = AStar.dijkstra(space, [local], self.profile)
+            edges[node] = dict((other, costs[self._toLocal(space, other)])
+                               for other in nodes
+                               if other != node and
+                               self._toLocal(space, other) in costs)
+
+        self.intra[cluster] = edges
+        self.rebuilt += 1
+
+    def _toLocal(self, space, index):
+        (x, y) = self.grid.position(index)
+        return space.index(x, y)
+
+    def _toGrid(self, space, local):
+        (x, y) = space.position(local)
+        return self.grid.index(x, y)
+
+    def _linkEnd(self, index, reverse):
+        """ Returns {node: cost} from a cell to the nodes of its cluster, or
+            from them to it if reverse """
+
+        cluster = self.clusterOf(index)
+        space = self.clusterSpace(cluster)
+        costs = AStar.dijkstra(space, [self._toLocal(space, index)],
+                               self.profile, reverse)
+
+        links = {}
+        for node in self.intra.get(cluster, {}):
+            local = self._toLocal(space, node)
+            if local in costs:
+                links[node] = costs[local]
+
+        return (links, space, costs)
+
+    def search(self, space, start, goal, profile=MovementProfile.DEFAULT,
+               visited=None):
+        """ Finds a path between two flat indices, with the same interface as
+            AStar.search so it can be passed to Map.findPath. Anything but a
+            search space covering the whole grid with this pathfinder's
+            profile is handed to AStar.search """
+
+        if (profile != self.profile or space.originX or space.originY or
+                space.width != self.grid.width or
+                space.height != self.grid.height):
+            return AStar.search(space, start, goal, profile, visited)
+
+        self.update()
+
+        if start == goal:
+            return [start]
+
+        if visited is not None:
+            visited.update((start, goal))
+
+        # an impassable end still links to its cluster's nodes, but there's
+        # no path to or from it
+        if not (space.passable[start] and space.passable[goal]):
+            return None
+
+        (startLinks, startSpace, startCosts) = self._linkEnd(start, False)
+        (goalLinks, goalSpace, goalCosts) = self._linkEnd(goal, True)
+
+        height = self.grid.height
+        (goalX, goalY) = divmod(goal, height)
+        heuristic = profile.heuristic
+
+        # the goal can be reached without leaving the cluster
+        direct = None
+        if self.clusterOf(start) == self.clusterOf(goal):
+            local = self._toLocal(startSpace, goal)
+            if local in startCosts:
+                direct = startCosts[local]
+
+        frontier = [(0, 0, start)]
+        costSoFar = {start: 0}
+        cameFrom = {start: None}
+        closed = set()
+        abstractPath = None
+
+        while frontier:
+            current = heapq.heappop(frontier)[2]
+
+            if current in closed:
+                continue
+
+            if current == goal:
+                abstractPath = AStar.reconstruct(cameFrom, goal)
+                break
+
+            closed.add(current)
+            if visited is not None:
+                self._visitCluster(self.clusterOf(current), visited)
+
+            if current == start:
+                neighbours = list(startLinks.items())
+                neighbours.extend(self.inter.get(start, ()))
+                if direct is not None:
+                    neighbours.append((goal, direct))
+            else:
+                neighbours = list(self.intra[self.clusterOf(current)]
+                                  .get(current, {}).items())
+                neighbours.extend(self.inter.get(current, ()))
+                if current in goalLinks:
+                    neighbours.append((goal, goalLinks[current]))
+
+            for (nextNode, stepCost) in neighbours:
+                if nextNode in closed:
+                    continue
+
+                newCost = costSoFar[current] + stepCost
+                if nextNode not in costSoFar or newCost < costSoFar[nextNode]:
+                    costSoFar[nextNode] = newCost
+                    cameFrom[nextNode] = current
+                    (x, y) = divmod(nextNode, height)
+                    h = heuristic(abs(x - goalX), abs(y - goalY))
+                    heapq.heappush(frontier, (newCost + h, h, nextNode))
+
+        if abstractPath is None:
+            return None
+
+        return self._refine(abstractPath)
+
+    def _refine(self, abstractPath):
+        """ Turns a path of abstract nodes into a path of cells """
+
+        path = abstractPath[:1]
+        for (previous, current) in zip(abstractPath, abstractPath[1:]):
+            cluster = self.clusterOf(previous)
+            if cluster != self.clusterOf(current):
+                # a step across a border
+                path.append(current)
+                continue
+
+            space = self.clusterSpace(cluster)
+            segment = AStar.search(space, self._toLocal(space, previous),
+                                   self._toLocal(space, current),
+                                   self.profile)
+            path.extend(self._toGrid(space, local) for local in segment[1:])
+
+        return path
+
+    def _visitCluster(self, cluster, visited):
+        """ Adds the cells of a cluster to visited, as the abstract search
+            depends on all of them """
+
+        (cx, cy) = cluster
+        size = self.clusterSize
+        height = self.grid.height
+        for x in range(cx * size, min((cx + 1) * size, self.grid.width)):
+            start = x * height + cy * size
+            visited.update(range(start, start + min(size,
+                                                    height - cy * size)))
+
+
+def runs(flags):
+    """ Returns (start, end) of each run of True in a boolean array """
+
+    padded = numpy.concatenate(([False], flags, [False]))
+    changes = numpy.flatnonzero(padded[1:] != padded[:-1])
+    return list(zip(changes[::2].tolist(), changes[1::2].tolist()))
+
+
+# unit testing
+class testHierarchical(unittest.TestCase):
+    def makeGrid(self, width, height, walls=()):
+        grid = Grid(width, height)
+        for (x, y) in walls:
+            grid.setPassable(x, y, False)
+        return grid
+
+    def pathCost(self, grid, path):
+        total = 0
+        for (previous, current) in zip(path, path[1:]):
+            (x0, y0) = grid.position(previous)
+            (x1, y1) = grid.position(current)
+            self.assertLessEqual(max(abs(x1 - x0), abs(y1 - y0)), 1)
+            self.assertTrue(grid.passable[x1, y1])
+            total += octile(abs(x1 - x0), abs(y1 - y0))
+        return total
+
+    def test_runs(self):
+        self.assertEqual(runs(numpy.array([True, True, False, True])),
+                         [(0, 2), (3, 4)])
+
+    def test_nearOptimal(self):
+        walls = [(12, y) for y in range(0, 30)] + [(25, y) for y in range(8, 40)]
+        grid = self.makeGrid(40, 40, walls)
+        hierarchy = HierarchicalPathfinder(grid, 8)
+        space = SearchSpace.fromGrid(grid)
+
+        for (start, goal) in (((0, 0), (39, 39)), ((30, 2), (3, 35)),
+                              ((2, 2), (5, 6))):
+            path = hierarchy.search(space, grid.index(*start),
+                                    grid.index(*goal))
+            best = AStar.search(space, grid.index(*start), grid.index(*goal))
+
+            self.assertEqual(path[0], grid.index(*start))
+            self.assertEqual(path[-1], grid.index(*goal))
+            self.assertLessEqual(self.pathCost(grid, path),
+                                 self.pathCost(grid, best) * 1.2)
+
+    def test_unreachable(self):
+        grid = self.makeGrid(32, 32, [(20, y) for y in range(32)])
+        hierarchy = HierarchicalPathfinder(grid, 8)
+
+        self.assertIsNone(hierarchy.search(SearchSpace.fromGrid(grid),
+                                           grid.index(1, 1),
+                                           grid.index(30, 30)))
+
+    def test_update(self):
+        grid = self.makeGrid(32, 32)
+        hierarchy = HierarchicalPathfinder(grid, 8)
+        rebuilt = hierarchy.rebuilt
+
+        for y in range(32):
+            grid.setPassable(20, y, False)
+
+        space = SearchSpace.fromGrid(grid)
+        self.assertIsNone(hierarchy.search(space, grid.index(1, 1),
+                                           grid.index(30, 30)))
+        # only the column of clusters around x = 20 and the ones either side
+        # of it are rebuilt
+        self.assertEqual(hierarchy.rebuilt - rebuilt, 12)
+
+        # and the links across borders match building it all again
+        fresh = HierarchicalPathfinder(grid, 8)
+        self.assertEqual(
+            dict((node, sorted(links)) for (node, links) in
+                 hierarchy.inter.items()),
+            dict((node, sorted(links)) for (node, links) in
+                 fresh.inter.items()))
+
+    def test_impassableEnd(self):
+        grid = self.makeGrid(32, 32, [(20, 20)])
+        hierarchy = HierarchicalPathfinder(grid, 8)
+        space = SearchSpace.fromGrid(grid)
+
+        self.assertIsNone(hierarchy.search(space, grid.index(1, 1),
+                                           grid.index(20, 20)))
+        self.assertIsNone(hierarchy.search(space, grid.index(20, 20),
+                                           grid.index(1, 1)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,302 @@
+import heapq
+import unittest
+import numpy
+
+import AStar
+import MovementProfile
+from Grid import Grid
+from SearchSpace import SearchSpace
+from helpers import octile
+
+"""
+ Jump Point Search, from:
+  Harabor and Grastien, Online Graph Pruning for Pathfinding on Grid Maps
+ with the rules for diagonal moves that don't cut corners, as in:
+  https://github.com/qiao/PathFinding.js
+"""
+
+
+def search(space, start, goal, profile=MovementProfile.DEFAULT, visited=None):
+    """ Finds the cheapest path between two flat indices of a search space,
+        only expanding the jump points where the path can change direction.
+
+        JPS needs every cell to cost the same and diagonals that don't cut
+        corners, for anything else this falls back to AStar.search.
+
+        @return a list of flat indices from start to goal with every cell in
+        between, or None if the goal can't be reached"""
+
+    if (not profile.diagonal or profile.cutCorners or
+            not space.uniformCost()):
+        return AStar.search(space, start, goal, profile, visited)
+
+    passable = space.passable
+    width = space.width
+    height = space.height
+    heuristic = profile.heuristic
+    (goalX, goalY) = divmod(goal, height)
+    (startX, startY) = divmod(start, height)
+    stepCost = 1 + space.cost[start]
+    scanned = visited
+
+    def walkable(x, y):
+        return 0 <= x < width and 0 <= y < height and passable[x * height + y]
+
+    def jumpStraightX(x, y, dx):
+        """ Steps from x, y along x until it finds a jump point, returns it
+            or None if it hits a wall """
+
+        index = x * height + y
+        step = dx * height
+        up = y > 0
+        down = y < height - 1
+
+        while 0 <= x < width:
+            if not passable[index]:
+                return None
+
+            if scanned is not None:
+                scanned.add(index)
+
+            # the goal, or a forced neighbour where a wall beside the path
+            # just ended
+            if (index == goal or
+                    (up and passable[index - 1] and
+                     not passable[index - step - 1]) or
+                    (down and passable[index + 1] and
+                     not passable[index - step + 1])):
+                return (x, y)
+
+            x += dx
+            index += step
+
+        return None
+
+    def jumpStraightY(x, y, dy):
+        """ Steps from x, y along y until it finds a jump point """
+
+        index = x * height + y
+        left = x > 0
+        right = x < width - 1
+
+        while 0 <= y < height:
+            if not passable[index]:
+                return None
+
+            if scanned is not None:
+                scanned.add(index)
+
+            if (index == goal or
+                    (left and passable[index - height] and
+                     not passable[index - height - dy]) or
+                    (right and passable[index + height] and
+                     not passable[index + height - dy])):
+                return (x, y)
+
+            y += dy
+            index += dy
+
+        return None
+
+    def jump(x, y, dx, dy):
+        """ Steps from x, y in the direction dx, dy until it finds a jump
+            point, returns it or None if it hits a wall """
+
+        if not dy:
+            return jumpStraightX(x, y, dx)
+
+        if not dx:
+            return jumpStraightY(x, y, dy)
+
+        while walkable(x, y):
+            if scanned is not None:
+                scanned.add(x * height + y)
+
+            if x == goalX and y == goalY:
+                return (x, y)
+
+            # a diagonal move is a jump point if a straight move from it
+            # would find one
+            if (jumpStraightX(x + dx, y, dx) is not None or
+                    jumpStraightY(x, y + dy, dy) is not None):
+                return (x, y)
+
+            if not (walkable(x + dx, y) and walkable(x, y + dy)):
+                return None
+
+            x += dx
+            y += dy
+
+        return None
+
+    def directions(x, y, parent):
+        """ Returns the directions worth searching from x, y when it was
+            reached from parent """
+
+        if parent is None:
+            return [(dx, dy) for (dx, dy, distance) in profile.offsets
+                    if walkable(x + dx, y + dy) and
+                    (not (dx and dy) or
+                     (walkable(x + dx, y) and walkable(x, y + dy)))]
+
+        (parentX, parentY) = divmod(parent, height)
+        dx = (x > parentX) - (x < parentX)
+        dy = (y > parentY) - (y < parentY)
+        results = []
+
+        if dx and dy:
+            if walkable(x, y + dy):
+                results.append((0, dy))
+            if walkable(x + dx, y):
+                results.append((dx, 0))
+            if walkable(x, y + dy) and walkable(x + dx, y):
+                results.append((dx, dy))
+
+        elif dx:
+            nextWalkable = walkable(x + dx, y)
+            for side in (1, -1):
+                if walkable(x, y + side):
+                    if nextWalkable:
+                        results.append((dx, side))
+                    results.append((0, side))
+            if nextWalkable:
+                results.append((dx, 0))
+
+        else:
+            nextWalkable = walkable(x, y + dy)
+            for side in (1, -1):
+                if walkable(x + side, y):
+                    if nextWalkable:
+                        results.append((side, dy))
+                    results.append((side, 0))
+            if nextWalkable:
+                results.append((0, dy))
+
+        return results
+
+    h = heuristic(abs(startX - goalX), abs(startY - goalY))
+    frontier = [(h, h, start)]
+    costSoFar = {start: 0}
+    cameFrom = {start: None}
+    closed = set()
+
+    path = None
+    while frontier:
+        current = heapq.heappop(frontier)[2]
+
+        if current in closed:
+            continue
+
+        if current == goal:
+            path = fill(AStar.reconstruct(cameFrom, goal), height)
+            break
+
+        closed.add(current)
+        currentCost = costSoFar[current]
+        (x, y) = divmod(current, height)
+
+        for (dx, dy) in directions(x, y, cameFrom[current]):
+            jumpPoint = jump(x + dx, y + dy, dx, dy)
+            if jumpPoint is None:
+                continue
+
+            (nextX, nextY) = jumpPoint
+            nextCell = nextX * height + nextY
+            if nextCell in closed:
+                continue
+
+            newCost = currentCost + stepCost * octile(abs(nextX - x),
+                                                      abs(nextY - y))
+            if nextCell not in costSoFar or newCost < costSoFar[nextCell]:
+                costSoFar[nextCell] = newCost
+                cameFrom[nextCell] = current
+                h = heuristic(abs(nextX - goalX), abs(nextY - goalY))
+                heapq.heappush(frontier, (newCost + h, h, nextCell))
+
+    if visited is not None:
+        visited.update(costSoFar)
+
+    return path
+
+
+def fill(jumpPoints, height):
+    """ Fills in the cells between consecutive jump points, which are always
+        in a straight or diagonal line """
+
+    path = jumpPoints[:1]
+    for (previous, current) in zip(jumpPoints, jumpPoints[1:]):
+        (x0, y0) = divmod(previous, height)
+        (x1, y1) = divmod(current, height)
+        dx = (x1 > x0) - (x1 < x0)
+        dy = (y1 > y0) - (y1 < y0)
+
+        for step in range(1, max(abs(x1 - x0), abs(y1 - y0)) + 1):
+            path.append((x0 + dx * step) * height + y0 + dy * step)
+
+    return path
+
+
+# unit testing
+class testJumpPointSearch(unittest.TestCase):
+    def makeSpace(self, width, height, walls=()):
+        passable = numpy.ones((width, height), numpy.bool_)
+        for (x, y) in walls:
+            passable[x, y] = False
+
+        return SearchSpace(memoryview(passable.reshape(-1)),
+                           memoryview(numpy.zeros(width * height, numpy.uint8)),
+                           width, height)
+
+    def pathCost(self, space, path):
+        total = 0
+        for (previous, current) in zip(path, path[1:]):
+            (x0, y0) = space.position(previous)
+            (x1, y1) = space.position(current)
+            self.assertLessEqual(max(abs(x1 - x0), abs(y1 - y0)), 1)
+            total += octile(abs(x1 - x0), abs(y1 - y0))
+        return total
+
+    def test_matchesAStar(self):
+        walls = [(10, y) for y in range(0, 25)] + [(20, y) for y in range(5, 30)]
+        walls += [(x, 15) for x in range(25, 30)]
+        space = self.makeSpace(30, 30, walls)
+
+        for (start, goal) in (((0, 0), (29, 29)), ((5, 29), (29, 0)),
+                              ((15, 15), (27, 20))):
+            jps = search(space, space.index(*start), space.index(*goal))
+            astar = AStar.search(space, space.index(*start),
+                                 space.index(*goal))
+
+            self.assertEqual(jps[0], space.index(*start))
+            self.assertEqual(jps[-1], space.index(*goal))
+            self.assertAlmostEqual(self.pathCost(space, jps),
+                                   self.pathCost(space, astar))
+            for i in jps:
+                self.assertTrue(space.passable[i])
+
+    def test_unreachable(self):
+        space = self.makeSpace(10, 10, [(5, y) for y in range(10)])
+
+        self.assertIsNone(search(space, space.index(0, 0),
+                                 space.index(9, 9)))
+
+    def test_fallback(self):
+        space = self.makeSpace(5, 5)
+        cost = numpy.zeros(25, numpy.uint8)
+        cost[12] = 5
+        space.cost = memoryview(cost)
+
+        path = search(space, space.index(1, 2), space.index(3, 2))
+        self.assertNotIn(12, path)
+
+    def test_fallbackOnGrid(self):
+        # the costs of a grid are kept track of as it changes
+        grid = Grid(5, 5)
+        space = SearchSpace.fromGrid(grid)
+        self.assertIn(12, search(space, 7, 17))
+
+        grid.setCost(2, 2, 5)
+        self.assertNotIn(12, search(space, 7, 17))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,29 +1,81 @@
 from __future__ import print_function
+import math
 import Cell
+from Grid import Grid
+from ChunkedGrid import ChunkedGrid
 from GameEntity import GameEntity
 from Vector import Vec2d
+from pygame import Rect
 import unittest
 import os.path
 import pygame
-from noise import snoise2
-from helpers import PriorityQueue, heuristic
+from Tileset import Tileset
+import AStar
+import MovementProfile
+from SearchSpace import SearchSpace
 from Path import Path
+from PathCache import PathCache
+from Hierarchical import HierarchicalPathfinder
+from FlowField import FlowField
+from PathSearch import PathSearch
+from DStarLite import DStarLite
+from Connectivity import Connectivity
+from TerrainCache import TerrainCache
+from Terrain import TerrainGenerator
 
 import config
 
 
 class Map(GameEntity):
-    def __init__(self):
+    def __init__(self, generator=None, chunked=False, grid=None):
+        """ Makes a map of config.MAP_WIDTH by MAP_HEIGHT, or if chunked a
+            world of config.WORLD_WIDTH by WORLD_HEIGHT cells that is only
+            generated where it is used. Given a grid, such as one loaded by
+            MapFile.load, the map uses it as it is instead """
+
         GameEntity.__init__(self)
-        self.mapWidth = config.MAP_WIDTH
-        self.mapHeight = config.MAP_HEIGHT
         self.cellWidth = config.CELL_WIDTH
         self.cellHeight = config.CELL_HEIGHT
 
-        self.map = []
-        self.generate()
+        # the terrain images are loaded once and shared by every cell
+        self.tileset = Tileset()
+
+        # terrain is kept in flat arrays, cells are views created on demand
+        if grid is not None:
+            self.grid = grid
+        elif chunked:
+            self.grid = ChunkedGrid()
+        else:
+            self.grid = Grid(config.MAP_WIDTH // self.cellWidth,
+                             config.MAP_HEIGHT // self.cellHeight)
+        self.mapWidth = self.grid.width * self.cellWidth
+        self.mapHeight = self.grid.height * self.cellHeight
+        self.map = MapColumns(self)
+
+        if generator is None:
+            generator = TerrainGenerator(config.MAP_SEED, config.MAP_OCTAVES)
+        self.generator = generator
+
+        # path queries are cached until the cells they searched change
+        self.pathCache = PathCache()
+        self.grid.addListener(self.pathCache.invalidate)
+
+        # and so are flow fields, until the cells they reach change
+        self.flowFields = PathCache(config.FLOW_FIELD_CACHE_SIZE)
+        self.grid.addListener(self.flowFields.invalidate)
+
+        # the cluster graph for hierarchical pathfinding, made when first used
+        self.hierarchy = None
+
+        # connected groups of cells, with and without corner cutting
+        self.connectivity = {}
+
+        # the terrain drawn in chunks, for drawing big areas in a few blits
+        self.terrainCache = TerrainCache(self.grid, self.tileset)
+
+        if grid is None:
+            self.generate()
 
-        self.tileset = None
         self.viewport = None
 
         self.walls = []
@@ -35,6 +87,11 @@ class Map(GameEntity):
     def __getitem__(self, position):
         return self.map[position]
 
+    def getCell(self, x, y):
+        """ Returns a view of the cell at the x, y index """
+
+        return Cell.Cell(self.grid, x, y, self.tileset)
+
     def setViewport(self, viewport):
         if (hasattr(viewport, 'screen')):
             self.viewport = viewport
@@ -53,106 +110,344 @@ class Map(GameEntity):
         else:
             (x, y) = (position[0], position[1])
 
-        return (0 <= x < (self.mapWidth / self.cellWidth) and
-                0 <= y < (self.mapHeight / self.cellHeight))
+        return (0 <= x < self.grid.width and
+                0 <= y < self.grid.height)
 
     def passable(self, position):
-        cell = self.map[position[0]][position[1]]
-        return cell.passable
+        return self.grid.passable[position[0], position[1]]
 
-    def neighbours(self, cell):
-        (x, y) = (cell.x, cell.y)
-        results = [(x + 1, y), (x, y + 1), (x - 1, y), (x, y - 1),
-                   (x - 1, y - 1), (x - 1, y + 1), (x + 1, y + 1),
-                   (x + 1, y - 1)]
+    def neighbours(self, cell, profile=MovementProfile.DEFAULT):
+        """ Returns the cells that can be moved to from a cell """
 
+        (x, y) = (cell.x, cell.y)
         if (x + y) % 2 == 0:
-            results.reverse()
+            offsets = profile.offsetsReversed
+        else:
+            offsets = profile.offsets
+
+        results = []
+        for (dx, dy, distance) in offsets:
+            position = (x + dx, y + dy)
+            if not (self.inBounds(position) and self.passable(position)):
+                continue
+
+            # don't cut the corners of impassable cells
+            if (dx and dy and not profile.cutCorners and
+                    not (self.passable((x + dx, y)) and
+                         self.passable((x, y + dy)))):
+                continue
+
+            results.append(position)
 
-        results = filter(self.inBounds, results)
-        results = filter(self.passable, results)
         return self.getCells(results)
 
     def getCellFromMouse(self, mouseX, mouseY):
-        (x, y) = (int(abs((mouseX + self.viewport.getPosition().x) / self.cellWidth)),
-                  int(abs((mouseY + self.viewport.getPosition().y) / self.cellHeight)))
+        (x, y) = ((mouseX + self.viewport.getX()) // self.cellWidth,
+                  (mouseY + self.viewport.getY()) // self.cellHeight)
 
         if (self.inBounds((x, y))):
-            return self.map[x][y]
+            return self.getCell(x, y)
         else:
-            return self.map[0][0]
+            return self.getCell(0, 0)
 
     def getCells(self, cellTuples):
         """ Returns a list of cells from position tuples """
 
         returnList = []
         for cellTuple in cellTuples:
-            returnList.append(self.map[cellTuple[0]][cellTuple[1]])
+            returnList.append(self.getCell(cellTuple[0], cellTuple[1]))
 
         return returnList
 
     def generate(self):
-        for x in range(0, self.mapHeight / self.cellHeight):
-            temp = []
-            for y in range(0, self.mapWidth / self.cellWidth):
-                temp.append(Cell.Cell(Vec2d(x, y),
-                                      snoise2(x, y, 10) * 5.0 + 20.0))
-            self.map.append(temp)
+        """ Generates the terrain of the map from the map's generator """
+
+        self.grid.generate(self.generator)
 
     def draw(self):
-        cellsOnScreen = self.getCellsOnScreen()
-        for row in self.map[cellsOnScreen[0]:cellsOnScreen[1]]:
-            for cell in row[cellsOnScreen[2]:cellsOnScreen[3]]:
-                if (cell.getDirty()):
-                    cell.draw(self.viewport)
-                    cell.setDirty(False)
+        """ Draws the dirty cells on screen, as one batch of blits """
+
+        (x_min, x_max, y_min, y_max) = self.getCellsOnScreen()
+        dirty = self.grid.dirty[x_min:x_max, y_min:y_max]
+        (xs, ys) = dirty.nonzero()
+        if not len(xs):
+            return
+
+        terrain = self.grid.terrain[x_min:x_max, y_min:y_max][xs, ys]
+        viewportPos = self.viewport.getPosition()
+        screenXs = (xs + x_min) * self.cellWidth - viewportPos.x
+        screenYs = (ys + y_min) * self.cellHeight - viewportPos.y
+
+        areas = {}
+        blits = []
+        for (screenX, screenY, cellTerrain) in zip(screenXs.tolist(),
+                                                   screenYs.tolist(),
+                                                   terrain.tolist()):
+            if cellTerrain not in areas:
+                areas[cellTerrain] = self.tileset.getArea(cellTerrain)
+            (image, area) = areas[cellTerrain]
+
+            if area is None:
+                blits.append((image, (screenX, screenY)))
+            else:
+                blits.append((image, (screenX, screenY), area))
+
+        self.viewport.drawMany(blits)
+        self.grid.dirty[x_min:x_max, y_min:y_max] = False
+
+    def drawArea(self, rect):
+        """ Draws the terrain in a rect of the screen from the pre-drawn
+            chunks, whether the cells are dirty or not """
+
+        # off the edge of the map is left blank
+        self.viewport.screen.fill(pygame.Color(255, 255, 255), rect)
+
+        viewportPos = self.viewport.getPosition()
+        mapRect = Rect(rect).move(viewportPos.x, viewportPos.y)
+        blits = self.terrainCache.blitsFor(mapRect)
+        self.viewport.drawMany([(image, (x + rect[0], y + rect[1]), area)
+                                for (image, (x, y), area) in blits])
+
+    def scroll(self, offset):
+        """ Moves the viewport by offset, drawing only the strips that come
+            into view and the places sprites were drawn last frame """
+
+        exposed = self.viewport.scroll(offset)
+        (dx, dy) = (int(offset[0]), int(offset[1]))
+        for rect in self.viewport.lastOverlays:
+            exposed.append(rect.move(-dx, -dy))
+
+        for rect in exposed:
+            self.drawArea(rect)
 
     def drawOverlay(self, cell):
         print(cell)
-        pygame.draw.rect(self.viewport.screen, pygame.Color(255, 255, 255), cell.getRect())
+        self.viewport.markOverlay(
+            pygame.draw.rect(self.viewport.screen, pygame.Color(255, 255, 255),
+                             cell.getRect()))
 
-    def findPath(self, start, finish):
+    def findPath(self, start, finish, profile=MovementProfile.DEFAULT,
+                 search=AStar.search, nearest=False):
         """ Uses A* algorithm to find the shortest path from start to finish
 
-            Code was copied from:
-            https://www.redblobgames.com/pathfinding/a-star/introduction.html"""
-
-        frontier = PriorityQueue()
-        frontier.put(start, 0)
-        came_from = {}
-        cost_so_far = {}
-        came_from[start] = None
-        cost_so_far[start] = 0
-
-        while not frontier.empty():
-            current = frontier.get()
-
-            if current == finish:
-                break
-
-            for nextCell in self.neighbours(current):
-                new_cost = cost_so_far[current] + nextCell.cost
-                if nextCell not in cost_so_far or new_cost < cost_so_far[nextCell]:
-                    cost_so_far[nextCell] = new_cost
-                    priority = new_cost + heuristic(finish, nextCell)
-                    frontier.put(nextCell, priority)
-                    came_from[nextCell] = current
-
-        # reconstruct the path
-        current = finish
-        path = []
-        try:
-            while current != start:
-                path.append(current)
-                current = came_from[current]
-        except KeyError:
-            # if there is no path found, just return the start
+            The search runs on flat cell indices over the grid's arrays, and
+            only the cells of the found path are turned back into Cells. The
+            movement profile sets the heuristic, diagonal moves and corner
+            cutting. search can be JumpPointSearch.search, which is much
+            quicker on open maps of uniform cost, or getHierarchy().search
+            for long paths across big maps.
+
+            If finish can't be reached from start the path is just start,
+            found without searching unless the map is chunked. If nearest is
+            True the path goes to the nearest cell to finish that can be
+            reached instead.
+
+            Results are cached, as the packed cell indices of the Path, so
+            asking again for the same path is cheap until the map changes
+            near it."""
+
+        key = (start.x, start.y, finish.x, finish.y, profile, search, nearest)
+        indices = self.pathCache.get(key)
+        if indices is not None:
+            return Path.fromIndices(indices, self.grid, self.tileset)
+
+        if (not self.reachable(start, finish, profile)):
+            if (not nearest):
+                return Path([start])
+
+            position = self.getConnectivity(profile).nearest(
+                (finish.x, finish.y), (start.x, start.y))
+            finish = self.getCell(*position)
+
+            # which cell is nearest can change anywhere on the map, so the
+            # path is cached as one to that cell rather than to finish
+            key = (start.x, start.y, finish.x, finish.y, profile, search,
+                   False)
+            indices = self.pathCache.get(key)
+            if indices is not None:
+                return Path.fromIndices(indices, self.grid, self.tileset)
+
+        space = SearchSpace.around(self.grid, start, finish)
+        if not (space.contains(start.x, start.y) and
+                space.contains(finish.x, finish.y)):
             return Path([start])
 
-        path.append(start)
-        path.reverse()
+        visited = set()
+        indices = search(space, space.index(start.x, start.y),
+                         space.index(finish.x, finish.y), profile, visited)
+
+        if indices is None:
+            # if there is no path found, just return the start
+            path = Path([start])
+        else:
+            path = Path.fromSpace(space, indices, self.grid, self.tileset)
+
+        self.pathCache.put(key, path.indices, space, visited)
+        return path
+
+    def lineOfSight(self, start, finish, profile=MovementProfile.DEFAULT,
+                    maxCost=None):
+        """ Checks if a unit can go in a straight line from the centre of
+            start to the centre of finish, through passable cells only, and
+            if maxCost is given no cell costing more.
+
+            Every cell the line touches is checked. Where it goes exactly
+            through a corner both cells beside the corner have to be clear,
+            unless the profile cuts corners """
+
+        passable = self.grid.passable
+        cost = self.grid.cost
+        (x, y) = (start.x, start.y)
+        (dx, dy) = (finish.x - x, finish.y - y)
+        (nx, ny) = (abs(dx), abs(dy))
+        (stepX, stepY) = (1 if dx > 0 else -1, 1 if dy > 0 else -1)
+
+        (ix, iy) = (0, 0)
+        while True:
+            if not passable[x, y]:
+                return False
+            if maxCost is not None and cost[x, y] > maxCost:
+                return False
+            if ix == nx and iy == ny:
+                return True
+
+            # which of the next vertical or horizontal edge the line crosses
+            # first, compared without dividing
+            side = (1 + 2 * ix) * ny - (1 + 2 * iy) * nx
+            if side == 0:
+                if not profile.cutCorners and not (passable[x + stepX, y] and
+                                                   passable[x, y + stepY]):
+                    return False
+                (x, y) = (x + stepX, y + stepY)
+                (ix, iy) = (ix + 1, iy + 1)
+            elif side < 0:
+                x += stepX
+                ix += 1
+            else:
+                y += stepY
+                iy += 1
+
+    def smoothPath(self, path, profile=MovementProfile.DEFAULT):
+        """ Pulls a path tight, returning only the cells of it where it
+            turns: each is the furthest along the path that can be seen from
+            the one before. So a unit going straight between them takes the
+            same way round obstacles, cutting out the zig-zags of moving
+            from cell to cell.
+
+            The straight lines don't cross any cell that costs more than the
+            cells of the path they cut out, so the path isn't pulled onto
+            worse terrain. """
+
+        cells = path.getPath() if isinstance(path, Path) else path
+        if not cells or len(cells) < 3:
+            return list(cells or [])
+
+        cost = self.grid.cost
+        waypoints = [cells[0]]
+        anchor = 0
+        highest = cost[cells[0].x, cells[0].y]
+        for i in range(1, len(cells)):
+            cell = cells[i]
+            highest = max(highest, cost[cell.x, cell.y])
+            if not self.lineOfSight(cells[anchor], cell, profile, highest):
+                # the cell before was the furthest that could be seen
+                anchor = i - 1
+                waypoints.append(cells[anchor])
+                highest = max(cost[cells[anchor].x, cells[anchor].y],
+                              cost[cell.x, cell.y])
+
+        waypoints.append(cells[-1])
+        return waypoints
+
+    def getConnectivity(self, profile=MovementProfile.DEFAULT):
+        """ Returns the connected groups of cells for a movement profile,
+            labelling them the first time """
+
+        if (hasattr(self.grid, 'chunkSize')):
+            raise Exception("Connectivity needs a map that isn't chunked")
+
+        diagonal = profile.diagonal and profile.cutCorners
+        if (diagonal not in self.connectivity):
+            self.connectivity[diagonal] = Connectivity(self.grid, diagonal)
+
+        return self.connectivity[diagonal]
+
+    def reachable(self, start, finish, profile=MovementProfile.DEFAULT):
+        """ Checks if there can be a path from start to finish, without a
+            search. Always True on a chunked map, or from an impassable
+            start which a search can still step off """
+
+        if (hasattr(self.grid, 'chunkSize')):
+            return True
+
+        connectivity = self.getConnectivity(profile)
+        if (connectivity.label(start.x, start.y) == 0):
+            return True
+
+        return connectivity.connected((start.x, start.y), (finish.x, finish.y))
+
+    def startPath(self, start, finish, profile=MovementProfile.DEFAULT):
+        """ Starts a path search that is run a little at a time, by calling
+            its step method or adding it to a PathScheduler, instead of all
+            at once like findPath """
+
+        return PathSearch(self, start, finish, profile)
+
+    def planPath(self, start, finish, profile=MovementProfile.DEFAULT):
+        """ Returns a planner that keeps a path from start to finish up to
+            date as cells change, repairing it rather than searching again.
+            Give it to a StrategyEntity with setPlanner """
+
+        return DStarLite(self, start, finish, profile)
+
+    def getFlowField(self, goals, profile=MovementProfile.DEFAULT):
+        """ Returns a flow field to a goal cell, or the nearest of a list of
+            goal cells, that any number of units can follow with
+            field.getNext(x, y) instead of finding a path each.
+
+            On a chunked world the field only covers the area around the
+            goals, config.SEARCH_MARGIN cells out."""
+
+        if (hasattr(goals, 'x') and hasattr(goals, 'y')):
+            goals = [goals]
+
+        key = (frozenset((goal.x, goal.y) for goal in goals), profile)
+        field = self.flowFields.get(key)
+        if field is not None:
+            return field
+
+        if (hasattr(self.grid, 'chunkSize')):
+            margin = config.SEARCH_MARGIN
+            space = SearchSpace.fromWindow(
+                self.grid,
+                min(goal.x for goal in goals) - margin,
+                max(goal.x for goal in goals) + margin + 1,
+                min(goal.y for goal in goals) - margin,
+                max(goal.y for goal in goals) + margin + 1)
+        else:
+            space = SearchSpace.fromGrid(self.grid)
+
+        field = FlowField(space, [space.index(goal.x, goal.y)
+                                  for goal in goals], profile)
 
-        return Path(path)
+        # the goals too, so a field to impassable goals is made again if
+        # they become passable
+        self.flowFields.put(key, field, space,
+                            field.reached().tolist() +
+                            [space.index(goal.x, goal.y) for goal in goals])
+        return field
+
+    def getHierarchy(self):
+        """ Returns the hierarchical pathfinder of the map, building its
+            cluster graph the first time """
+
+        if (self.hierarchy is None):
+            if (hasattr(self.grid, 'chunkSize')):
+                raise Exception("Hierarchical pathfinding needs a map that "
+                                "isn't chunked")
+            self.hierarchy = HierarchicalPathfinder(self.grid)
+
+        return self.hierarchy
 
     def drawPath(self, path):
         """ Draws a path onto the map """
@@ -161,14 +456,16 @@ class Map(GameEntity):
         for cell in path:
             cell.setDirty(True)
             local_pos = self.viewport.getLocalPosition(cell.getCentre())
-            pygame.draw.circle(self.viewport.screen,
-                               pygame.Color(255, 255, 255),
-                               (local_pos.x, local_pos.y),
-                               2)
-            pygame.draw.aaline(self.viewport.screen,
-                               pygame.Color(255, 255, 255),
-                               (prevPos.x, prevPos.y),
-                               (local_pos.x, local_pos.y))
+            self.viewport.markOverlay(
+                pygame.draw.circle(self.viewport.screen,
+                                   pygame.Color(255, 255, 255),
+                                   (local_pos.x, local_pos.y),
+                                   2))
+            self.viewport.markOverlay(
+                pygame.draw.aaline(self.viewport.screen,
+                                   pygame.Color(255, 255, 255),
+                                   (prevPos.x, prevPos.y),
+                                   (local_pos.x, local_pos.y)))
             prevPos = local_pos
 
     def printMap(self):
@@ -179,42 +476,164 @@ class Map(GameEntity):
             print("]")
 
     def makeScreenCellsDirty(self):
-        cellsOnScreen = self.getCellsOnScreen()
-        for row in self.map[cellsOnScreen[0]:cellsOnScreen[1]]:
-            for cell in row[cellsOnScreen[2]:cellsOnScreen[3]]:
-                cell.setDirty(True)
+        (x_min, x_max, y_min, y_max) = self.getCellsOnScreen()
+        self.grid.dirty[x_min:x_max, y_min:y_max] = True
+
+    def makeRectDirty(self, rect):
+        """ Marks the cells under a rect of the map dirty, such as where a
+            sprite was drawn, so they are drawn over it next frame """
+
+        (x_min, x_max, y_min, y_max) = self.getCellRange(rect)
+        self.grid.dirty[x_min:x_max, y_min:y_max] = True
+
+    def loadTileset(self, tilesetPath, terrainOrder=None):
+        """ Loads a tileset sheet that every cell will be drawn from """
 
-    def loadTileset(self, tilesetPath):
         if (os.path.isfile(tilesetPath)):
-            self.tileset = pygame.image.load(tilesetPath).convert()
+            self.tileset.loadAtlas(tilesetPath, terrainOrder)
+            self.terrainCache.clear()
+            if (self.viewport is not None):
+                self.makeScreenCellsDirty()
         else:
             raise Exception("Invalid tileset path: " + tilesetPath)
 
+    def getCellRange(self, rect):
+        """ Returns (x_min, x_max, y_min, y_max), the cell indices that a rect
+            of the map in pixels covers any part of, clamped to the map. The
+            max indices are one past the last, as for slicing """
+
+        (left, top, width, height) = rect
+
+        x_min = max(0, int(math.floor(left / float(self.cellWidth))))
+        y_min = max(0, int(math.floor(top / float(self.cellHeight))))
+        x_max = min(self.grid.width,
+                    int(math.ceil((left + width) / float(self.cellWidth))))
+        y_max = min(self.grid.height,
+                    int(math.ceil((top + height) / float(self.cellHeight))))
+
+        return (x_min, max(x_min, x_max), y_min, max(y_min, y_max))
+
     def getCellsOnScreen(self):
         """ Finds the cell index min and max """
 
-        # the position of the viewport
-        viewportPos = self.viewport.getPosition()
+        return self.getCellRange(self.viewport.getRect())
+
+    def onScreen(self, entity):
+        """ Checks if any of the cells under an entity are on screen """
+
+        (x_min, x_max, y_min, y_max) = self.getCellsOnScreen()
+        (left, right, top, bottom) = self.getCellRange(entity.getRect())
+
+        return (left < x_max and x_min < right and
+                top < y_max and y_min < bottom)
+
+
+class MapColumns:
+    """ Lets map[x][y] index the grid, creating cell views on demand """
+
+    def __init__(self, theMap):
+        self.theMap = theMap
+
+    def __len__(self):
+        return self.theMap.grid.width
+
+    def __getitem__(self, x):
+        if isinstance(x, slice):
+            return [MapColumn(self.theMap, i)
+                    for i in range(*x.indices(len(self)))]
+
+        if x < 0:
+            x += len(self)
+        if not 0 <= x < len(self):
+            raise IndexError("Map column out of range")
+
+        return MapColumn(self.theMap, x)
+
+
+class MapColumn:
+    """ One column of the map, the cells with the same x index """
+
+    def __init__(self, theMap, x):
+        self.theMap = theMap
+        self.x = x
+
+    def __len__(self):
+        return self.theMap.grid.height
+
+    def __getitem__(self, y):
+        if isinstance(y, slice):
+            return [self.theMap.getCell(self.x, i)
+                    for i in range(*y.indices(len(self)))]
+
+        if y < 0:
+            y += len(self)
+        if not 0 <= y < len(self):
+            raise IndexError("Map row out of range")
+
+        return self.theMap.getCell(self.x, y)
+
+
+# unit testing
+class testMap(unittest.TestCase):
+    def setUp(self):
+        self.theMap = Map()
+
+    def test_getCellRange(self):
+        m = self.theMap
+        width = m.cellWidth
+        height = m.cellHeight
+
+        # partial tiles at the edges are included
+        self.assertEqual(m.getCellRange((width // 2, height, width * 2,
+                                         height // 2)),
+                         (0, 3, 1, 2))
+
+        # and clamped to the map
+        self.assertEqual(m.getCellRange((-width * 5, -1, width * 1000, 2)),
+                         (0, m.grid.width, 0, 1))
+        self.assertEqual(m.getCellRange((-width * 5, 0, width, height)),
+                         (0, 0, 0, 1))
+
+        for value in m.getCellRange((10.5, 20.25, 100.0, 100.0)):
+            self.assertIsInstance(value, int)
+
+    def test_findPathNearest(self):
+        m = self.theMap
+        m.grid.passable[:] = True
+        m.grid.passable[10, :] = False
+        m.grid.changed(0, m.grid.width, 0, m.grid.height)
+
+        path = m.findPath(m[2][2], m[20][2], nearest=True)
+        self.assertEqual(path[-1], m[9][2])
+
+        # a gap far from the search lets it reach the real finish
+        m.grid.setPassable(10, 30, True)
+        path = m.findPath(m[2][2], m[20][2], nearest=True)
+        self.assertEqual(path[-1], m[20][2])
 
-        # set the starting index mins and maxes
-        x_min, y_min = 0, 0
-        x_max = self.mapWidth / self.cellWidth
-        y_max = self.mapHeight / self.cellHeight
+    def test_flowFieldImpassableGoal(self):
+        m = self.theMap
+        m.grid.passable[:] = True
+        m.grid.passable[10, 10] = False
+        m.grid.changed(0, m.grid.width, 0, m.grid.height)
 
-        if (viewportPos.x > 0):
-            x_min = viewportPos.x / self.cellWidth
+        field = m.getFlowField(m[10][10])
+        self.assertEqual(field.getPath(5, 5), [(5, 5)])
 
-        if (viewportPos.y > 0):
-            y_min = viewportPos.y / self.cellHeight
+        # the field is made again once the goal can be reached
+        m.grid.setPassable(10, 10, True)
+        self.assertEqual(m.getFlowField(m[10][10]).getPath(5, 5)[-1],
+                         (10, 10))
 
-        mapRight = ((viewportPos.x * -1) + self.mapWidth)
-        if (mapRight > self.viewport.getRect().width):
-            x_max = x_max - ((mapRight - self.viewport.getRect().width) /
-                             self.cellWidth)
+    def test_chunked(self):
+        # a whole world is generated at once, which must not touch every
+        # chunk of the terrain cache
+        world = Map(chunked=True)
+        self.assertEqual(world.grid.width, config.WORLD_WIDTH)
 
-        mapTop = ((viewportPos.y * -1) + self.mapHeight)
-        if (mapTop > self.viewport.getRect().height):
-            y_max = y_max - ((mapTop - self.viewport.getRect().height) /
-                             self.cellHeight)
+        world.terrainCache.getSurface(0, 0)
+        world.grid.setPassable(1, 1, False)
+        self.assertFalse(world.getCell(1, 1).passable)
 
-        return (x_min, x_max, y_min, y_max)
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,343 @@
+import json
+import os
+import struct
+import tempfile
+import unittest
+import numpy
+
+import Map
+import MovementProfile
+from Grid import Grid, LAYERS
+from ChunkedGrid import ChunkedGrid
+from Connectivity import Connectivity
+from Hierarchical import HierarchicalPathfinder
+from Terrain import TerrainGenerator
+
+"""
+ Saving maps to a file, and opening them again as memory maps so only the
+ parts of the file that are used are read
+"""
+
+MAGIC = b'MAPFILE\0'
+VERSION = 1
+
+# magic, version and the length of the header that follows
+PREAMBLE = struct.Struct('<8sII')
+
+# arrays start on page boundaries, so each can be mapped on its own
+ALIGNMENT = 4096
+
+# the settings of a TerrainGenerator, to make it again
+GENERATOR_SETTINGS = ('seed', 'octaves', 'persistence', 'lacunarity', 'scale',
+                      'amplitude', 'base')
+
+
+def save(theMap, path, precompute=True):
+    """ Saves a map to a file.
+
+        The file starts with a JSON header, after which the arrays follow as
+        raw bytes, each at an offset given in the header. A Map's layers
+        are saved whole, with its connectivity labels and cluster graph,
+        worked out first if precompute is True. A chunked world is saved as
+        the chunks that are loaded or edited, as tiles of chunkSize by
+        chunkSize cells, and the generator that makes the rest.
+
+        The file is written next to path and moved over it when done, so
+        maps open from the old file are unaffected. """
+
+    grid = theMap.grid
+    header = {'version': VERSION,
+              'width': int(grid.width),
+              'height': int(grid.height),
+              'generator': None,
+              'arrays': {}}
+    arrays = {}
+
+    if isinstance(theMap.generator, TerrainGenerator):
+        header['generator'] = dict((name, getattr(theMap.generator, name))
+                                   for name in GENERATOR_SETTINGS)
+
+    if hasattr(grid, 'chunkSize'):
+        if header['generator'] is None:
+            raise Exception("A chunked world can only be saved with a "
+                            "TerrainGenerator, to make the chunks not saved")
+
+        header['layout'] = 'chunked'
+        header['chunkSize'] = grid.chunkSize
+        chunks = _storedChunks(grid)
+        arrays['chunkKeys'] = chunks
+        for name in LAYERS:
+            dtype = getattr(grid, name).dtype
+            arrays['chunks.' + name] = ((len(chunks), grid.chunkSize,
+                                         grid.chunkSize), dtype)
+    else:
+        header['layout'] = 'grid'
+        for name in LAYERS:
+            arrays[name] = getattr(grid, name)
+
+        if precompute:
+            for cutCorners in (False, True):
+                theMap.getConnectivity(
+                    MovementProfile.MovementProfile(cutCorners=cutCorners))
+            theMap.getHierarchy()
+
+        header['connectivity'] = {}
+        for (diagonal, connectivity) in theMap.connectivity.items():
+            connectivity.update()
+            name = 'labels.diagonal' if diagonal else 'labels'
+            arrays[name] = connectivity.labels
+            header['connectivity'][name] = {
+                'diagonal': diagonal,
+                'nextLabel': int(connectivity.nextLabel)}
+
+        hierarchy = theMap.hierarchy
+        header['hierarchy'] = None
+        if (hierarchy is not None and
+                hierarchy.profile == MovementProfile.DEFAULT):
+            header['hierarchy'] = {'clusterSize': hierarchy.clusterSize}
+            for (name, array) in hierarchy.toArrays().items():
+                arrays['hierarchy.' + name] = array
+
+    # lay the arrays out one after another, from the end of the header
+    offset = 0
+    for (name, array) in sorted(arrays.items()):
+        (shape, dtype) = _describe(array)
+        header['arrays'][name] = {'offset': offset,
+                                  'dtype': numpy.dtype(dtype).str,
+                                  'shape': list(shape)}
+        size = int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize
+        offset += -(-size // ALIGNMENT) * ALIGNMENT
+
+    encoded = json.dumps(header, sort_keys=True).encode('utf-8')
+    start = -(-(PREAMBLE.size + len(encoded)) // ALIGNMENT) * ALIGNMENT
+
+    (handle, temporary) = tempfile.mkstemp(dir=os.path.dirname(
+        os.path.abspath(path)))
+    try:
+        with os.fdopen(handle, 'wb') as output:
+            output.write(PREAMBLE.pack(MAGIC, VERSION, len(encoded)))
+            output.write(encoded)
+            output.truncate(start + offset)
+
+            for (name, array) in arrays.items():
+                if isinstance(array, numpy.ndarray):
+                    output.seek(start + header['arrays'][name]['offset'])
+                    output.write(numpy.ascontiguousarray(array).tobytes())
+
+        if header['layout'] == 'chunked':
+            _writeChunks(grid, temporary, start, header)
+
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def _describe(array):
+    """ Returns the shape and dtype of an array, or of a (shape, dtype) of
+        one to be written later """
+
+    if isinstance(array, numpy.ndarray):
+        return (array.shape, array.dtype)
+
+    return array
+
+
+def _storedChunks(grid):
+    """ Returns the chunk keys of a ChunkedGrid to save, the chunks loaded,
+        edited or read from a file before, as an n by 2 array in order """
+
+    keys = set(grid.chunks) | set(grid.edits)
+    if grid.stored is not None:
+        keys.update(map(tuple, grid.stored.keys.tolist()))
+
+    return numpy.array(sorted(keys), numpy.int64).reshape(-1, 2)
+
+
+def _writeChunks(grid, path, start, header):
+    """ Writes the layers of each chunk to save into its tile """
+
+    keys = _open(path, start, header['arrays']['chunkKeys'], 'r')
+    tiles = dict((name, _open(path, start,
+                              header['arrays']['chunks.' + name], 'r+'))
+                 for name in LAYERS)
+
+    for (i, (chunkX, chunkY)) in enumerate(keys.tolist()):
+        chunk = grid.getChunk(chunkX, chunkY)
+        for name in LAYERS:
+            tiles[name][i] = getattr(chunk, name)
+
+    for tile in tiles.values():
+        tile.flush()
+
+
+def _open(path, start, entry, mode):
+    if not int(numpy.prod(entry['shape'])):
+        return numpy.zeros(entry['shape'], numpy.dtype(entry['dtype']))
+
+    return numpy.memmap(path, numpy.dtype(entry['dtype']), mode,
+                        start + entry['offset'], tuple(entry['shape']))
+
+
+def readHeader(path):
+    """ Returns the header of a map file, and where its arrays start """
+
+    with open(path, 'rb') as source:
+        preamble = source.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            raise Exception("Not a map file: " + path)
+
+        (magic, version, length) = PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise Exception("Not a map file: " + path)
+        if version > VERSION:
+            raise Exception("Map file version {} is newer than this version "
+                            "{} can read".format(version, VERSION))
+
+        header = json.loads(source.read(length).decode('utf-8'))
+
+    start = -(-(PREAMBLE.size + length) // ALIGNMENT) * ALIGNMENT
+    return (header, start)
+
+
+def load(path):
+    """ Opens a map saved with save.
+
+        The arrays are memory maps of the file, so opening it reads little
+        more than the header, and then only the pages of it that are used.
+        They are copy on write: the map can be changed, but the file is only
+        changed by saving over it. The cluster graph is read whole, it is a
+        small part of the file. """
+
+    (header, start) = readHeader(path)
+    entries = header['arrays']
+
+    def array(name):
+        return _open(path, start, entries[name], 'c')
+
+    generator = None
+    if header['generator'] is not None:
+        generator = TerrainGenerator(**header['generator'])
+
+    if header['layout'] == 'chunked':
+        stored = StoredChunks(array('chunkKeys'),
+                              dict((name, array('chunks.' + name))
+                                   for name in LAYERS))
+        grid = ChunkedGrid(header['width'], header['height'],
+                           header['chunkSize'], generator=generator,
+                           stored=stored)
+        return Map.Map(generator, grid=grid)
+
+    grid = Grid(header['width'], header['height'],
+                dict((name, array(name)) for name in LAYERS))
+    theMap = Map.Map(generator, grid=grid)
+
+    for (name, saved) in header['connectivity'].items():
+        theMap.connectivity[saved['diagonal']] = Connectivity(
+            grid, saved['diagonal'], array(name), saved['nextLabel'])
+
+    if header['hierarchy'] is not None:
+        theMap.hierarchy = HierarchicalPathfinder(
+            grid, header['hierarchy']['clusterSize'],
+            arrays=dict((name, numpy.array(array('hierarchy.' + name)))
+                        for name in ('borders', 'nodes', 'edges', 'costs')))
+
+    return theMap
+
+
+class StoredChunks:
+    """ The chunks of a chunked world in a map file, for a ChunkedGrid to
+        read instead of generating them """
+
+    def __init__(self, keys, tiles):
+        self.keys = keys
+        self.tiles = tiles
+
+        # each key as one number, in the same order as the sorted keys
+        keys = numpy.asarray(keys, numpy.int64)
+        self.numbers = (keys[:, 0] << 32) + keys[:, 1]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def getChunk(self, chunkX, chunkY):
+        """ Returns {layer name: array} of a stored chunk, or None """
+
+        number = (chunkX << 32) + chunkY
+        i = int(numpy.searchsorted(self.numbers, number))
+        if i == len(self.numbers) or self.numbers[i] != number:
+            return None
+
+        return dict((name, tiles[i]) for (name, tiles) in self.tiles.items())
+
+
+# unit testing
+class testMapFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.map')
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_grid(self):
+        theMap = Map.Map()
+        theMap.grid.setPassable(3, 3, False)
+        save(theMap, self.path)
+
+        loaded = load(self.path)
+        for name in LAYERS:
+            layer = getattr(loaded.grid, name)
+            self.assertIsInstance(layer, numpy.memmap)
+            self.assertTrue(numpy.array_equal(layer,
+                                              getattr(theMap.grid, name)))
+
+        # the pathfinding data comes from the file, and gives the same paths
+        self.assertEqual(len(loaded.connectivity), 2)
+        self.assertEqual(loaded.hierarchy.rebuilt, 0)
+        (start, finish) = (loaded[0][0], loaded[20][25])
+        self.assertEqual(
+            loaded.findPath(start, finish).getPath(),
+            theMap.findPath(theMap[0][0], theMap[20][25]).getPath())
+        self.assertEqual(
+            loaded.findPath(start, finish,
+                            search=loaded.getHierarchy().search).getPath(),
+            theMap.findPath(theMap[0][0], theMap[20][25],
+                            search=theMap.getHierarchy().search).getPath())
+
+        # changing the map doesn't change the file
+        (x, y) = numpy.argwhere(theMap.grid.passable)[0].tolist()
+        loaded.grid.setPassable(x, y, False)
+        self.assertFalse(loaded.getConnectivity().label(x, y))
+        self.assertTrue(load(self.path).grid.passable[x, y])
+
+    def test_chunked(self):
+        world = ChunkedGrid(1024, 1024, 16, memory=Grid(16, 16).nbytes() * 2,
+                            generator=TerrainGenerator(3))
+        for x in range(0, 100, 10):
+            world.setPassable(x, x, False)
+        saved = set(world.chunks) | set(world.edits)
+
+        save(Map.Map(world.generator, grid=world), self.path)
+
+        loaded = load(self.path).grid
+        self.assertEqual(len(loaded.stored), len(saved))
+        self.assertFalse(loaded.passable[50, 50])
+        self.assertTrue(numpy.array_equal(loaded.terrainHeight[0:100, 0:100],
+                                          world.terrainHeight[0:100, 0:100]))
+
+        # chunks not saved are generated as before
+        self.assertTrue(numpy.array_equal(loaded.cost[500:520, 500:520],
+                                          world.cost[500:520, 500:520]))
+
+    def test_version(self):
+        with open(self.path, 'wb') as output:
+            output.write(PREAMBLE.pack(MAGIC, VERSION + 1, 2) + b'{}')
+
+        with self.assertRaises(Exception):
+            load(self.path)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+from helpers import SQRT2, manhattan, octile
+
+import config
+
+# neighbour offsets and the distance of each step. Cells where x + y is even
+# use the reversed order, which straightens the paths
+ORTHOGONAL = ((1, 0, 1), (0, 1, 1), (-1, 0, 1), (0, -1, 1))
+DIAGONAL = ((-1, -1, SQRT2), (-1, 1, SQRT2), (1, 1, SQRT2), (1, -1, SQRT2))
+
+
+class MovementProfile:
+    """ Describes how a unit moves across the map, for the pathfinding.
+
+        A step costs its length (1, or sqrt(2) for a diagonal) times one
+        plus the cost of the cell it enters, so the heuristic only has to
+        underestimate distance to stay admissible.
+
+        If cutCorners is False a diagonal step is only allowed when both of
+        the cells beside it are passable, so paths can't squeeze between two
+        impassable cells or clip the corner of one."""
+
+    def __init__(self, heuristic=None, diagonal=True,
+                 cutCorners=config.PATH_CUT_CORNERS):
+        if heuristic is None:
+            heuristic = octile if diagonal else manhattan
+
+        self.heuristic = heuristic
+        self.diagonal = diagonal
+        self.cutCorners = cutCorners
+
+        if diagonal:
+            self.offsets = ORTHOGONAL + DIAGONAL
+        else:
+            self.offsets = ORTHOGONAL
+        self.offsetsReversed = tuple(reversed(self.offsets))
+
+    def __repr__(self):
+        return 'MovementProfile({}, {}, {})'.format(self.heuristic.__name__,
+                                                    self.diagonal,
+                                                    self.cutCorners)
+
+    def __key(self):
+        return (self.heuristic, self.diagonal, self.cutCorners)
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    def __eq__(self, other):
+        return (isinstance(other, MovementProfile) and
+                self.__key() == other.__key())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+# used when no profile is given
+DEFAULT = MovementProfile()
@@ -1,17 +1,30 @@
+import math
 from GameEntity import GameEntity
 from Vector import Vec2d
 from SteeringManager import SteeringManager
-from functions import truncate
+from helpers import truncate
+
+import config
 
 
 class MovingGameEntity(GameEntity):
+    """ A game entity that moves by steering. Each tick call the behaviours
+        wanted on its SManager, then update.
+
+        For thousands of units put them in an EntityStore and steer them
+        with a SteeringSystem instead, which does the same for all of them
+        at once. """
+
     def __init__(self):
         GameEntity.__init__(self)
         self.velocity = Vec2d(0, 0)
         self.SManager = SteeringManager(self)
 
-        self._max_speed = 5
-        self._mass = 2
+        self._max_speed = config.ENTITY_MAX_SPEED
+        self._mass = config.ENTITY_MASS
+
+        # the position with the fractions of a pixel that the rect drops
+        self._exact = None
 
     def setVelocity(self, velocity):
 
@@ -24,8 +37,26 @@ class MovingGameEntity(GameEntity):
     def getMass(self):
         return self._mass
 
+    def setMass(self, mass):
+        self._mass = mass
+
+    def getMaxSpeed(self):
+        return self._max_speed
+
+    def setMaxSpeed(self, maxSpeed):
+        self._max_speed = maxSpeed
+
     def update(self):
         self.velocity = truncate(self.velocity + self.SManager.getSteering(),
                                  self._max_speed)
 
-        self.setPosition(self.getPosition() + self.velocity)
+        # start again from the rect if something else has moved it
+        exact = self._exact
+        rect = self._rect
+        if (exact is None or (math.floor(exact.x), math.floor(exact.y)) !=
+                (rect.x, rect.y)):
+            exact = Vec2d(rect.x, rect.y)
+
+        exact += self.velocity
+        self._exact = exact
+        self.setPosition(int(math.floor(exact.x)), int(math.floor(exact.y)))
@@ -1,12 +1,39 @@
 import sys
-import pygame
-from helpers import myQueue
+import unittest
+import numpy
+
+import Cell
+
+
+def indexType(grid):
+    """ Returns the smallest integer type that holds every flat index of a
+        grid """
+
+    if grid.width * grid.height <= numpy.iinfo(numpy.int32).max:
+        return numpy.int32
+
+    return numpy.int64
 
 
 class Path:
+    """ A path over the cells of a grid, kept as a packed array of their flat
+        indices, x * grid height + y, rather than a list of Cells.
+
+        Cells are made when they are asked for, by indexing or iterating,
+        so a path costs 4 bytes a cell (8 on a chunked world) however long
+        it is. Slices and reverse are views of the same array, without
+        copying, and the arrays are read only so paths and the path cache
+        can share them.
+
+        A cursor keeps how far along the path its follower is: getNext
+        returns the cell at the cursor and moves it on, and remaining is
+        how many cells are left. """
+
     def __init__(self, nodeList=None):
-        self.__list = None
-        self.queue = myQueue()
+        self.grid = None
+        self.tileset = None
+        self.indices = numpy.zeros(0, numpy.int32)
+        self.cursor = 0
 
         if nodeList:
             try:
@@ -14,47 +41,199 @@ class Path:
             except Exception as e:
                 sys.stderr.write(str(e))
 
+    @classmethod
+    def fromIndices(cls, indices, grid, tileset=None):
+        """ Makes a path from the flat indices of cells of a grid, sharing
+            the array if it is already read only """
+
+        path = cls()
+        path._set(indices, grid, tileset)
+        return path
+
+    @classmethod
+    def fromSpace(cls, space, indices, grid, tileset=None):
+        """ Makes a path from the flat indices of a SearchSpace over grid,
+            as a search returns them """
+
+        (xs, ys) = numpy.divmod(numpy.asarray(indices, numpy.int64),
+                                space.height)
+        return cls.fromIndices((xs + space.originX) * grid.height +
+                               (ys + space.originY), grid, tileset)
+
+    def _set(self, indices, grid, tileset):
+        indices = numpy.asarray(indices)
+        if indices.flags.writeable or indices.dtype != indexType(grid):
+            indices = indices.astype(indexType(grid))
+            indices.flags.writeable = False
+
+        self.grid = grid
+        self.tileset = tileset
+        self.indices = indices
+        self.cursor = 0
+
+    def _view(self, indices):
+        """ Returns a path over other indices of the same grid """
+
+        path = Path()
+        path.grid = self.grid
+        path.tileset = self.tileset
+        path.indices = indices
+        return path
+
     def __len__(self):
-        return len(self.__list)
+        return len(self.indices)
 
     def __repr__(self):
-        if (self.__list > 0):
-            return 'Path({}, {})'.format(self.__list[0],
-                                         self.__list[len(self.__list) - 1])
+        if len(self.indices):
+            return 'Path({}, {})'.format(self[0], self[-1])
         else:
             return 'Path(Empty)'
 
-    def __validList(self, nodeList):
-        """ Checks if every item in a list is a valid map position """
+    def __getitem__(self, key):
+        """ Returns the Cell at an index, or a Path of a slice """
 
-        for node in nodeList:
-            if not (hasattr(node, 'getPosition')):
-                return False
+        if isinstance(key, slice):
+            return self._view(self.indices[key])
 
-        return True
+        (x, y) = divmod(int(self.indices[key]), self.grid.height)
+        return Cell.Cell(self.grid, x, y, self.tileset)
 
-    def __getitem__(self, key):
-        return self.__list[key]
+    def __iter__(self):
+        grid = self.grid
+        tileset = self.tileset
+        for index in self.indices.tolist():
+            (x, y) = divmod(index, grid.height)
+            yield Cell.Cell(grid, x, y, tileset)
+
+    def __add__(self, other):
+        """ Returns a new Path of this one followed by other """
+
+        if not len(self):
+            return other[:]
+        if not len(other):
+            return self[:]
+        if other.grid is not self.grid:
+            raise Exception("Paths are over different grids")
+
+        indices = numpy.concatenate((self.indices, other.indices))
+        indices.flags.writeable = False
+        return self._view(indices)
 
     def getNext(self):
-        return self.queue.get()
+        """ Returns the cell at the cursor and moves the cursor on, or None
+            at the end of the path """
+
+        if self.cursor >= len(self.indices):
+            return None
+
+        cell = self[self.cursor]
+        self.cursor += 1
+        return cell
+
+    def remaining(self):
+        """ Returns how many cells are left from the cursor on """
+
+        return len(self.indices) - self.cursor
 
     def setPath(self, nodeList):
         """ Takes a list of map nodes and sets it as the path """
 
-        if (self.__validList(nodeList)):
-            self.__list = nodeList
-            self.queue.extend(self.__list)
-        else:
+        if isinstance(nodeList, Path):
+            self._set(nodeList.indices, nodeList.grid, nodeList.tileset)
+            return
+
+        first = nodeList[0]
+        if not (hasattr(first, 'grid') and hasattr(first, 'x')):
             raise Exception("Invalid nodes in node list")
 
+        grid = first.grid
+        height = grid.height
+        try:
+            indices = numpy.fromiter((node.x * height + node.y
+                                      for node in nodeList),
+                                     indexType(grid), len(nodeList))
+        except AttributeError:
+            raise Exception("Invalid nodes in node list")
+
+        self._set(indices, grid, first.tileset)
+
     def getPath(self):
-        """ """
-        return self.__list
+        """ Returns the cells of the path as a list """
+
+        return list(self)
+
+    def positions(self):
+        """ Returns the x, y of each cell of the path, as an n by 2 array """
+
+        if self.grid is None:
+            return numpy.zeros((0, 2), numpy.int64)
+
+        return numpy.stack(numpy.divmod(self.indices.astype(numpy.int64),
+                                        self.grid.height), axis=1)
 
     def reverse(self):
-        """ Returns a new Path, reversed """
+        """ Returns the path backwards, a view of the same cells """
+
+        return self._view(self.indices[::-1])
+
+
+# unit testing
+class testPath(unittest.TestCase):
+    def setUp(self):
+        from Grid import Grid
+
+        self.grid = Grid(10, 8)
+        self.cells = [Cell.Cell(self.grid, x, x // 2) for x in range(6)]
+        self.path = Path(self.cells)
+
+    def test_cells(self):
+        path = self.path
+        self.assertEqual(len(path), 6)
+        self.assertEqual(path.indices.dtype, numpy.int32)
+        self.assertEqual(path[2], Cell.Cell(self.grid, 2, 1))
+        self.assertEqual(path[-1], self.cells[-1])
+        self.assertEqual(path.getPath(), self.cells)
+        self.assertEqual(path.positions().tolist(),
+                         [[c.x, c.y] for c in self.cells])
+        self.assertEqual(len(Path()), 0)
+
+    def test_cursor(self):
+        path = self.path
+        self.assertEqual(path.getNext(), self.cells[0])
+        self.assertEqual(path.getNext(), self.cells[1])
+        self.assertEqual(path.remaining(), 4)
+
+        for i in range(4):
+            path.getNext()
+        self.assertIsNone(path.getNext())
+        self.assertEqual(path.remaining(), 0)
+
+    def test_views(self):
+        path = self.path
+        backwards = path.reverse()
+        self.assertEqual(backwards.getPath(), self.cells[::-1])
+        self.assertTrue(numpy.shares_memory(backwards.indices, path.indices))
+
+        middle = path[1:4]
+        self.assertEqual(middle.getPath(), self.cells[1:4])
+        self.assertTrue(numpy.shares_memory(middle.indices, path.indices))
+
+        # nothing can change the cells under another path
+        with self.assertRaises(ValueError):
+            middle.indices[0] = 0
+
+    def test_add(self):
+        joined = self.path[:3] + self.path.reverse()
+        self.assertEqual(joined.getPath(), self.cells[:3] + self.cells[::-1])
+        self.assertEqual((Path() + self.path).getPath(), self.cells)
+
+    def test_fromSpace(self):
+        from SearchSpace import SearchSpace
+
+        space = SearchSpace.fromWindow(self.grid, 2, 6, 1, 5)
+        indices = [space.index(c.x, c.y) for c in self.cells[2:]]
+        path = Path.fromSpace(space, indices, self.grid)
+        self.assertEqual(path.getPath(), self.cells[2:])
 
-        reversedPath = self.__list[:]
-        reversedPath.reverse()
-        return Path(reversedPath)
+if __name__ == "__main__":
+    unittest.main()
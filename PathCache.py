@@ -0,0 +1,205 @@
+import collections
+import unittest
+import numpy
+
+import config
+from SearchSpace import SearchSpace
+
+# above this many regions an invalidation just drops the whole cache
+MAX_REGIONS_INVALIDATED = 4096
+
+
+class PathCache:
+    """ Remembers the results of path queries until the map changes under them.
+
+        The map is split into square regions, each with a version number
+        that goes up when a cell in it changes. A cached path remembers the
+        versions of the regions its search looked at, and is only returned
+        while they are all unchanged, so an edit only drops the paths whose
+        search went near it. The least recently used paths are dropped once
+        there are more than maxSize.
+
+        Versions are taken from one count of changes for the whole map, so
+        a search that takes a while can tell if anything it looked at
+        changed after it started, see mark and changedSince."""
+
+    def __init__(self, maxSize=config.PATH_CACHE_SIZE,
+                 regionSize=config.PATH_CACHE_REGION):
+        self.maxSize = maxSize
+        self.regionSize = regionSize
+
+        self.entries = collections.OrderedDict()
+        self.versions = {}
+        self.changes = 0
+        self.epoch = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'PathCache({} paths, {} hits, {} misses)'.format(
+            len(self.entries), self.hits, self.misses)
+
+    def get(self, key):
+        """ Returns the cached value for key, or None if there isn't one or
+            the map has changed where it was searched """
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            (value, epoch, regions) = entry
+            if epoch == self.epoch and all(
+                    self.versions.get(region, 0) == version
+                    for (region, version) in regions):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self.entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value, space, visited, since=None):
+        """ Caches value for key. visited are the flat indices of the search
+            space that the search looked at. If since is a mark taken when
+            the search started, nothing is cached if the map changed where
+            it looked in the meantime.
+
+            @return whether value was cached """
+
+        if since is not None and self.changedSince(since, space, visited):
+            return False
+
+        self.entries[key] = (value, self.epoch,
+                             self._regionVersions(space, visited))
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+        return True
+
+    def mark(self):
+        """ Returns a mark of the map as it is now, for changedSince """
+
+        return (self.epoch, self.changes)
+
+    def changedSince(self, mark, space, visited):
+        """ Checks if any cell within a cell of the visited ones has
+            changed since mark was taken """
+
+        (epoch, changes) = mark
+        if epoch != self.epoch:
+            return True
+        if changes == self.changes:
+            return False
+
+        return any(version > changes
+                   for (region, version) in self._regionVersions(space,
+                                                                 visited))
+
+    def invalidate(self, x_min, x_max, y_min, y_max):
+        """ Marks the regions overlapping a range of cells as changed """
+
+        size = self.regionSize
+        regionsX = range(x_min // size, (x_max - 1) // size + 1)
+        regionsY = range(y_min // size, (y_max - 1) // size + 1)
+
+        if len(regionsX) * len(regionsY) > MAX_REGIONS_INVALIDATED:
+            self.clear()
+            return
+
+        self.changes += 1
+        for regionX in regionsX:
+            for regionY in regionsY:
+                self.versions[(regionX, regionY)] = self.changes
+
+    def clear(self):
+        self.entries.clear()
+        self.versions.clear()
+        self.epoch += 1
+
+    def stats(self):
+        """ Returns the number of hits, misses and cached paths """
+
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'hitRate': float(self.hits) / total if total else 0.0}
+
+    def _regionVersions(self, space, visited):
+        """ Returns (region, version) for every region within a cell of the
+            visited cells, as changing a cell next to the search can change
+            its result too """
+
+        indices = numpy.fromiter(visited, numpy.int64, len(visited))
+        (xs, ys) = numpy.divmod(indices, space.height)
+        xs += space.originX
+        ys += space.originY
+
+        regions = set()
+        for (dx, dy) in ((-1, -1), (-1, 1), (1, -1), (1, 1)):
+            regionsX = (xs + dx) // self.regionSize
+            regionsY = (ys + dy) // self.regionSize
+            regions.update(zip(regionsX.tolist(), regionsY.tolist()))
+
+        return tuple((region, self.versions.get(region, 0))
+                     for region in regions)
+
+
+# unit testing
+class testPathCache(unittest.TestCase):
+    def setUp(self):
+        self.space = SearchSpace(None, None, 64, 64)
+
+    def test_hitAndMiss(self):
+        cache = PathCache(regionSize=8)
+
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', [1, 2], self.space, [self.space.index(3, 3)])
+        self.assertEqual(cache.get('a'), [1, 2])
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_invalidate(self):
+        cache = PathCache(regionSize=8)
+        cache.put('near', [1], self.space, [self.space.index(3, 3)])
+        cache.put('far', [2], self.space, [self.space.index(40, 40)])
+
+        cache.invalidate(5, 6, 5, 6)
+        self.assertIsNone(cache.get('near'))
+        self.assertEqual(cache.get('far'), [2])
+
+        # a cell next to the search is in the next region over
+        cache.put('edge', [3], self.space, [self.space.index(7, 3)])
+        cache.invalidate(8, 9, 3, 4)
+        self.assertIsNone(cache.get('edge'))
+
+    def test_changedSince(self):
+        cache = PathCache(regionSize=8)
+        visited = [self.space.index(3, 3)]
+        mark = cache.mark()
+
+        cache.invalidate(40, 41, 40, 41)
+        self.assertFalse(cache.changedSince(mark, self.space, visited))
+        self.assertTrue(cache.put('a', [1], self.space, visited, mark))
+
+        cache.invalidate(3, 4, 3, 4)
+        self.assertTrue(cache.changedSince(mark, self.space, visited))
+        self.assertFalse(cache.put('b', [2], self.space, visited, mark))
+        self.assertIsNone(cache.get('b'))
+
+    def test_lru(self):
+        cache = PathCache(maxSize=2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key, self.space, [0])
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+import collections
+import time
+import unittest
+
+import config
+import AStar
+import MovementProfile
+from SearchSpace import SearchSpace
+from Path import Path
+
+
+class PathSearch:
+    """ A path query on a map that is searched a little at a time.
+
+        Made by Map.startPath. Each call to step expands up to budget cells
+        of an AStar.AStarSearch, and getPath gives the path so far, the
+        path to the most promising cell searched, until it is done. The
+        finished path goes into the map's path cache like Map.findPath's.
+
+        The search looks at the map as it is while it runs, so if cells it
+        looked at change before it is done it starts again. """
+
+    def __init__(self, theMap, start, finish, profile=MovementProfile.DEFAULT):
+        self.theMap = theMap
+        self.start = start
+        self.finish = finish
+        self.profile = profile
+        self.key = (start.x, start.y, finish.x, finish.y, profile,
+                    AStar.search, False)
+        self.restarts = 0
+
+        self.path = None
+        self.astar = None
+        indices = theMap.pathCache.get(self.key)
+        if indices is not None:
+            self.path = Path.fromIndices(indices, theMap.grid, theMap.tileset)
+            return
+
+        self._begin()
+
+    def _begin(self):
+        theMap = self.theMap
+        (start, finish) = (self.start, self.finish)
+
+        if not theMap.reachable(start, finish, self.profile):
+            self.path = Path([start])
+            return
+
+        self.space = SearchSpace.around(theMap.grid, start, finish)
+        if not (self.space.contains(start.x, start.y) and
+                self.space.contains(finish.x, finish.y)):
+            self.path = Path([start])
+            return
+
+        # to tell if the map changes where the search looks before it's done
+        self.mark = theMap.pathCache.mark()
+
+        self.visited = set()
+        self.astar = AStar.AStarSearch(self.space,
+                                       self.space.index(start.x, start.y),
+                                       self.space.index(finish.x, finish.y),
+                                       self.profile, self.visited)
+
+    def __repr__(self):
+        return 'PathSearch({}, {}{})'.format(self.start, self.finish,
+                                             ', done' if self.done() else '')
+
+    def done(self):
+        return self.path is not None
+
+    def step(self, budget=config.PATH_SEARCH_BUDGET):
+        """ Expands up to budget cells of the search
+
+            @return the number of cells expanded """
+
+        if self.done():
+            return 0
+
+        astar = self.astar
+        expanded = astar.expanded
+        if astar.step(budget):
+            if self.theMap.pathCache.changedSince(self.mark, self.space,
+                                                  self.visited):
+                # part of the search was of the map as it was, start again
+                self.restarts += 1
+                self._begin()
+                return astar.expanded - expanded
+
+            if astar.path is None:
+                # if there is no path found, just return the start
+                self.path = Path([self.start])
+            else:
+                self.path = self._toPath(astar.path)
+
+            self.theMap.pathCache.put(self.key, self.path.indices, self.space,
+                                      self.visited, self.mark)
+
+        return astar.expanded - expanded
+
+    def getPath(self):
+        """ Returns the path found, or the best so far if not done """
+
+        if self.done():
+            return self.path[:]
+
+        return self._toPath(self.astar.bestPath())
+
+    def _toPath(self, indices):
+        if indices is None:
+            return Path()
+
+        return Path.fromSpace(self.space, indices, self.theMap.grid,
+                              self.theMap.tileset)
+
+
+class PathScheduler:
+    """ Shares a budget of expanded cells a frame between many PathSearches.
+
+        Each update every search gets a turn, of an equal share of what is
+        left of the budget, and callbacks are called with the Path when a
+        search is done. """
+
+    def __init__(self, budget=config.PATH_FRAME_BUDGET):
+        self.budget = budget
+        self.searches = collections.deque()
+
+    def __len__(self):
+        return len(self.searches)
+
+    def __repr__(self):
+        return 'PathScheduler({} searches, {} a frame)'.format(
+            len(self.searches), self.budget)
+
+    def add(self, search, callback=None):
+        """ Adds a PathSearch to be stepped each update """
+
+        if search.done():
+            if callback is not None:
+                callback(search.getPath())
+            return
+
+        self.searches.append((search, callback))
+
+    def remove(self, search):
+        self.searches = collections.deque(
+            (s, callback) for (s, callback) in self.searches if s is not search)
+
+    def update(self, deadline=None):
+        """ Gives each search a turn, until the budget is used up or the
+            time.perf_counter() deadline passes, call once a frame """
+
+        budget = self.budget
+        turns = len(self.searches)
+        while self.searches and budget > 0 and turns > 0:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            # the searches still to have a turn split what is left
+            share = max(1, budget // turns)
+            turns -= 1
+
+            (search, callback) = self.searches.popleft()
+            budget -= search.step(share)
+            if search.done():
+                if callback is not None:
+                    callback(search.getPath())
+            else:
+                self.searches.append((search, callback))
+
+
+# unit testing
+class testPathSearch(unittest.TestCase):
+    def setUp(self):
+        import Map
+        self.theMap = Map.Map()
+        self.theMap.grid.passable[:] = True
+        self.theMap.grid.passable[5, 0:20] = False
+
+    def test_matchesFindPath(self):
+        m = self.theMap
+        search = PathSearch(m, m[0][0], m[9][0])
+        search.step(5)
+        self.assertFalse(search.done())
+        self.assertEqual(search.getPath()[0], m[0][0])
+
+        while not search.done():
+            search.step(5)
+
+        m.pathCache.clear()
+        expected = m.findPath(m[0][0], m[9][0])
+        self.assertEqual(search.getPath().getPath(), expected.getPath())
+
+    def test_mapChangesDuringSearch(self):
+        m = self.theMap
+        search = PathSearch(m, m[0][0], m[9][0])
+        search.step(40)
+
+        # wall off the way round the wall before the search is done
+        m.grid.passable[3, 0:31] = False
+        m.grid.changed(3, 4, 0, 31)
+        while not search.done():
+            search.step(40)
+
+        self.assertEqual(search.restarts, 1)
+        for cell in search.getPath():
+            self.assertTrue(cell.passable)
+
+        found = m.findPath(m[0][0], m[9][0])
+        for cell in found:
+            self.assertTrue(cell.passable)
+
+    def test_scheduler(self):
+        m = self.theMap
+        scheduler = PathScheduler(50)
+        found = []
+        for y in range(3):
+            scheduler.add(PathSearch(m, m[0][y], m[9][y]), found.append)
+
+        frames = 0
+        while len(scheduler):
+            scheduler.update()
+            frames += 1
+
+        self.assertEqual(len(found), 3)
+        self.assertGreater(frames, 1)
+
+        # no time left, no turns
+        search = PathSearch(m, m[0][5], m[9][5])
+        scheduler.add(search)
+        scheduler.update(time.perf_counter())
+        self.assertEqual(search.astar.expanded, 0)
+
+if __name__ == "__main__":
+    unittest.main()
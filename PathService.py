@@ -0,0 +1,369 @@
+import concurrent.futures
+import heapq
+import itertools
+import time
+import unittest
+import numpy
+from multiprocessing import shared_memory
+
+import config
+import AStar
+import MovementProfile
+from SearchSpace import SearchSpace
+from Path import Path
+
+# search spaces attached to by a worker, by shared memory name
+_attached = {}
+
+
+def _solve(task):
+    """ Runs one path search in a worker process.
+
+        @return (flat indices or None, flat indices of the visited cells) """
+
+    (snapshot, arrays, width, height, start, goal, profile, search,
+     deadline) = task
+
+    if deadline is not None and time.time() > deadline:
+        return (None, None)
+
+    if snapshot is not None:
+        if snapshot not in _attached:
+            # a new snapshot means the old ones are finished with
+            for memory in _attached.values():
+                memory.close()
+            _attached.clear()
+            _attached[snapshot] = shared_memory.SharedMemory(snapshot)
+
+        buffer = _attached[snapshot].buf
+        size = width * height
+        space = SearchSpace(buffer[:size].cast('?'), buffer[size:size * 2],
+                            width, height)
+    else:
+        (passable, cost) = arrays
+        space = SearchSpace(memoryview(passable).cast('?'),
+                            memoryview(cost), width, height)
+
+    visited = set()
+    path = search(space, start, goal, profile, visited)
+    return (path, numpy.fromiter(visited, numpy.int64, len(visited)))
+
+
+class PathService:
+    """ Finds paths in worker processes, so a long search doesn't hold up
+        the main loop.
+
+        findPath returns a concurrent.futures.Future straight away, which
+        gets the Path once a worker has found it. Requests wait in a
+        queue in order of priority, lowest first, and only as many as there
+        are workers are handed out at a time, so a request made later with
+        a lower priority still goes first.
+
+        Workers search a read only copy of the map's passability and cost,
+        kept in shared memory and copied again after the map changes.
+
+        Nothing happens to the futures between calls to update, which
+        should be called once a frame. Callbacks added to the futures run
+        in update, on the main thread."""
+
+    def __init__(self, theMap, workers=config.PATH_WORKERS):
+        self.theMap = theMap
+        self.workers = workers
+        self.executor = None
+
+        self.queue = []
+        self.running = {}
+        self.counter = itertools.count()
+
+        # shared memory copies of the map, and how many searches use each
+        self.snapshot = None
+        self.snapshotMemory = {}
+        self.snapshotUsers = {}
+        self.stale = True
+        theMap.grid.addListener(self.mapChanged)
+
+    def __repr__(self):
+        return 'PathService({} workers, {} queued, {} running)'.format(
+            self.workers, len(self.queue), len(self.running))
+
+    def mapChanged(self, x_min, x_max, y_min, y_max):
+        self.stale = True
+
+    def findPath(self, start, finish, profile=MovementProfile.DEFAULT,
+                 search=AStar.search, priority=0, timeout=None,
+                 callback=None):
+        """ Asks for a path from start to finish, as Map.findPath does.
+            search has to be a module level function, like AStar.search or
+            JumpPointSearch.search, so it can be sent to a worker.
+
+            If the path isn't found within timeout seconds the future gets a
+            concurrent.futures.TimeoutError. Cancelling the future drops the
+            request, or the result if it is already being searched.
+
+            @return a concurrent.futures.Future of a Path"""
+
+        future = concurrent.futures.Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        key = (start.x, start.y, finish.x, finish.y, profile, search, False)
+        indices = self.theMap.pathCache.get(key)
+        if indices is not None:
+            future.set_result(Path.fromIndices(indices, self.theMap.grid,
+                                               self.theMap.tileset))
+            return future
+
+        if not self.theMap.reachable(start, finish, profile):
+            future.set_result(Path([start]))
+            return future
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        request = (start, finish, profile, search, deadline, key, future)
+        heapq.heappush(self.queue, (priority, next(self.counter), request))
+        return future
+
+    def update(self):
+        """ Hands out queued requests and finishes the ones that are done,
+            call once a frame """
+
+        now = time.time()
+
+        for (job, request) in list(self.running.items()):
+            (start, finish, profile, search, deadline, key, future, space,
+             snapshot, mark) = request
+
+            if not job.done():
+                if future.cancelled():
+                    self._finish(job, snapshot)
+                elif deadline is not None and now > deadline:
+                    future.set_exception(concurrent.futures.TimeoutError())
+                    self._finish(job, snapshot)
+                continue
+
+            self._finish(job, snapshot)
+            if future.cancelled():
+                continue
+
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+                continue
+
+            (indices, visited) = job.result()
+            if visited is None or (deadline is not None and now > deadline):
+                future.set_exception(concurrent.futures.TimeoutError())
+                continue
+
+            if indices is None:
+                path = Path([start])
+            else:
+                path = Path.fromSpace(space, indices, self.theMap.grid,
+                                      self.theMap.tileset)
+
+            # only cache paths found on the map as it is now, not if cells
+            # the search looked at have changed since it was sent
+            self.theMap.pathCache.put(key, path.indices, space, visited, mark)
+
+            future.set_result(path)
+
+        while self.queue and len(self.running) < self.workers:
+            request = heapq.heappop(self.queue)[2]
+            (start, finish, profile, search, deadline, key, future) = request
+
+            if future.cancelled():
+                continue
+
+            if deadline is not None and now > deadline:
+                future.set_exception(concurrent.futures.TimeoutError())
+                continue
+
+            self._dispatch(request)
+
+    def _dispatch(self, request):
+        (start, finish, profile, search, deadline, key, future) = request
+        grid = self.theMap.grid
+
+        space = SearchSpace.around(grid, start, finish)
+        if not (space.contains(start.x, start.y) and
+                space.contains(finish.x, finish.y)):
+            future.set_result(Path([start]))
+            return
+
+        # to tell if the map changes where the worker looks before it's done
+        mark = self.theMap.pathCache.mark()
+
+        if hasattr(grid, 'chunkSize'):
+            # a chunked world is too big to share, the window is sent
+            snapshot = None
+            arrays = (bytes(space.passable), bytes(space.cost))
+        else:
+            snapshot = self._getSnapshot()
+            arrays = None
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers)
+
+        task = (snapshot, arrays, space.width, space.height,
+                space.index(start.x, start.y),
+                space.index(finish.x, finish.y), profile, search, deadline)
+        job = self.executor.submit(_solve, task)
+
+        if snapshot is not None:
+            self.snapshotUsers[snapshot] += 1
+        self.running[job] = request + (space, snapshot, mark)
+
+    def _getSnapshot(self):
+        """ Returns the name of the shared memory with a copy of the map's
+            passability and cost, copying it again if the map has changed """
+
+        if self.stale or self.snapshot is None:
+            grid = self.theMap.grid
+            size = grid.width * grid.height
+            memory = shared_memory.SharedMemory(create=True, size=size * 2)
+            memory.buf[:size] = grid.passable.reshape(-1).view(numpy.uint8)
+            memory.buf[size:size * 2] = grid.cost.reshape(-1)
+
+            if self.snapshot is not None:
+                self._release(self.snapshot)
+
+            self.snapshot = memory.name
+            self.snapshotUsers[memory.name] = 1
+            self.snapshotMemory[memory.name] = memory
+            self.stale = False
+
+        return self.snapshot
+
+    def _finish(self, job, snapshot):
+        del self.running[job]
+        if snapshot is not None:
+            self._release(snapshot)
+
+    def _release(self, snapshot):
+        """ Frees a snapshot once no search or newer snapshot needs it """
+
+        self.snapshotUsers[snapshot] -= 1
+        if self.snapshotUsers[snapshot] == 0:
+            del self.snapshotUsers[snapshot]
+            memory = self.snapshotMemory.pop(snapshot)
+            memory.close()
+            memory.unlink()
+
+    def shutdown(self):
+        """ Cancels every request and stops the workers """
+
+        for (priority, count, request) in self.queue:
+            request[-1].cancel()
+        self.queue = []
+
+        for request in self.running.values():
+            request[6].cancel()
+
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+        for memory in self.snapshotMemory.values():
+            memory.close()
+            memory.unlink()
+        self.snapshotMemory = {}
+        self.snapshotUsers = {}
+        self.snapshot = None
+        self.running = {}
+
+
+# unit testing
+class testPathService(unittest.TestCase):
+    def setUp(self):
+        import Map
+        self.theMap = Map.Map()
+        self.theMap.grid.passable[:] = True
+        self.service = PathService(self.theMap, 2)
+
+    def tearDown(self):
+        self.service.shutdown()
+
+    def wait(self, *futures):
+        for i in range(500):
+            self.service.update()
+            if all(future.done() for future in futures):
+                return
+            time.sleep(0.01)
+
+    def test_findPath(self):
+        m = self.theMap
+        results = []
+        future = self.service.findPath(m[0][0], m[5][5],
+                                       callback=results.append)
+        self.wait(future)
+
+        path = future.result()
+        self.assertEqual((path[-1].x, path[-1].y), (5, 5))
+        self.assertEqual(results, [future])
+
+        # asked again it comes from the cache
+        self.assertTrue(self.service.findPath(m[0][0], m[5][5]).done())
+
+    def test_priority(self):
+        m = self.theMap
+        order = []
+        futures = [self.service.findPath(m[0][0], m[i][9], priority=-i,
+                                         callback=lambda f, i=i: order.append(i))
+                   for i in range(1, 6)]
+        self.service.workers = 1
+        self.wait(*futures)
+
+        self.assertEqual(order, [5, 4, 3, 2, 1])
+
+    def test_cancelAndTimeout(self):
+        m = self.theMap
+        cancelled = self.service.findPath(m[0][0], m[3][3])
+        late = self.service.findPath(m[0][0], m[4][4], timeout=-1)
+        cancelled.cancel()
+        self.wait(cancelled, late)
+
+        self.assertTrue(cancelled.cancelled())
+        self.assertRaises(concurrent.futures.TimeoutError, late.result)
+
+    def test_mapChanged(self):
+        m = self.theMap
+        future = self.service.findPath(m[0][0], m[0][4])
+        self.wait(future)
+        first = self.service.snapshot
+
+        for x in range(0, 3):
+            m.grid.setPassable(x, 2, False)
+        future = self.service.findPath(m[0][0], m[0][4])
+        self.wait(future)
+
+        self.assertNotEqual(self.service.snapshot, first)
+        self.assertNotIn((0, 2), [(c.x, c.y) for c in future.result()])
+
+    def test_changedWhileSearching(self):
+        import Map
+        world = Map.Map(chunked=True)
+        world.grid.passable[0:20, 0:20] = True
+        world.grid.cost[0:20, 0:20] = 0
+        self.service.shutdown()
+        self.service = PathService(world, 1)
+
+        future = self.service.findPath(world[0][0], world[0][9])
+        self.service.update()
+        for job in list(self.service.running):
+            job.result()
+
+        # a cell on the way is blocked before the result is collected
+        world.grid.setPassable(0, 5, False)
+        self.wait(future)
+        self.assertIn((0, 5), [(c.x, c.y) for c in future.result()])
+
+        # so the path from the old terrain isn't kept
+        again = self.service.findPath(world[0][0], world[0][9])
+        self.assertFalse(again.done())
+        self.wait(again)
+        self.assertNotIn((0, 5), [(c.x, c.y) for c in again.result()])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import numpy
+
+import config
+
+
+class SearchSpace:
+    """ A rectangle of the map laid out for the search algorithms.
+
+        Cells are addressed by flat index, index = x * height + y in local
+        co-ords, and passable/cost are flat sequences indexed by it. For a
+        Grid these are zero copy views of its arrays, for a ChunkedGrid they
+        are copied out of a window around the search."""
+
+    def __init__(self, passable, cost, width, height, originX=0, originY=0,
+                 grid=None):
+        self.passable = passable
+        self.cost = cost
+        self.width = width
+        self.height = height
+        self.originX = originX
+        self.originY = originY
+
+        # the Grid the space covers all of, if it shares its memory
+        self.grid = grid
+
+    def __repr__(self):
+        return 'SearchSpace({}, {}, {}, {})'.format(self.originX, self.originY,
+                                                   self.width, self.height)
+
+    @classmethod
+    def fromGrid(cls, grid):
+        """ Makes a search space over a whole Grid, sharing its memory """
+
+        return cls(memoryview(grid.passable.reshape(-1)),
+                   memoryview(grid.cost.reshape(-1)),
+                   grid.width, grid.height, grid=grid)
+
+    @classmethod
+    def fromWindow(cls, grid, x_min, x_max, y_min, y_max):
+        """ Makes a search space from a copy of part of a grid """
+
+        x_min = max(0, x_min)
+        y_min = max(0, y_min)
+        x_max = min(grid.width, x_max)
+        y_max = min(grid.height, y_max)
+
+        passable = grid.passable[x_min:x_max, y_min:y_max]
+        cost = grid.cost[x_min:x_max, y_min:y_max]
+        return cls(memoryview(passable.reshape(-1)),
+                   memoryview(cost.reshape(-1)),
+                   x_max - x_min, y_max - y_min, x_min, y_min)
+
+    @classmethod
+    def around(cls, grid, start, finish, margin=config.SEARCH_MARGIN):
+        """ Makes a search space for a path from start to finish, the whole
+            grid if it is a Grid, or the box around them if it is chunked """
+
+        if hasattr(grid, 'chunkSize'):
+            return cls.fromWindow(grid,
+                                  min(start.x, finish.x) - margin,
+                                  max(start.x, finish.x) + margin + 1,
+                                  min(start.y, finish.y) - margin,
+                                  max(start.y, finish.y) + margin + 1)
+
+        return cls.fromGrid(grid)
+
+    def uniformCost(self):
+        """ Checks if every passable cell of the space costs the same, which
+            the Grid keeps track of, anything else is checked cell by cell """
+
+        if self.grid is not None:
+            return self.grid.uniformCost()
+
+        passable = numpy.asarray(self.passable, numpy.bool_)
+        costs = numpy.asarray(self.cost)[passable]
+        return costs.size == 0 or costs.min() == costs.max()
+
+    def contains(self, x, y):
+        """ Checks if a map position is inside the search space """
+
+        return (self.originX <= x < self.originX + self.width and
+                self.originY <= y < self.originY + self.height)
+
+    def index(self, x, y):
+        """ Returns the flat index of a map position """
+
+        return (x - self.originX) * self.height + (y - self.originY)
+
+    def position(self, index):
+        """ Returns the map position of a flat index """
+
+        (x, y) = divmod(index, self.height)
+        return (x + self.originX, y + self.originY)
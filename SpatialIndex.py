@@ -0,0 +1,244 @@
+import heapq
+import math
+import unittest
+from pygame import Rect
+
+import config
+from GameEntity import GameEntity
+
+
+class SpatialIndex:
+    """ Finds the entities in an area without looking at every entity.
+
+        The world is split into square buckets, and each entity is kept in
+        every bucket its rect overlaps. A query only looks at the entities
+        in the buckets it covers. Entities that are added to the index keep
+        it up to date themselves when they move or change size.
+
+        Distances are measured to the centre of each entity's rect."""
+
+    def __init__(self, bucketSize=config.SPATIAL_BUCKET_SIZE):
+        self.bucketSize = bucketSize
+        self.buckets = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, entity):
+        return entity in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __repr__(self):
+        return 'SpatialIndex({} entities, {} buckets)'.format(
+            len(self.entries), len(self.buckets))
+
+    def _range(self, rect):
+        """ Returns the buckets a rect overlaps, as (x_min, x_max, y_min,
+            y_max) with the maxes included """
+
+        size = self.bucketSize
+        return (int(rect[0] // size),
+                int((rect[0] + max(rect[2], 1) - 1) // size),
+                int(rect[1] // size),
+                int((rect[1] + max(rect[3], 1) - 1) // size))
+
+    def insert(self, entity):
+        """ Adds an entity, which tells the index whenever it moves """
+
+        if entity in self.entries:
+            self.update(entity)
+            return
+
+        bucketRange = self._range(entity.getRect())
+        self.entries[entity] = bucketRange
+        self._add(entity, bucketRange)
+        entity.setSpatialIndex(self)
+
+    def remove(self, entity):
+        bucketRange = self.entries.pop(entity)
+        self._discard(entity, bucketRange)
+        entity.setSpatialIndex(None)
+
+    def update(self, entity):
+        """ Moves an entity to the buckets of its rect, if they've changed """
+
+        bucketRange = self._range(entity.getRect())
+        old = self.entries[entity]
+        if bucketRange != old:
+            self._discard(entity, old)
+            self._add(entity, bucketRange)
+            self.entries[entity] = bucketRange
+
+    def _add(self, entity, bucketRange):
+        (x_min, x_max, y_min, y_max) = bucketRange
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                bucket = self.buckets.get((x, y))
+                if bucket is None:
+                    bucket = self.buckets[(x, y)] = set()
+                bucket.add(entity)
+
+    def _discard(self, entity, bucketRange):
+        (x_min, x_max, y_min, y_max) = bucketRange
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                bucket = self.buckets[(x, y)]
+                bucket.discard(entity)
+                if not bucket:
+                    del self.buckets[(x, y)]
+
+    def _gather(self, bucketRange):
+        """ Returns the entities in a range of buckets """
+
+        (x_min, x_max, y_min, y_max) = bucketRange
+        found = set()
+        buckets = self.buckets
+
+        # a big range is quicker to check bucket by bucket that exists
+        if (x_max - x_min + 1) * (y_max - y_min + 1) > len(buckets):
+            for ((x, y), bucket) in buckets.items():
+                if x_min <= x <= x_max and y_min <= y <= y_max:
+                    found.update(bucket)
+            return found
+
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                bucket = buckets.get((x, y))
+                if bucket:
+                    found.update(bucket)
+        return found
+
+    def queryRect(self, rect):
+        """ Returns the entities whose rects overlap rect """
+
+        rect = Rect(rect)
+        return [entity for entity in self._gather(self._range(rect))
+                if rect.colliderect(entity.getRect())]
+
+    def queryRadius(self, point, radius):
+        """ Returns the entities within radius of a point """
+
+        (x, y) = (point[0], point[1])
+        bucketRange = self._range((x - radius, y - radius,
+                                   radius * 2 + 1, radius * 2 + 1))
+        radiusSqrd = radius * radius
+
+        results = []
+        for entity in self._gather(bucketRange):
+            (centreX, centreY) = entity.getRect().center
+            if (centreX - x) ** 2 + (centreY - y) ** 2 <= radiusSqrd:
+                results.append(entity)
+        return results
+
+    def nearest(self, point, k=1, exclude=None):
+        """ Returns the k nearest entities to a point, nearest first,
+            leaving out exclude """
+
+        (x, y) = (point[0], point[1])
+        size = self.bucketSize
+        (bucketX, bucketY) = (int(x // size), int(y // size))
+
+        # look in rings of buckets further out, until the nearest k found
+        # so far are nearer than anything in the next ring could be
+        seen = set()
+        candidates = []
+        ring = 0
+        while len(seen) < len(self.entries) - (exclude in self.entries):
+            for key in ringBuckets(bucketX, bucketY, ring):
+                for entity in self.buckets.get(key, ()):
+                    if entity in seen or entity is exclude:
+                        continue
+                    seen.add(entity)
+                    (centreX, centreY) = entity.getRect().center
+                    candidates.append(((centreX - x) ** 2 +
+                                       (centreY - y) ** 2, id(entity),
+                                       entity))
+
+            if len(candidates) >= k:
+                best = heapq.nsmallest(k, candidates)
+                # anything not seen yet is at least this far away
+                reach = ring * size
+                if best[-1][0] <= reach * reach:
+                    return [entity for (distance, i, entity) in best]
+
+            ring += 1
+
+        return [entity for (distance, i, entity)
+                in heapq.nsmallest(k, candidates)]
+
+
+def ringBuckets(centreX, centreY, ring):
+    """ Yields the buckets at chebyshev distance ring from a bucket """
+
+    if ring == 0:
+        yield (centreX, centreY)
+        return
+
+    for x in range(centreX - ring, centreX + ring + 1):
+        yield (x, centreY - ring)
+        yield (x, centreY + ring)
+    for y in range(centreY - ring + 1, centreY + ring):
+        yield (centreX - ring, y)
+        yield (centreX + ring, y)
+
+
+# unit testing
+class testSpatialIndex(unittest.TestCase):
+    def makeEntity(self, x, y, size=10):
+        entity = GameEntity()
+        entity.setPosition(x, y)
+        entity.setDimensions(size, size)
+        return entity
+
+    def setUp(self):
+        self.index = SpatialIndex(32)
+        self.entities = [self.makeEntity(x * 25, y * 25)
+                         for x in range(10) for y in range(10)]
+        for entity in self.entities:
+            self.index.insert(entity)
+
+    def test_queryRect(self):
+        found = self.index.queryRect(Rect(0, 0, 30, 30))
+        self.assertEqual(len(found), 4)
+
+        expected = [entity for entity in self.entities
+                    if entity.getRect().colliderect(Rect(40, 60, 100, 33))]
+        self.assertEqual(set(self.index.queryRect(Rect(40, 60, 100, 33))),
+                         set(expected))
+
+    def test_queryRadius(self):
+        # the centres at (5, 5), (30, 5) and (5, 30)
+        found = self.index.queryRadius((5, 5), 25)
+        self.assertEqual(len(found), 3)
+
+    def test_nearest(self):
+        point = (113, 161)
+        nearest = self.index.nearest(point, 5)
+
+        def distance(entity):
+            (x, y) = entity.getRect().center
+            return math.hypot(x - point[0], y - point[1])
+
+        expected = sorted(self.entities, key=distance)[:5]
+        self.assertEqual([distance(e) for e in nearest],
+                         [distance(e) for e in expected])
+        self.assertEqual(len(self.index.nearest((5000, 5000), 3)), 3)
+
+    def test_moves(self):
+        entity = self.entities[0]
+        entity.setPosition(1000, 1000)
+        self.assertEqual(self.index.queryRect(Rect(995, 995, 10, 10)),
+                         [entity])
+
+        entity.move(-500, 0)
+        self.assertEqual(self.index.queryRadius((505, 1005), 1), [entity])
+
+        self.index.remove(entity)
+        entity.move(1, 1)
+        self.assertEqual(self.index.queryRadius((506, 1006), 1), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,666 @@
+import heapq
+import unittest
+import numpy
+
+import config
+from GameEntity import GameEntity
+from EntityStore import EntityStore
+from Path import Path
+from Vector import Vec2d
+from helpers import truncate
+
+"""
+ Steering behaviours, from:
+  Reynolds, Steering Behaviors For Autonomous Characters
+ and the series at:
+  https://gamedevelopment.tutsplus.com/series/understanding-steering-behaviors--gamedev-12732
+"""
+
+# behaviours of the units of a SteeringSystem, as bit flags
+SEEK = 1
+FLEE = 2
+ARRIVE = 4
+SEPARATE = 8
+COHERE = 16
+AVOID = 32
+
+# the behaviours that head for or away from a target
+TARGETED = SEEK | FLEE | ARRIVE
+
+# what each behaviour is weighted by when they are added up
+SEPARATION_WEIGHT = 1.5
+COHESION_WEIGHT = 0.5
+AVOIDANCE_WEIGHT = 2.0
+
+
+def cellCentre(node):
+    """ Returns the centre of a path node, a Cell or an (x, y) point """
+
+    if hasattr(node, 'getRect'):
+        return node.getRect().center
+
+    return (node[0], node[1])
+
+
+class SteeringManager:
+    """ Adds up the steering forces on one MovingGameEntity.
+
+        Call the behaviours wanted each tick, then the entity's update takes
+        the total with getSteering, cut down to config.STEERING_MAX_FORCE
+        and over the entity's mass. The other units for separation and
+        cohesion come from the SpatialIndex the entity is in, at most
+        config.NEIGHBOUR_LIMIT of the nearest.
+
+        For many units at once a SteeringSystem does the same for every
+        unit of an EntityStore in one go."""
+
+    def __init__(self, host):
+        self.host = host
+        self.steering = Vec2d(0, 0)
+
+        # the path being followed and how far along it the host is
+        self.path = None
+        self.pathIndex = 0
+
+    def __repr__(self):
+        return 'SteeringManager({})'.format(self.steering)
+
+    def _desired(self, target, slowingRadius=0):
+        """ Returns the velocity that heads at full speed to target, slowing
+            down inside slowingRadius """
+
+        centre = self.host.getCentre()
+        offset = Vec2d(target[0] - centre.x, target[1] - centre.y)
+        distance = offset.get_length()
+        if distance == 0:
+            return offset
+
+        speed = self.host.getMaxSpeed()
+        if distance < slowingRadius:
+            speed *= distance / slowingRadius
+
+        offset *= speed / distance
+        return offset
+
+    def seek(self, target, weight=1):
+        self.steering += (self._desired(target) -
+                          self.host.getVelocity()) * weight
+
+    def flee(self, target, weight=1):
+        self.steering -= (self._desired(target) +
+                          self.host.getVelocity()) * weight
+
+    def arrive(self, target, slowingRadius=config.SLOWING_RADIUS, weight=1):
+        self.steering += (self._desired(target, slowingRadius) -
+                          self.host.getVelocity()) * weight
+
+    def followPath(self, path, radius=config.PATH_RADIUS, weight=1):
+        """ Seeks each cell of a path in turn, arriving at the last """
+
+        if path is not self.path:
+            self.path = path
+            self.pathIndex = 0
+
+        if path is None or not len(path):
+            return
+
+        centre = self.host.getCentre()
+        target = cellCentre(path[self.pathIndex])
+        while (self.pathIndex < len(path) - 1 and
+               centre.get_distance(target) < radius):
+            self.pathIndex += 1
+            target = cellCentre(path[self.pathIndex])
+
+        if self.pathIndex == len(path) - 1:
+            self.arrive(target, weight=weight)
+        else:
+            self.seek(target, weight)
+
+    def neighbours(self, radius=config.NEIGHBOUR_RADIUS,
+                   limit=config.NEIGHBOUR_LIMIT):
+        """ Returns up to limit of the nearest other entities within radius,
+            from the SpatialIndex the host is in """
+
+        index = self.host._spatialIndex
+        if index is None:
+            return []
+
+        centre = self.host.getCentre()
+        found = [(entity.getCentre().get_dist_sqrd(centre), id(entity),
+                  entity)
+                 for entity in index.queryRadius(centre, radius)
+                 if entity is not self.host]
+        return [entity for (distance, i, entity)
+                in heapq.nsmallest(limit, found)]
+
+    def separation(self, radius=config.NEIGHBOUR_RADIUS,
+                   weight=SEPARATION_WEIGHT):
+        """ Pushes away from the units nearby, harder the closer they are """
+
+        centre = self.host.getCentre()
+        away = Vec2d(0, 0)
+        for entity in self.neighbours(radius):
+            offset = centre - entity.getCentre()
+            distanceSqrd = offset.get_length_sqrd()
+            if distanceSqrd:
+                away += offset / distanceSqrd
+
+        if away.x or away.y:
+            self.steering += away.normalized() * (config.STEERING_MAX_FORCE *
+                                                  weight)
+
+    def cohesion(self, radius=config.NEIGHBOUR_RADIUS,
+                 weight=COHESION_WEIGHT):
+        """ Pulls towards the middle of the units nearby """
+
+        neighbours = self.neighbours(radius)
+        if not neighbours:
+            return
+
+        middle = Vec2d(0, 0)
+        for entity in neighbours:
+            middle += entity.getCentre()
+        middle /= len(neighbours)
+
+        offset = middle - self.host.getCentre()
+        if offset.x or offset.y:
+            self.steering += offset.normalized() * (
+                config.STEERING_MAX_FORCE * weight)
+
+    def avoidObstacles(self, theMap, distance=config.AVOID_DISTANCE,
+                       weight=AVOIDANCE_WEIGHT):
+        """ Steers away from impassable cells, or the edge of the map, that
+            are ahead of the host """
+
+        velocity = self.host.getVelocity()
+        speed = velocity.get_length()
+        if speed == 0:
+            return
+
+        centre = self.host.getCentre()
+        heading = velocity / speed
+        reach = distance * speed / self.host.getMaxSpeed()
+        for fraction in (0.5, 1):
+            ahead = centre + heading * (reach * fraction)
+            (x, y) = (int(ahead.x // theMap.cellWidth),
+                      int(ahead.y // theMap.cellHeight))
+            if theMap.inBounds((x, y)) and theMap.passable((x, y)):
+                continue
+
+            away = ahead - ((x + 0.5) * theMap.cellWidth,
+                            (y + 0.5) * theMap.cellHeight)
+            if not (away.x or away.y):
+                away = -heading
+            self.steering += away.normalized() * (config.STEERING_MAX_FORCE *
+                                                  weight)
+            return
+
+    def getSteering(self):
+        """ Returns the steering force over the host's mass, and starts
+            adding up again from nothing """
+
+        force = truncate(self.steering, config.STEERING_MAX_FORCE)
+        self.steering = Vec2d(0, 0)
+        return force / self.host.getMass()
+
+    def reset(self):
+        self.steering = Vec2d(0, 0)
+
+
+class SteeringSystem:
+    """ Steers every unit of an EntityStore in one go.
+
+        Each unit has bit flags of the behaviours it uses, SEEK, FLEE or
+        ARRIVE to its target, SEPARATE from and COHERE with the units nearby
+        and AVOID impassable cells, kept as columns of the store. update
+        works the forces out for all of them with numpy and adds them to
+        the store's steering, then the store's update moves them.
+
+        The units nearby are found by putting the units in buckets the size
+        of the neighbour radius, sorted by bucket, and looking at no more
+        than limit units in each of the nine buckets round a unit. So each
+        unit looks at a bounded number of others however many there are,
+        rather than every unit looking at every other."""
+
+    def __init__(self, store, theMap=None, radius=config.NEIGHBOUR_RADIUS,
+                 limit=config.NEIGHBOUR_LIMIT,
+                 maxForce=config.STEERING_MAX_FORCE,
+                 avoidDistance=config.AVOID_DISTANCE):
+        self.store = store
+        self.theMap = theMap
+        self.radius = radius
+        self.limit = limit
+        self.maxForce = maxForce
+        self.avoidDistance = avoidDistance
+
+        store.addColumn('target', (2,))
+        store.addColumn('behaviours', (), numpy.uint8, 0)
+        store.addColumn('slowingRadius', (), numpy.float64,
+                        config.SLOWING_RADIUS)
+
+        # entity -> [array of the centres of a path's cells, cursor]
+        self.paths = {}
+        self.pathRadius = config.PATH_RADIUS
+
+    def __repr__(self):
+        return 'SteeringSystem({} units, {} following paths)'.format(
+            len(self.store), len(self.paths))
+
+    def setBehaviours(self, entity, behaviours):
+        """ Sets the flags of the behaviours an entity uses """
+
+        self.store.behaviours[self.store.slotOf(entity)] = behaviours
+
+    def getBehaviours(self, entity):
+        return int(self.store.behaviours[self.store.slotOf(entity)])
+
+    def _setTarget(self, entity, target, behaviour):
+        slot = self.store.slotOf(entity)
+        self.store.target[slot] = (target[0], target[1])
+        self.store.behaviours[slot] = (
+            (int(self.store.behaviours[slot]) & ~TARGETED) | behaviour)
+
+    def seek(self, entity, target):
+        self.paths.pop(entity, None)
+        self._setTarget(entity, target, SEEK)
+
+    def flee(self, entity, target):
+        self.paths.pop(entity, None)
+        self._setTarget(entity, target, FLEE)
+
+    def arrive(self, entity, target, slowingRadius=config.SLOWING_RADIUS):
+        self.paths.pop(entity, None)
+        self.store.slowingRadius[self.store.slotOf(entity)] = slowingRadius
+        self._setTarget(entity, target, ARRIVE)
+
+    def followPath(self, entity, path):
+        """ Seeks each cell of a path in turn, arriving at the last """
+
+        if isinstance(path, Path):
+            # the centres of all the cells at once, without making them
+            size = numpy.array([config.CELL_WIDTH, config.CELL_HEIGHT])
+            points = (path.positions() * size + size // 2).astype(
+                numpy.float64)
+        else:
+            points = numpy.array([cellCentre(node) for node in path],
+                                 numpy.float64).reshape(-1, 2)
+        if not len(points):
+            self.stop(entity)
+            return
+
+        self.paths[entity] = [points, 0]
+        self._setTarget(entity, points[0], SEEK if len(points) > 1 else ARRIVE)
+
+    def remove(self, entity):
+        """ Takes a unit out of the store, and drops any path it follows """
+
+        self.paths.pop(entity, None)
+        self.store.remove(entity)
+
+    def stop(self, entity):
+        """ Stops seeking, fleeing, arriving or following a path """
+
+        self.paths.pop(entity, None)
+        slot = self.store.slotOf(entity)
+        self.store.behaviours[slot] = (int(self.store.behaviours[slot]) &
+                                       ~TARGETED)
+
+    def update(self):
+        """ Adds the steering of every unit to the store, call before the
+            store's update """
+
+        store = self.store
+        n = store.count
+        if not n:
+            return
+
+        centre = store.position[:n] + store.size[:n] / 2
+        velocity = store.velocity[:n]
+        maxSpeed = store.maxSpeed[:n]
+        behaviours = store.behaviours[:n]
+
+        if self.paths:
+            self._advancePaths(centre)
+
+        force = numpy.zeros((n, 2))
+
+        targeted = (behaviours & TARGETED) != 0
+        if targeted.any():
+            force[targeted] += self._targetForces(
+                numpy.flatnonzero(targeted), centre, velocity, maxSpeed)
+
+        social = (behaviours & (SEPARATE | COHERE)) != 0
+        if social.any():
+            (slots, away, middle) = self._neighbours(centre, social)
+            separate = (behaviours[slots] & SEPARATE) != 0
+            force[slots[separate]] += normalized(away[separate]) * (
+                self.maxForce * SEPARATION_WEIGHT)
+
+            cohere = (behaviours[slots] & COHERE) != 0
+            force[slots[cohere]] += normalized(
+                middle[cohere] - centre[slots[cohere]]) * (
+                self.maxForce * COHESION_WEIGHT)
+
+        avoid = (behaviours & AVOID) != 0
+        if self.theMap is not None and avoid.any():
+            slots = numpy.flatnonzero(avoid)
+            force[slots] += self._avoidance(slots, centre, velocity, maxSpeed)
+
+        # cut the total down to the max force
+        size = numpy.hypot(force[:, 0], force[:, 1])
+        over = size > self.maxForce
+        force[over] *= (self.maxForce / size[over])[:, None]
+
+        store.steering[:n] += force
+
+    def _advancePaths(self, centre):
+        """ Moves the units following paths on to their next cells, once
+            they are close enough to the cells they are heading for """
+
+        store = self.store
+
+        # units taken out of the store straight away have nothing to follow
+        for entity in [entity for entity in self.paths
+                       if entity not in store]:
+            del self.paths[entity]
+        if not self.paths:
+            return
+
+        entities = list(self.paths)
+        slots = numpy.array([store.slotOf(entity) for entity in entities])
+        offset = store.target[slots] - centre[slots]
+        reached = (offset[:, 0] ** 2 + offset[:, 1] ** 2 <
+                   self.pathRadius * self.pathRadius)
+
+        for i in numpy.flatnonzero(reached).tolist():
+            entity = entities[i]
+            follow = self.paths[entity]
+            (points, cursor) = follow
+            if cursor == len(points) - 1:
+                continue
+
+            cursor += 1
+            follow[1] = cursor
+            self._setTarget(entity, points[cursor],
+                            ARRIVE if cursor == len(points) - 1 else SEEK)
+
+    def _targetForces(self, slots, centre, velocity, maxSpeed):
+        """ Returns the forces of the units that seek, flee or arrive """
+
+        store = self.store
+        behaviours = store.behaviours[slots]
+        offset = store.target[slots] - centre[slots]
+        distance = numpy.hypot(offset[:, 0], offset[:, 1])
+        direction = normalized(offset, distance)
+
+        speed = maxSpeed[slots].copy()
+        arrive = (behaviours & ARRIVE) != 0
+        speed[arrive] *= numpy.minimum(
+            1, distance[arrive] / store.slowingRadius[slots[arrive]])
+
+        flee = (behaviours & FLEE) != 0
+        direction[flee] *= -1
+
+        return direction * speed[:, None] - velocity[slots]
+
+    def _neighbours(self, centre, active):
+        """ Returns the units that have units nearby, with the sum of the
+            pushes away from them and the middle of them """
+
+        n = len(centre)
+        radius = self.radius
+        buckets = numpy.floor(centre / radius).astype(numpy.int64)
+        buckets -= buckets.min(axis=0) - 1
+        (wide, high) = buckets.max(axis=0) + 2
+
+        if wide * high <= max(4096, n * 4):
+            # few enough buckets to look each one up in a table
+            ids = buckets[:, 0] * high + buckets[:, 1]
+            counts = numpy.bincount(ids, minlength=wide * high)
+            starts = numpy.cumsum(counts) - counts
+
+            def bucketRange(near):
+                start = starts[near]
+                return (start, start + counts[near])
+        else:
+            high = 1 << 32
+            ids = (buckets[:, 0] << 32) + buckets[:, 1]
+
+        order = numpy.argsort(ids, kind='stable')
+        if high == 1 << 32:
+            sortedIds = ids[order]
+
+            def bucketRange(near):
+                return (numpy.searchsorted(sortedIds, near, 'left'),
+                        numpy.searchsorted(sortedIds, near, 'right'))
+
+        units = numpy.flatnonzero(active)
+        unitIds = ids[units]
+        unitCentres = centre[units]
+        away = numpy.zeros((len(units), 2))
+        total = numpy.zeros((len(units), 2))
+        count = numpy.zeros(len(units))
+        radiusSqrd = radius * radius
+
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                (start, end) = bucketRange(unitIds + dx * high + dy)
+
+                for k in range(self.limit):
+                    position = start + k
+                    inBucket = position < end
+                    if not inBucket.any():
+                        break
+
+                    other = order[numpy.minimum(position, n - 1)]
+                    offset = unitCentres - centre[other]
+                    distanceSqrd = offset[:, 0] ** 2 + offset[:, 1] ** 2
+                    close = (inBucket & (other != units) &
+                             (distanceSqrd < radiusSqrd))
+
+                    # pushed away by 1 / distance, not at all by units in
+                    # the same place
+                    push = numpy.where(close & (distanceSqrd > 0),
+                                       1 / numpy.maximum(distanceSqrd, 1e-9),
+                                       0)
+                    away += offset * push[:, None]
+                    total += centre[other] * close[:, None]
+                    count += close
+
+        found = count > 0
+        middle = total[found] / count[found][:, None]
+        return (units[found], away[found], middle)
+
+    def _avoidance(self, slots, centre, velocity, maxSpeed):
+        """ Returns the forces that steer units away from impassable cells
+            ahead of them """
+
+        theMap = self.theMap
+        (cellWidth, cellHeight) = (theMap.cellWidth, theMap.cellHeight)
+
+        velocity = velocity[slots]
+        speed = numpy.hypot(velocity[:, 0], velocity[:, 1])
+        heading = normalized(velocity, speed)
+        reach = self.avoidDistance * speed / maxSpeed[slots]
+
+        force = numpy.zeros((len(slots), 2))
+        done = speed == 0
+        for fraction in (0.5, 1):
+            ahead = centre[slots] + heading * (reach * fraction)[:, None]
+            cells = numpy.floor(ahead / (cellWidth, cellHeight)).astype(
+                numpy.int64)
+            blocked = ~done & ~self._passable(cells)
+
+            away = ahead[blocked] - (cells[blocked] + 0.5) * (cellWidth,
+                                                              cellHeight)
+            still = (away == 0).all(axis=1)
+            away[still] = -heading[blocked][still]
+            force[blocked] = normalized(away) * (self.maxForce *
+                                                 AVOIDANCE_WEIGHT)
+            done |= blocked
+
+        return force
+
+    def _passable(self, cells):
+        """ Checks which of an array of cell indices are passable, cells off
+            the map are not """
+
+        grid = self.theMap.grid
+        (xs, ys) = (cells[:, 0], cells[:, 1])
+        inside = (xs >= 0) & (xs < grid.width) & (ys >= 0) & (ys < grid.height)
+
+        passable = numpy.zeros(len(cells), numpy.bool_)
+        if hasattr(grid, 'chunkSize'):
+            # a chunked grid is read a cell at a time
+            for i in numpy.flatnonzero(inside).tolist():
+                passable[i] = grid.passable[int(xs[i]), int(ys[i])]
+        else:
+            passable[inside] = grid.passable[xs[inside], ys[inside]]
+
+        return passable
+
+
+def normalized(vectors, lengths=None):
+    """ Returns an array of vectors scaled to length 1, or left at 0 """
+
+    if lengths is None:
+        lengths = numpy.hypot(vectors[:, 0], vectors[:, 1])
+
+    result = numpy.zeros_like(vectors, numpy.float64)
+    moving = lengths > 0
+    result[moving] = vectors[moving] / lengths[moving][:, None]
+    return result
+
+
+# unit testing
+class testSteering(unittest.TestCase):
+    def setUp(self):
+        import Map
+        self.theMap = Map.Map()
+        self.theMap.grid.passable[:] = True
+
+    def makeUnit(self, x, y, size=10):
+        unit = GameEntity()
+        unit.setPosition(x, y)
+        unit.setDimensions(size, size)
+        return unit
+
+    def test_arrive(self):
+        store = EntityStore()
+        system = SteeringSystem(store)
+        unit = self.makeUnit(0, 0)
+        store.add(unit)
+        system.arrive(unit, (200, 105))
+
+        for tick in range(300):
+            system.update()
+            store.update()
+
+        (x, y) = store.getPosition(unit)
+        self.assertAlmostEqual(x + 5, 200, 0)
+        self.assertAlmostEqual(y + 5, 105, 0)
+
+    def test_flee(self):
+        store = EntityStore()
+        system = SteeringSystem(store)
+        unit = self.makeUnit(100, 100)
+        store.add(unit)
+        system.flee(unit, (90, 105))
+
+        for tick in range(10):
+            system.update()
+            store.update()
+
+        self.assertGreater(store.getPosition(unit)[0], 110)
+
+    def test_separation(self):
+        store = EntityStore()
+        system = SteeringSystem(store, radius=32)
+        units = [self.makeUnit(100 + i, 100, 2) for i in range(5)]
+        for unit in units:
+            store.add(unit)
+            system.setBehaviours(unit, SEPARATE)
+
+        for tick in range(30):
+            system.update()
+            store.update()
+
+        xs = sorted(store.getPosition(unit)[0] for unit in units)
+        for (a, b) in zip(xs, xs[1:]):
+            self.assertGreater(b - a, 5)
+
+    def test_followPath(self):
+        m = self.theMap
+        m.grid.passable[5, 0:20] = False
+        store = EntityStore()
+        system = SteeringSystem(store, m)
+        unit = self.makeUnit(0, 0)
+        store.add(unit)
+        system.followPath(unit, m.findPath(m[0][0], m[9][0]))
+        system.setBehaviours(unit, system.getBehaviours(unit) | AVOID)
+
+        for tick in range(1000):
+            system.update()
+            store.update()
+
+        store.syncAll()
+        (x, y) = unit.getRect().center
+        self.assertEqual((x // m.cellWidth, y // m.cellHeight), (9, 0))
+
+    def test_removeFollower(self):
+        m = self.theMap
+        store = EntityStore()
+        system = SteeringSystem(store, m)
+        units = [self.makeUnit(0, 0), self.makeUnit(0, 64)]
+        for unit in units:
+            store.add(unit)
+            system.followPath(unit, m.findPath(m[0][0], m[9][0]))
+
+        # taken out of the store directly, or through the system
+        store.remove(units[0])
+        system.update()
+        self.assertEqual(list(system.paths), [units[1]])
+
+        system.remove(units[1])
+        system.update()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(system.paths, {})
+
+    def test_avoidance(self):
+        m = self.theMap
+        m.grid.passable[10, :] = False
+        store = EntityStore()
+        system = SteeringSystem(store, m)
+        unit = self.makeUnit(10 * 32 - 30, 100)
+        store.add(unit, velocity=(5, 0))
+        system.setBehaviours(unit, AVOID)
+        system.update()
+
+        self.assertLess(store.steering[0][0], 0)
+
+    def test_manager(self):
+        from MovingGameEntity import MovingGameEntity
+        from SpatialIndex import SpatialIndex
+
+        index = SpatialIndex()
+        units = []
+        for i in range(3):
+            unit = MovingGameEntity()
+            unit.setPosition(100 + i, 100)
+            unit.setDimensions(10, 10)
+            index.insert(unit)
+            units.append(unit)
+
+        for tick in range(100):
+            for unit in units:
+                unit.SManager.arrive((300, 105))
+                unit.SManager.separation(32)
+            for unit in units:
+                unit.update()
+
+        for unit in units:
+            self.assertLess(unit.getCentre().get_distance((300, 105)), 40)
+        self.assertGreater(units[0].distanceTo(units[1]), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,241 @@
+import math
+import unittest
+
 import GameEntity
+import MovementProfile
 import Path
 
+import config
+
 
 class StrategyEntity(GameEntity.GameEntity):
-    def __init__(self):
+    """ A unit that walks along a path, at speed pixels a second.
+
+        The path is pulled tight with the map's smoothPath, and the unit
+        goes in straight lines between the cells where it turns, keeping
+        its position in fractions of a pixel between ticks. Only the cells
+        under where it was drawn and where it is now are marked dirty each
+        move, however long the path. Without a map the unit goes from cell
+        to cell of the path as it is, and marks nothing dirty. """
+
+    def __init__(self, theMap=None, speed=config.UNIT_SPEED):
         GameEntity.GameEntity.__init__(self)
 
+        self.theMap = theMap
+        self.speed = speed
+
         self.path = Path.Path()
+        self.pathFuture = None
+        self.planner = None
+
+        # the cells where the path turns, and the next one to go to
+        self.waypoints = []
+        self.waypoint = 0
+
+        # the position with the fractions of a pixel that the rect drops
+        self._exact = None
+
+    def setMap(self, theMap):
+        self.theMap = theMap
 
     def setPath(self, path):
-        self.path = Path.Path(path)
+        """ Sets the path to follow, a list of cells or a Path. It can also
+            be a future from PathService.findPath, the entity keeps to its
+            current path until the future has the new one """
+
+        self.setPlanner(None)
+        if (hasattr(path, 'add_done_callback')):
+            self.pathFuture = path
+            path.add_done_callback(self.pathFound)
+        else:
+            self.pathFuture = None
+            if (not isinstance(path, Path.Path)):
+                path = Path.Path(path)
+            self._follow(path)
+
+    def pathFound(self, future):
+        """ Takes the path from a finished future, unless it was cancelled,
+            failed or another path has been set since """
+
+        if (future is not self.pathFuture):
+            return
+
+        self.pathFuture = None
+        if (not future.cancelled() and future.exception() is None):
+            self._follow(Path.Path(future.result()))
+
+    def setPlanner(self, planner):
+        """ Follows a planner from Map.planPath instead of a fixed path, so
+            the way is repaired when the map changes in front of the entity """
+
+        if (self.planner is not None):
+            self.planner.close()
+
+        self.planner = planner
+        if (planner is not None):
+            self.pathFuture = None
+            self._follow(planner.getPath())
+
+    def _follow(self, path):
+        """ Starts along a path, from the first of its turning points """
+
+        self.path = path
+        cells = path.getPath() or []
+
+        if (self.theMap is None):
+            self.waypoints = list(cells)
+        elif (self.planner is not None):
+            self.waypoints = self.theMap.smoothPath(cells,
+                                                    self.planner.profile)
+        else:
+            self.waypoints = self.theMap.smoothPath(cells)
+        self.waypoint = 0
+
+    def getWaypoints(self):
+        """ Returns the cells still to go to """
+
+        return self.waypoints[self.waypoint:]
+
+    def arrived(self):
+        return self.waypoint >= len(self.waypoints)
+
+    def move(self, dt=1.0 / config.TICK_RATE):
+        """ Walks dt seconds along the path """
+
+        if (self.planner is not None and self.planner.hasChanges()):
+            # the way ahead may be blocked, so it's worked out again from
+            # the cell the unit is over
+            self.planner.moveTo(self._cellUnder())
+            self._follow(self.planner.getPath())
+
+        if (self.arrived()):
+            return
+
+        # start again from the rect if something else has moved it
+        rect = self._rect
+        exact = self._exact
+        if (exact is None or (math.floor(exact[0]), math.floor(exact[1])) !=
+                (rect.x, rect.y)):
+            exact = (float(rect.x), float(rect.y))
+
+        (x, y) = exact
+        distance = self.speed * dt
+        while (distance > 0 and not self.arrived()):
+            target = self.waypoints[self.waypoint].getRect()
+            (dx, dy) = (target.x - x, target.y - y)
+            length = math.hypot(dx, dy)
+
+            if (length <= distance):
+                (x, y) = (target.x, target.y)
+                distance -= length
+                self.waypoint += 1
+            else:
+                x += dx * distance / length
+                y += dy * distance / length
+                distance = 0
+
+        self._exact = (x, y)
+        (newX, newY) = (int(math.floor(x)), int(math.floor(y)))
+        if ((newX, newY) != (rect.x, rect.y)):
+            if (self.theMap is not None):
+                self.theMap.makeRectDirty(rect)
+            self.setPosition(newX, newY)
+            if (self.theMap is not None):
+                self.theMap.makeRectDirty(rect)
+
+    def _cellUnder(self):
+        """ Returns the cell under the centre of the unit """
+
+        (x, y) = self._rect.center
+        return self.theMap.getCell(x // self.theMap.cellWidth,
+                                   y // self.theMap.cellHeight)
+
+
+# unit testing
+class testStrategyEntity(unittest.TestCase):
+    def setUp(self):
+        import Map
+
+        self.theMap = Map.Map()
+        grid = self.theMap.grid
+        grid.passable[:] = True
+        grid.cost[:] = 0
+        grid.changed(0, grid.width, 0, grid.height)
+
+        self.unit = StrategyEntity(self.theMap, speed=config.CELL_WIDTH * 3)
+        self.unit.setDimensions(config.CELL_WIDTH, config.CELL_HEIGHT)
+
+    def test_smoothPath(self):
+        m = self.theMap
+        path = m.findPath(m[2][2], m[12][6])
+        self.assertEqual(m.smoothPath(path), [m[2][2], m[12][6]])
+
+        # a wall in the way leaves a turn at its end
+        for y in range(0, 10):
+            m.grid.setPassable(7, y, False)
+        path = m.findPath(m[2][2], m[12][2])
+        waypoints = m.smoothPath(path)
+        self.assertEqual((waypoints[0], waypoints[-1]), (m[2][2], m[12][2]))
+        self.assertLess(len(waypoints), len(path))
+        for (a, b) in zip(waypoints, waypoints[1:]):
+            self.assertTrue(m.lineOfSight(a, b))
+
+    def test_lineOfSight(self):
+        m = self.theMap
+        m.grid.setPassable(3, 2, False)
+        self.assertFalse(m.lineOfSight(m[0][0], m[6][4]))
+        self.assertTrue(m.lineOfSight(m[0][0], m[6][0]))
+
+        # squeezing diagonally between two blocked cells
+        m.grid.setPassable(4, 4, False)
+        m.grid.setPassable(5, 5, False)
+        profile = MovementProfile.MovementProfile(cutCorners=False)
+        self.assertFalse(m.lineOfSight(m[4][5], m[5][4], profile))
+
+        # or onto dearer terrain
+        m.grid.setCost(8, 0, 5)
+        self.assertFalse(m.lineOfSight(m[6][0], m[10][0], maxCost=0))
+
+    def test_move(self):
+        m = self.theMap
+        unit = self.unit
+        unit.setPosition(m[2][2].getPosition())
+        unit.setPath(m.findPath(m[2][2], m[2][8]))
+        self.assertEqual(unit.getWaypoints(), [m[2][2], m[2][8]])
+
+        m.grid.dirty[:] = False
+        unit.move(0.5)
+        # a cell and a half down, in a straight line
+        self.assertEqual(unit.getRect().topleft,
+                         (2 * m.cellWidth, 3 * m.cellHeight + 16))
+
+        # only the cells under the sprite before and after are dirty
+        (xs, ys) = m.grid.dirty.nonzero()
+        self.assertEqual(set(zip(xs.tolist(), ys.tolist())),
+                         set([(2, 2), (2, 3), (2, 4)]))
+
+        for tick in range(10):
+            unit.move(0.5)
+        self.assertTrue(unit.arrived())
+        self.assertEqual(unit.getRect().topleft, m[2][8].getPosition())
+
+    def test_planner(self):
+        m = self.theMap
+        unit = self.unit
+        unit.setPosition(m[2][2].getPosition())
+        unit.setPlanner(m.planPath(m[2][2], m[2][12]))
+        self.assertEqual(unit.getWaypoints()[-1], m[2][12])
 
-    def move(self):
-        if (self.path is not None):
-            theMove = self.path.getNext()
+        unit.move(0.5)
+        for x in range(0, 6):
+            m.grid.setPassable(x, 8, False)
 
-            if (theMove is not None):
-                self.setPosition(theMove.getPosition())
+        for tick in range(40):
+            unit.move(0.5)
+            self.assertTrue(unit._cellUnder().passable)
+        self.assertTrue(unit.arrived())
+        self.assertEqual(unit.getRect().topleft, m[2][12].getPosition())
+        unit.setPlanner(None)
 
-            for cell in self.path:
-                cell.setDirty(True)
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import math
+import unittest
+import numpy
+
+import config
+
+"""
+ simplex noise based on Stefan Gustavson's paper:
+  http://staffwww.itn.liu.se/~stegu/simplexnoise/simplexnoise.pdf
+ computed over whole arrays of points at once instead of point by point
+"""
+
+F2 = 0.5 * (math.sqrt(3.0) - 1.0)
+G2 = (3.0 - math.sqrt(3.0)) / 6.0
+
+GRADIENTS = numpy.array([(1, 1), (-1, 1), (1, -1), (-1, -1),
+                         (1, 0), (-1, 0), (1, 0), (-1, 0),
+                         (0, 1), (0, -1), (0, 1), (0, -1)], numpy.float64)
+
+# gradient components looked up directly by hash value
+GRADIENT_X = GRADIENTS[numpy.arange(256) % 12, 0]
+GRADIENT_Y = GRADIENTS[numpy.arange(256) % 12, 1]
+
+
+def permutation(seed):
+    """ Returns the doubled permutation table for a seed """
+
+    perm = numpy.random.RandomState(seed).permutation(256)
+    return numpy.concatenate((perm, perm))
+
+
+def simplex2(x, y, perm):
+    """ 2D simplex noise for arrays of x and y, in the range -1 to 1 """
+
+    # skew the input space to find which simplex cell each point is in
+    s = (x + y) * F2
+    i = numpy.floor(x + s)
+    j = numpy.floor(y + s)
+    t = (i + j) * G2
+
+    # distances from the three corners of the simplex
+    x0 = x - i + t
+    y0 = y - j + t
+    i1 = x0 > y0
+    j1 = ~i1
+    x1 = x0 + G2
+    x1[i1] -= 1.0
+    y1 = y0 + G2
+    y1[j1] -= 1.0
+    x2 = x0 + (2.0 * G2 - 1.0)
+    y2 = y0 + (2.0 * G2 - 1.0)
+
+    # hashed gradient of each corner
+    ii = i.astype(numpy.intp) & 255
+    jj = j.astype(numpy.intp) & 255
+    h0 = perm[ii + perm[jj]]
+    h1 = perm[ii + i1 + perm[jj + j1]]
+    h2 = perm[ii + 1 + perm[jj + 1]]
+
+    total = numpy.zeros(numpy.shape(x))
+    for (cx, cy, h) in ((x0, y0, h0), (x1, y1, h1), (x2, y2, h2)):
+        falloff = 0.5 - cx * cx - cy * cy
+        numpy.maximum(falloff, 0.0, out=falloff)
+        falloff *= falloff
+        falloff *= falloff
+        total += falloff * (GRADIENT_X[h] * cx + GRADIENT_Y[h] * cy)
+
+    return 70.0 * total
+
+
+def classify(heights):
+    """ Returns the terrain type, passable flag and cost arrays for heights """
+
+    levels = numpy.array([level for (level, terrain) in config.TERRAIN_LEVELS])
+    types = numpy.array([config.TERRAIN_BASE] +
+                        [terrain for (level, terrain) in config.TERRAIN_LEVELS],
+                        numpy.uint8)
+    terrain = types[numpy.searchsorted(levels, heights, side='left')]
+
+    size = max(config.TERRAIN_PASSABLE) + 1
+    passableTable = numpy.zeros(size, numpy.bool_)
+    costTable = numpy.zeros(size, numpy.uint8)
+    for terrainType in config.TERRAIN_PASSABLE:
+        passableTable[terrainType] = config.TERRAIN_PASSABLE[terrainType]
+        costTable[terrainType] = config.TERRAIN_COST[terrainType]
+
+    return (terrain, passableTable[terrain], costTable[terrain])
+
+
+class TerrainGenerator:
+    """ Generates terrain heights from fractal simplex noise.
+
+        The same seed and parameters always give the same heights, and any
+        block of the world can be generated on its own."""
+
+    def __init__(self, seed=config.MAP_SEED, octaves=config.MAP_OCTAVES,
+                 persistence=0.5, lacunarity=2.0, scale=1.0,
+                 amplitude=5.0, base=20.0):
+        self.seed = seed
+        self.octaves = octaves
+        self.persistence = persistence
+        self.lacunarity = lacunarity
+        self.scale = scale
+        self.amplitude = amplitude
+        self.base = base
+
+        self._perm = permutation(seed)
+
+    def __repr__(self):
+        return 'TerrainGenerator({}, {})'.format(self.seed, self.octaves)
+
+    def heights(self, x, y, width, height):
+        """ Returns the heights of a width by height block, indexed [x, y] """
+
+        (xs, ys) = numpy.meshgrid(
+            numpy.arange(x, x + width, dtype=numpy.float64) * self.scale,
+            numpy.arange(y, y + height, dtype=numpy.float64) * self.scale,
+            indexing='ij')
+
+        total = numpy.zeros((width, height))
+        frequency = 1.0
+        amplitude = 1.0
+        maxAmplitude = 0.0
+        for octave in range(self.octaves):
+            total += simplex2(xs * frequency, ys * frequency,
+                              self._perm) * amplitude
+            maxAmplitude += amplitude
+            frequency *= self.lacunarity
+            amplitude *= self.persistence
+
+        return total / maxAmplitude * self.amplitude + self.base
+
+    def generate(self, grid, chunkSize=256):
+        """ Fills a grid with terrain, chunkSize columns at a time so the
+            temporary arrays stay small on huge maps """
+
+        for x in range(0, grid.width, chunkSize):
+            width = min(chunkSize, grid.width - x)
+            grid.setBlock(x, 0, self.heights(x, 0, width, grid.height))
+
+
+# unit testing
+class testTerrain(unittest.TestCase):
+    def test_simplex2(self):
+        (xs, ys) = numpy.meshgrid(numpy.linspace(-50, 50, 101),
+                                  numpy.linspace(-50, 50, 101))
+        values = simplex2(xs * 0.37, ys * 0.37, permutation(1))
+
+        self.assertTrue(numpy.all(values >= -1.0))
+        self.assertTrue(numpy.all(values <= 1.0))
+        self.assertGreater(values.std(), 0.1)
+
+    def test_reproducible(self):
+        first = TerrainGenerator(seed=5).heights(10, 20, 30, 40)
+        second = TerrainGenerator(seed=5).heights(10, 20, 30, 40)
+        other = TerrainGenerator(seed=6).heights(10, 20, 30, 40)
+
+        self.assertTrue(numpy.array_equal(first, second))
+        self.assertFalse(numpy.array_equal(first, other))
+
+    def test_blocks(self):
+        generator = TerrainGenerator(seed=3)
+        whole = generator.heights(0, 0, 64, 64)
+        block = generator.heights(16, 32, 8, 8)
+
+        self.assertTrue(numpy.allclose(whole[16:24, 32:40], block))
+
+    def test_classify(self):
+        (terrain, passable, cost) = classify(numpy.array([15.0, 20.0, 25.0]))
+
+        self.assertEqual(list(terrain), [config.TERRAIN_WATER,
+                                         config.TERRAIN_WATER,
+                                         config.TERRAIN_GRASS])
+        self.assertEqual(list(passable), [False, False, True])
+
+if __name__ == "__main__":
+    unittest.main()
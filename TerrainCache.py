@@ -0,0 +1,233 @@
+import collections
+import unittest
+import pygame
+from pygame import Rect, Surface
+
+import config
+from Grid import Grid
+from Tileset import Tileset
+
+
+class TerrainCache:
+    """ Keeps the terrain of square chunks of the map drawn onto surfaces.
+
+        A chunk is drawn a tile at a time the first time it is used, after
+        that any part of it can be drawn to the screen with one blit. The
+        least recently used chunks are dropped when the surfaces take more
+        than memory bytes.
+
+        Cells that change are drawn again onto the chunks that are loaded,
+        or for a big change the chunks are dropped and drawn again when they
+        are next used."""
+
+    def __init__(self, grid, tileset, chunkCells=config.RENDER_CHUNK_CELLS,
+                 memory=config.RENDER_CHUNK_MEMORY,
+                 cellWidth=config.CELL_WIDTH, cellHeight=config.CELL_HEIGHT):
+        self.grid = grid
+        self.tileset = tileset
+        self.chunkCells = chunkCells
+        self.memory = memory
+        self.cellWidth = cellWidth
+        self.cellHeight = cellHeight
+
+        self.surfaces = collections.OrderedDict()
+        self.nbytes = 0
+
+        # whether the surfaces are in the display format
+        self._converted = False
+
+        grid.addListener(self.cellsChanged)
+
+    def __repr__(self):
+        return 'TerrainCache({} chunks, {} bytes)'.format(len(self.surfaces),
+                                                         self.nbytes)
+
+    def clear(self):
+        self.surfaces.clear()
+        self.nbytes = 0
+
+    def convert(self):
+        """ Converts the loaded surfaces to the display format, so blitting
+            them doesn't have to convert pixels every time.
+
+            Can only be done after the display mode is set, returns False if
+            there is no display yet."""
+
+        if pygame.display.get_surface() is None:
+            return False
+
+        for key in self.surfaces:
+            self.surfaces[key] = self.surfaces[key].convert()
+
+        self._converted = True
+        return True
+
+    def getSurface(self, chunkX, chunkY):
+        """ Returns the surface of a chunk, drawing it if needed """
+
+        if not self._converted:
+            self.convert()
+
+        key = (chunkX, chunkY)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+
+        surface = Surface((self.chunkCells * self.cellWidth,
+                           self.chunkCells * self.cellHeight))
+        if self._converted:
+            surface = surface.convert()
+        x = chunkX * self.chunkCells
+        y = chunkY * self.chunkCells
+        self._drawCells(surface, x, x + self.chunkCells, y, y + self.chunkCells)
+
+        self.surfaces[key] = surface
+        self.nbytes += surface.get_bytesize() * surface.get_width() * \
+            surface.get_height()
+        while self.nbytes > self.memory and len(self.surfaces) > 1:
+            (oldKey, old) = self.surfaces.popitem(last=False)
+            self.nbytes -= old.get_bytesize() * old.get_width() * \
+                old.get_height()
+
+        return surface
+
+    def _drawCells(self, surface, x_min, x_max, y_min, y_max):
+        """ Draws a range of cells onto the surface of the chunk they are in """
+
+        x_max = min(x_max, self.grid.width)
+        y_max = min(y_max, self.grid.height)
+        if x_min >= x_max or y_min >= y_max:
+            return
+
+        originX = (x_min // self.chunkCells) * self.chunkCells
+        originY = (y_min // self.chunkCells) * self.chunkCells
+        terrain = self.grid.terrain[x_min:x_max, y_min:y_max]
+
+        areas = {}
+        blits = []
+        for x in range(x_max - x_min):
+            screenX = (x_min + x - originX) * self.cellWidth
+            for (y, cellTerrain) in enumerate(terrain[x].tolist()):
+                if cellTerrain not in areas:
+                    areas[cellTerrain] = self.tileset.getArea(cellTerrain)
+                (image, area) = areas[cellTerrain]
+
+                position = (screenX, (y_min + y - originY) * self.cellHeight)
+                if area is None:
+                    blits.append((image, position))
+                else:
+                    blits.append((image, position, area))
+
+        surface.blits(blits, False)
+
+    def cellsChanged(self, x_min, x_max, y_min, y_max):
+        size = self.chunkCells
+
+        # only the loaded chunks matter, and there are far fewer of them than
+        # chunks in a big change like generating a whole world
+        (chunkX_min, chunkX_max) = (x_min // size, (x_max - 1) // size)
+        (chunkY_min, chunkY_max) = (y_min // size, (y_max - 1) // size)
+        chunks = [(chunkX, chunkY) for (chunkX, chunkY) in self.surfaces
+                  if chunkX_min <= chunkX <= chunkX_max and
+                  chunkY_min <= chunkY <= chunkY_max]
+
+        if (x_max - x_min) * (y_max - y_min) > size * size:
+            # cheaper to draw the chunks again when they're next used
+            for key in chunks:
+                surface = self.surfaces.pop(key)
+                self.nbytes -= surface.get_bytesize() * \
+                    surface.get_width() * surface.get_height()
+            return
+
+        for (chunkX, chunkY) in chunks:
+            self._drawCells(self.surfaces[(chunkX, chunkY)],
+                            max(x_min, chunkX * size),
+                            min(x_max, (chunkX + 1) * size),
+                            max(y_min, chunkY * size),
+                            min(y_max, (chunkY + 1) * size))
+
+    def blitsFor(self, rect):
+        """ Returns the blits that draw the terrain in a rect of the map, in
+            pixels, with positions relative to the rect's top left """
+
+        chunkWidth = self.chunkCells * self.cellWidth
+        chunkHeight = self.chunkCells * self.cellHeight
+
+        # only the chunks that are on the map
+        right = min(rect.right, self.grid.width * self.cellWidth)
+        bottom = min(rect.bottom, self.grid.height * self.cellHeight)
+
+        blits = []
+        for chunkX in range(max(0, rect.left) // chunkWidth,
+                            (right - 1) // chunkWidth + 1):
+            for chunkY in range(max(0, rect.top) // chunkHeight,
+                                (bottom - 1) // chunkHeight + 1):
+                chunkRect = Rect(chunkX * chunkWidth, chunkY * chunkHeight,
+                                 chunkWidth, chunkHeight)
+                part = chunkRect.clip(rect)
+                if not part.width or not part.height:
+                    continue
+
+                blits.append((self.getSurface(chunkX, chunkY),
+                              (part.x - rect.x, part.y - rect.y),
+                              part.move(-chunkRect.x, -chunkRect.y)))
+
+        return blits
+
+
+# unit testing
+class testTerrainCache(unittest.TestCase):
+    def setUp(self):
+        self.grid = Grid(10, 10)
+        self.grid.terrain[5, 5] = config.TERRAIN_WATER
+        self.tileset = Tileset({config.TERRAIN_GRASS: Surface((2, 2)),
+                                config.TERRAIN_WATER: Surface((2, 2))})
+        self.tileset.getImage(config.TERRAIN_GRASS).fill((0, 255, 0))
+        self.tileset.getImage(config.TERRAIN_WATER).fill((0, 0, 255))
+
+    def makeCache(self, memory=1024 * 1024):
+        return TerrainCache(self.grid, self.tileset, 4, memory, 2, 2)
+
+    def test_blitsFor(self):
+        cache = self.makeCache()
+        screen = Surface((8, 8))
+        screen.blits(cache.blitsFor(Rect(6, 6, 8, 8)))
+
+        self.assertEqual(len(cache.blitsFor(Rect(6, 6, 8, 8))), 4)
+        self.assertEqual(screen.get_at((4, 4)), pygame.Color(0, 0, 255))
+        self.assertEqual(screen.get_at((0, 0)), pygame.Color(0, 255, 0))
+
+    def test_cellsChanged(self):
+        cache = self.makeCache()
+        surface = cache.getSurface(1, 1)
+
+        self.grid.setTerrainHeight(6, 6, 0)
+        self.assertEqual(surface.get_at((4, 4)), pygame.Color(0, 0, 255))
+
+    def test_eviction(self):
+        chunkBytes = Surface((8, 8)).get_bytesize() * 64
+        cache = self.makeCache(chunkBytes * 2)
+        for chunkX in range(3):
+            cache.getSurface(chunkX, 0)
+
+        self.assertEqual(list(cache.surfaces), [(1, 0), (2, 0)])
+        self.assertEqual(cache.nbytes, chunkBytes * 2)
+
+    def test_convert(self):
+        cache = self.makeCache()
+        cache.getSurface(0, 0)
+        self.assertFalse(cache.convert())
+
+        display = pygame.display.set_mode((8, 8))
+        try:
+            self.assertTrue(cache.convert())
+            for surface in [cache.surfaces[(0, 0)], cache.getSurface(1, 0)]:
+                self.assertEqual(surface.get_bitsize(), display.get_bitsize())
+            self.assertEqual(cache.getSurface(1, 1).get_at((2, 2)),
+                             pygame.Color(0, 0, 255))
+        finally:
+            pygame.display.quit()
+
+if __name__ == "__main__":
+    unittest.main()
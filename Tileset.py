@@ -0,0 +1,166 @@
+import os.path
+import tempfile
+import unittest
+import pygame
+from pygame import Rect, Surface
+
+import config
+
+
+class Tileset:
+    """ Holds one shared image per terrain type.
+
+        Every image is loaded from disk once, no matter how many cells use
+        it. Images can come from separate files (see config.TERRAIN_IMAGES)
+        or from a single atlas sheet, in which case each terrain type is a
+        sub-rect of the sheet."""
+
+    def __init__(self, images=None):
+        self._images = {}
+        self._areas = {}
+        self._sheet = None
+        self._converted = False
+
+        if images is None:
+            images = config.TERRAIN_IMAGES
+
+        for terrain in images:
+            self.loadImage(terrain, images[terrain])
+
+    def loadImage(self, terrain, image):
+        """ Sets the image for a terrain type, from a path or a surface """
+
+        if not hasattr(image, 'fill'):
+            if not os.path.isfile(image):
+                raise Exception("Invalid tile image path: " + image)
+            image = pygame.image.load(image)
+
+        self._images[terrain] = image
+        self._areas[terrain] = (image, None)
+        self._converted = False
+
+    def loadAtlas(self, atlasPath, terrainOrder=None,
+                  tileWidth=config.CELL_WIDTH, tileHeight=config.CELL_HEIGHT):
+        """ Loads a tileset sheet and splits it into tiles.
+
+            Tiles are read left to right, top to bottom, and assigned to the
+            terrain types in terrainOrder (by default sorted by type)."""
+
+        if not os.path.isfile(atlasPath):
+            raise Exception("Invalid tileset path: " + atlasPath)
+
+        if terrainOrder is None:
+            terrainOrder = sorted(config.TERRAIN_IMAGES)
+
+        sheet = pygame.image.load(atlasPath)
+        columns = sheet.get_width() // tileWidth
+        rows = sheet.get_height() // tileHeight
+
+        if len(terrainOrder) > columns * rows:
+            raise Exception("Tileset " + atlasPath + " has too few tiles")
+
+        self._sheet = sheet
+        for index, terrain in enumerate(terrainOrder):
+            area = Rect((index % columns) * tileWidth,
+                        (index // columns) * tileHeight,
+                        tileWidth, tileHeight)
+            self._images[terrain] = sheet.subsurface(area)
+            self._areas[terrain] = (sheet, area)
+
+        self._converted = False
+
+    def convert(self):
+        """ Converts the images to the display format.
+
+            Can only be done after the display mode is set, returns False if
+            there is no display yet."""
+
+        if pygame.display.get_surface() is None:
+            return False
+
+        if self._sheet is not None:
+            sheet = self._sheet.convert()
+        else:
+            sheet = None
+
+        for terrain in self._images:
+            image, area = self._areas[terrain]
+            if area is not None and image is self._sheet:
+                self._images[terrain] = sheet.subsurface(area)
+                self._areas[terrain] = (sheet, area)
+            else:
+                image = image.convert()
+                self._images[terrain] = image
+                self._areas[terrain] = (image, None)
+
+        self._sheet = sheet
+        self._converted = True
+        return True
+
+    def getImage(self, terrain):
+        """ Returns the shared surface for a terrain type """
+
+        if not self._converted:
+            self.convert()
+
+        return self._images[terrain]
+
+    def getArea(self, terrain):
+        """ Returns (surface, area) for blitting a terrain type.
+
+            area is None when the surface is the whole tile, otherwise it is
+            the rect of the tile inside the atlas sheet."""
+
+        if not self._converted:
+            self.convert()
+
+        return self._areas[terrain]
+
+    def getTerrainTypes(self):
+        return list(self._images)
+
+
+# unit testing
+class testTileset(unittest.TestCase):
+    def test_sharedImage(self):
+        tileset = Tileset()
+
+        image = tileset.getImage(config.TERRAIN_GRASS)
+        self.assertIs(tileset.getImage(config.TERRAIN_GRASS), image)
+        self.assertIsNot(tileset.getImage(config.TERRAIN_WATER), image)
+
+    def test_loadImage(self):
+        surface = Surface((config.CELL_WIDTH, config.CELL_HEIGHT))
+        tileset = Tileset({})
+        tileset.loadImage(config.TERRAIN_GRASS, surface)
+
+        self.assertIs(tileset.getImage(config.TERRAIN_GRASS), surface)
+        self.assertRaises(Exception, tileset.loadImage,
+                          config.TERRAIN_WATER, "missing.png")
+
+    def test_getArea(self):
+        tileset = Tileset()
+        (image, area) = tileset.getArea(config.TERRAIN_WATER)
+
+        self.assertIs(image, tileset.getImage(config.TERRAIN_WATER))
+        self.assertIsNone(area)
+
+    def test_loadAtlas(self):
+        sheet = Surface((config.CELL_WIDTH * 2, config.CELL_HEIGHT))
+        sheet.fill(pygame.Color(0, 0, 255), Rect(0, 0, config.CELL_WIDTH,
+                                                 config.CELL_HEIGHT))
+        sheetPath = os.path.join(tempfile.mkdtemp(), 'tiles.png')
+        pygame.image.save(sheet, sheetPath)
+
+        tileset = Tileset({})
+        tileset.loadAtlas(sheetPath, [config.TERRAIN_WATER,
+                                      config.TERRAIN_GRASS])
+
+        (image, area) = tileset.getArea(config.TERRAIN_GRASS)
+        self.assertEqual(area, Rect(config.CELL_WIDTH, 0,
+                                    config.CELL_WIDTH, config.CELL_HEIGHT))
+        water = tileset.getImage(config.TERRAIN_WATER)
+        self.assertEqual(water.get_at((0, 0)), pygame.Color(0, 0, 255))
+
+if __name__ == "__main__":
+    unittest.main()
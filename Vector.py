@@ -10,12 +10,15 @@ class Vec2d(object):
     __slots__ = ['x', 'y']
 
     def __init__(self, x_or_pair, y = None):
-        if y is None:
-            self.x = x_or_pair[0]
-            self.y = x_or_pair[1]
-        else:
+        if y is not None:
             self.x = x_or_pair
             self.y = y
+        elif isinstance(x_or_pair, Vec2d):
+            self.x = x_or_pair.x
+            self.y = x_or_pair.y
+        else:
+            self.x = x_or_pair[0]
+            self.y = x_or_pair[1]
 
     def __len__(self):
         return 2
@@ -42,13 +45,17 @@ class Vec2d(object):
 
     # Comparison
     def __eq__(self, other):
-        if hasattr(other, "__getitem__") and len(other) == 2:
+        if isinstance(other, Vec2d):
+            return self.x == other.x and self.y == other.y
+        elif hasattr(other, "__getitem__") and len(other) == 2:
             return self.x == other[0] and self.y == other[1]
         else:
             return False
 
     def __ne__(self, other):
-        if hasattr(other, "__getitem__") and len(other) == 2:
+        if isinstance(other, Vec2d):
+            return self.x != other.x or self.y != other.y
+        elif hasattr(other, "__getitem__") and len(other) == 2:
             return self.x != other[0] or self.y != other[1]
         else:
             return True
@@ -162,32 +169,57 @@ class Vec2d(object):
         return self
 
     # Division
-    def __div__(self, other):
-        return self._o2(other, operator.div)
+    def __truediv__(self, other):
+        if isinstance(other, Vec2d):
+            return Vec2d(self.x / other.x, self.y / other.y)
+        elif (hasattr(other, "__getitem__")):
+            return Vec2d(self.x / other[0], self.y / other[1])
+        else:
+            return Vec2d(self.x / other, self.y / other)
+    __div__ = __truediv__
 
-    def __rdiv__(self, other):
-        return self._r_o2(other, operator.div)
+    def __rtruediv__(self, other):
+        if (hasattr(other, "__getitem__")):
+            return Vec2d(other[0] / self.x, other[1] / self.y)
+        else:
+            return Vec2d(other / self.x, other / self.y)
+    __rdiv__ = __rtruediv__
 
-    def __idiv__(self, other):
-        return self._io(other, operator.div)
+    def __itruediv__(self, other):
+        if isinstance(other, Vec2d):
+            self.x /= other.x
+            self.y /= other.y
+        elif (hasattr(other, "__getitem__")):
+            self.x /= other[0]
+            self.y /= other[1]
+        else:
+            self.x /= other
+            self.y /= other
+        return self
+    __idiv__ = __itruediv__
 
     def __floordiv__(self, other):
-        return self._o2(other, operator.floordiv)
+        if isinstance(other, Vec2d):
+            return Vec2d(self.x // other.x, self.y // other.y)
+        elif (hasattr(other, "__getitem__")):
+            return Vec2d(self.x // other[0], self.y // other[1])
+        else:
+            return Vec2d(self.x // other, self.y // other)
 
     def __rfloordiv__(self, other):
         return self._r_o2(other, operator.floordiv)
 
     def __ifloordiv__(self, other):
-        return self._io(other, operator.floordiv)
-
-    def __truediv__(self, other):
-        return self._o2(other, operator.truediv)
-
-    def __rtruediv__(self, other):
-        return self._r_o2(other, operator.truediv)
-
-    def __itruediv__(self, other):
-        return self._io(other, operator.floordiv)
+        if isinstance(other, Vec2d):
+            self.x //= other.x
+            self.y //= other.y
+        elif (hasattr(other, "__getitem__")):
+            self.x //= other[0]
+            self.y //= other[1]
+        else:
+            self.x //= other
+            self.y //= other
+        return self
 
     # Modulo
     def __mod__(self, other):
@@ -236,10 +268,10 @@ class Vec2d(object):
 
     # Unary operations
     def __neg__(self):
-        return Vec2d(operator.neg(self.x), operator.neg(self.y))
+        return Vec2d(-self.x, -self.y)
 
     def __pos__(self):
-        return Vec2d(operator.pos(self.x), operator.pos(self.y))
+        return Vec2d(self.x, self.y)
 
     def __abs__(self):
         return Vec2d(abs(self.x), abs(self.y))
@@ -249,10 +281,10 @@ class Vec2d(object):
 
     # vectory functions
     def get_length_sqrd(self):
-        return self.x**2 + self.y**2
+        return self.x*self.x + self.y*self.y
 
     def get_length(self):
-        return math.sqrt(self.x**2 + self.y**2)
+        return math.hypot(self.x, self.y)
 
     def __setlength(self, value):
         length = self.get_length()
@@ -297,10 +329,10 @@ class Vec2d(object):
         return math.degrees(math.atan2(cross, dot))
 
     def normalized(self):
-        length = self.length
+        length = math.hypot(self.x, self.y)
         if length != 0:
-            return self/length
-        return Vec2d(self)
+            return Vec2d(self.x/length, self.y/length)
+        return Vec2d(self.x, self.y)
 
     def normalize_return_length(self):
         length = self.length
@@ -460,6 +492,13 @@ if __name__ == "__main__":
             inplace_vec += Vec2d(-1, -1)
             self.assertEquals(inplace_vec, inplace_ref)
 
+        def testDivision(self):
+            v = Vec2d(5, 9)
+            v /= 2
+            self.assertEqual(v, (2.5, 4.5))
+            self.assertEqual(Vec2d(5, 9) // 2, (2, 4))
+            self.assertEqual(v.__div__(Vec2d(2.5, 1.5)), (1, 3))
+
         def testPickle(self):
             testvec = Vec2d(5, .3)
             testvec_str = pickle.dumps(testvec)
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import pygame
 from pygame import Rect, Surface
 from GameEntity import GameEntity
 from pygame import locals
 
+import config
+
 
 class Viewport(GameEntity):
     """ Viewport class designed to be game independant."""
@@ -24,6 +27,12 @@ class Viewport(GameEntity):
         # used to centre the viewport on a gameObject's position
         self.track = None
 
+        # the parts of the screen drawn to since the last present, and the
+        # sprites drawn over the map this frame and last
+        self.dirtyRects = []
+        self.overlays = []
+        self.lastOverlays = []
+
     def inView(self, rect):
         """ Checks if any part of a rect is in the viewport """
 
@@ -57,9 +66,8 @@ class Viewport(GameEntity):
     def enforceLimits(self):
         """ Checks if the current viewport position is beyond bounds """
 
-        pos = self.getPosition()
         if (self.limits[0]):
-            if (pos.x < self.limits[0]):
+            if (self._rect.x < self.limits[0]):
                 self._rect.x = self.limits[0]
 
         if (self.limits[1]):
@@ -67,7 +75,7 @@ class Viewport(GameEntity):
                 self._rect.x = self.limits[1] - self._rect.width
 
         if (self.limits[2]):
-            if (pos.y < self.limits[2]):
+            if (self._rect.y < self.limits[2]):
                 self._rect.y = self.limits[2]
 
         if (self.limits[3]):
@@ -78,17 +86,80 @@ class Viewport(GameEntity):
         self.enforceLimits()
 
     def draw(self, image, position):
-        # get a vector of the local position of the sprite
-        local_vec = position - self.getPosition()
+        """ Draws an image at a position in global co-ords, which can be a
+            Vector, a tuple or a rect """
 
         # draw the sprite's image to the local position
-        self.screen.blit(image, (local_vec.x, local_vec.y))
+        self.markOverlay(self.screen.blit(image,
+                                          (position[0] - self._rect.x,
+                                           position[1] - self._rect.y)))
+
+    def drawMany(self, blits):
+        """ Draws a list of (image, (x, y)) or (image, (x, y), area) in one
+            go, with x, y already in screen co-ords """
+
+        if not blits:
+            return
+
+        rects = self.screen.blits(blits)
+        if (len(rects) > config.DIRTY_RECT_LIMIT):
+            # one rect round them all is quicker to update than many
+            self.markDirty(rects[0].unionall(rects))
+        else:
+            self.dirtyRects.extend(rects)
+
+    def markDirty(self, rect):
+        """ Adds a part of the screen, in screen co-ords, to be updated by
+            the next present """
+
+        self.dirtyRects.append(Rect(rect))
+
+    def markOverlay(self, rect):
+        """ Marks a part of the screen that has been drawn over the map, so
+            that scrolling knows to draw the map there again """
+
+        self.markDirty(rect)
+        self.overlays.append(Rect(rect))
+
+    def scroll(self, offset):
+        """ Moves the viewport by offset, copying what is still on screen
+            into place rather than drawing it again.
+
+            @return the rects of the screen that scrolled into view and have
+            to be drawn """
+
+        (dx, dy) = (int(offset[0]), int(offset[1]))
+        self.move(dx, dy)
+        self.screen.scroll(-dx, -dy)
+        self.markDirty(self.screen.get_rect())
+
+        (width, height) = self.screen.get_size()
+        exposed = []
+        if (dx):
+            x = width - dx if dx > 0 else 0
+            exposed.append(Rect(x, 0, min(abs(dx), width), height))
+        if (dy):
+            y = height - dy if dy > 0 else 0
+            exposed.append(Rect(0, y, width, min(abs(dy), height)))
+
+        return exposed
+
+    def present(self):
+        """ Updates the parts of the display that have been drawn to since
+            the last call, instead of flipping the whole screen """
+
+        if (self.dirtyRects and pygame.display.get_surface() is self.screen):
+            pygame.display.update(self.dirtyRects)
+
+        self.dirtyRects = []
+        self.lastOverlays = self.overlays
+        self.overlays = []
 
     def getLocalPosition(self, position):
         return position - self.getPosition()
 
     def fillScreen(self):
-        self.screen.fill(locals.Color(255, 255, 255))
+        self.markDirty(self.screen.fill(locals.Color(255, 255, 255)))
 
 
 # unit testing
@@ -136,5 +207,29 @@ class testViewport(unittest.TestCase):
         rect = Rect(2000, 2000, 100, 100)
         self.assertFalse(vp.inView(rect))
 
+    def test_scroll(self):
+        vp = Viewport(self.screen)
+        self.screen.fill((0, 0, 0))
+        self.screen.fill((255, 0, 0), Rect(100, 100, 10, 10))
+
+        exposed = vp.scroll((32, -16))
+        self.assertEqual(vp.getPosition(), (32, -16))
+        self.assertEqual(self.screen.get_at((68, 116)), (255, 0, 0))
+        self.assertEqual(exposed, [Rect(568, 0, 32, 600), Rect(0, 0, 600, 16)])
+
+    def test_dirtyRects(self):
+        vp = Viewport(self.screen)
+        vp.setPosition(100, 100)
+        tile = Surface((10, 10))
+
+        vp.draw(tile, vp.getPosition() + (5, 5))
+        vp.drawMany([(tile, (20, 20)), (tile, (40, 40), Rect(0, 0, 5, 5))])
+        self.assertEqual(vp.dirtyRects, [Rect(5, 5, 10, 10),
+                                         Rect(20, 20, 10, 10),
+                                         Rect(40, 40, 5, 5)])
+
+        vp.present()
+        self.assertEqual(vp.dirtyRects, [])
+
 if __name__ == "__main__":
     unittest.main()
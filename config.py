@@ -5,3 +5,100 @@ MAP_WIDTH = 1024
 MAP_HEIGHT = 1024
 CELL_WIDTH = 32
 CELL_HEIGHT = 32
+
+# terrain types
+TERRAIN_WATER = 0
+TERRAIN_GRASS = 1
+
+# one image per terrain type, loaded once by the Tileset
+TERRAIN_IMAGES = {
+    TERRAIN_WATER: './img/water_1.png',
+    TERRAIN_GRASS: './img/grass_1.png',
+}
+
+# terrain generation
+MAP_SEED = 0
+MAP_OCTAVES = 10
+
+# a cell is the terrain of the highest level its height is above, or
+# TERRAIN_BASE if it is below them all
+TERRAIN_BASE = TERRAIN_WATER
+TERRAIN_LEVELS = (
+    (20, TERRAIN_GRASS),
+)
+
+TERRAIN_PASSABLE = {
+    TERRAIN_WATER: False,
+    TERRAIN_GRASS: True,
+}
+
+TERRAIN_COST = {
+    TERRAIN_WATER: 0,
+    TERRAIN_GRASS: 0,
+}
+
+# chunked worlds, sizes are in cells
+WORLD_WIDTH = 2 ** 24
+WORLD_HEIGHT = 2 ** 24
+CHUNK_SIZE = 64
+CHUNK_MEMORY = 32 * 1024 * 1024
+
+# how far around the start and finish a search on a chunked world can go
+SEARCH_MARGIN = 64
+
+# allow diagonal moves between two impassable cells or past their corners
+PATH_CUT_CORNERS = False
+
+# path query cache, the region size is in cells
+PATH_CACHE_SIZE = 256
+PATH_CACHE_REGION = 16
+
+# size in cells of the clusters used by hierarchical pathfinding
+CLUSTER_SIZE = 16
+
+# how many flow fields to keep, each takes around 10 bytes per cell
+FLOW_FIELD_CACHE_SIZE = 16
+
+# worker processes for finding paths off the main loop
+PATH_WORKERS = 2
+
+# cells a time sliced path search expands each step, and that all of them
+# together can expand each frame
+PATH_SEARCH_BUDGET = 256
+PATH_FRAME_BUDGET = 2048
+
+# above this many rects drawn at once they are updated as one rect round them
+DIRTY_RECT_LIMIT = 64
+
+# pre-drawn terrain, chunk size in cells and the memory the surfaces can use
+RENDER_CHUNK_CELLS = 16
+RENDER_CHUNK_MEMORY = 64 * 1024 * 1024
+
+# size in pixels of the buckets of the spatial index of entities
+SPATIAL_BUCKET_SIZE = CELL_WIDTH * 2
+
+# how fast an entity can move, in pixels a tick, and how heavy it is to steer
+ENTITY_MAX_SPEED = 5
+ENTITY_MASS = 2
+
+# how fast a unit walks along its path, in pixels a second
+UNIT_SPEED = CELL_WIDTH * 2
+
+# steering, forces are in pixels a tick per tick and distances in pixels
+STEERING_MAX_FORCE = 1
+# how far out arrive starts to slow down, and path following moves on to the
+# next cell
+SLOWING_RADIUS = CELL_WIDTH * 2
+PATH_RADIUS = CELL_WIDTH // 2
+# how far out other units push a unit away, or pull it in with cohesion, and
+# at most how many of them are looked at in each bucket of that size
+NEIGHBOUR_RADIUS = CELL_WIDTH
+NEIGHBOUR_LIMIT = 6
+# how far ahead a unit looks for impassable cells to steer round
+AVOID_DISTANCE = CELL_WIDTH
+
+# simulation ticks a second, how many can be run in one frame to catch up,
+# and the most frames a second to draw (0 for no limit)
+TICK_RATE = 30
+MAX_TICKS_PER_FRAME = 5
+FRAME_RATE_LIMIT = 120
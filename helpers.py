@@ -1,5 +1,6 @@
 import collections
 import heapq
+import math
 
 """
  classes copied from:
@@ -46,3 +47,54 @@ class PriorityQueue:
 def heuristic(a, b):
     # Manhattan distance on a square grid
     return abs(a.x - b.x) + abs(a.y - b.y)
+
+
+"""
+ heuristics for the pathfinding, taking the absolute x and y distances
+ between two cells. See:
+  http://theory.stanford.edu/~amitp/GameProgramming/Heuristics.html
+"""
+
+SQRT2 = math.sqrt(2)
+
+
+def manhattan(dx, dy):
+    # exact for 4-connected moves, overestimates if diagonals are allowed
+    return dx + dy
+
+
+def octile(dx, dy):
+    # exact for 8-connected moves where a diagonal costs sqrt(2)
+    return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+
+def euclidean(dx, dy):
+    # straight line distance, admissible for any moves but less informed
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def chebyshev(dx, dy):
+    # exact for 8-connected moves where a diagonal costs 1
+    return max(dx, dy)
+
+
+def weighted(h, weight):
+    """ Returns heuristic h scaled by weight. A weight above 1 expands fewer
+        cells but the paths can be up to weight times longer than optimal """
+
+    def weightedHeuristic(dx, dy):
+        return weight * h(dx, dy)
+
+    return weightedHeuristic
+
+
+def truncate(vector, maxLength):
+    """ Returns vector, or a copy of it scaled down to maxLength if it is
+        longer """
+
+    lengthSqrd = vector.x * vector.x + vector.y * vector.y
+    if lengthSqrd <= maxLength * maxLength:
+        return vector
+
+    scale = maxLength / math.sqrt(lengthSqrd)
+    return type(vector)(vector.x * scale, vector.y * scale)
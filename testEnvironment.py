@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
 
 import pygame
-import sys
 import pygame.locals as locals
 from Vector import Vec2d
 import Viewport
 import Map
 import StrategyEntity
+from PathService import PathService
+from SpatialIndex import SpatialIndex
+from GameLoop import GameLoop
 
 from config import *
 
-clock = pygame.time.Clock()
-
 SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
 viewport = Viewport.Viewport(SCREEN)
 viewport.setPosition(0, 0)
@@ -22,66 +22,99 @@ viewport.setLimit(3, (MAP_HEIGHT + CELL_HEIGHT))
 
 theMap = Map.Map()
 theMap.setViewport(viewport)
+pathService = PathService(theMap)
 
-SCREEN.fill(pygame.locals.Color(255, 255, 255))
+viewport.fillScreen()
 
-test = StrategyEntity.StrategyEntity()
+test = StrategyEntity.StrategyEntity(theMap)
 test.setPosition(Vec2d(4 * CELL_WIDTH, 0))
 test.setDimensions(CELL_WIDTH, CELL_HEIGHT)
 test.setImage(pygame.Surface((test.getRect().width, test.getRect().height)))
-test.setPath(theMap.findPath(theMap[4][0], theMap[14][12]))
 
-# main loop
-running = True
-while running:
+# the units, so only the ones in view are drawn
+units = SpatialIndex()
+units.insert(test)
+test.setPath(pathService.findPath(theMap[4][0], theMap[14][12]))
+
+# the path to the mouse is found off the main loop, and drawn once it is
+path = theMap.findPath(theMap[4][0], theMap[4][0])
+mouseCell = None
+mouseFuture = None
+
+# the unit walks its path while this is set, return starts and stops it
+walking = False
+
+SCROLL_KEYS = {
+    locals.K_a: Vec2d(-CELL_WIDTH, 0),
+    locals.K_d: Vec2d(CELL_WIDTH, 0),
+    locals.K_s: Vec2d(0, CELL_HEIGHT),
+    locals.K_w: Vec2d(0, -CELL_HEIGHT),
+}
+
+
+def handleInput(dt):
+    global walking
+
     for event in pygame.event.get():
         if (event.type == locals.QUIT):
-            pygame.quit()
-            sys.exit()
+            loop.stop()
         if (event.type == locals.KEYDOWN):
             if (event.key == locals.K_ESCAPE):
-                pygame.quit()
-                sys.exit()
-
-            if (event.key == locals.K_a):
-                theMove = Vec2d(-CELL_WIDTH, 0)
-                if (viewport.inLimits(theMove)):
-                    viewport.move(theMove)
-                    viewport.fillScreen()
-                    theMap.makeScreenCellsDirty()
+                loop.stop()
 
-            if (event.key == locals.K_d):
-                theMove = Vec2d(CELL_WIDTH, 0)
+            if (event.key in SCROLL_KEYS):
+                theMove = SCROLL_KEYS[event.key]
                 if (viewport.inLimits(theMove)):
-                    viewport.move(theMove)
-                    viewport.fillScreen()
-                    theMap.makeScreenCellsDirty()
+                    theMap.scroll(theMove)
 
-            if (event.key == locals.K_s):
-                theMove = Vec2d(0, CELL_HEIGHT)
-                if (viewport.inLimits(theMove)):
-                    viewport.move(theMove)
-                    viewport.fillScreen()
-                    theMap.makeScreenCellsDirty()
+            if (event.key == locals.K_RETURN):
+                walking = not walking
 
-            if (event.key == locals.K_w):
-                theMove = Vec2d(0, -CELL_HEIGHT)
-                if (viewport.inLimits(theMove)):
-                    viewport.move(theMove)
-                    viewport.fillScreen()
-                    theMap.makeScreenCellsDirty()
 
-            if (event.key == locals.K_RETURN):
-                test.move()
+def updatePaths(dt):
+    global path, mouseCell, mouseFuture
 
     # get the mouse position
     (mouseX, mouseY) = pygame.mouse.get_pos()
 
-    clock.tick(30)
+    cell = theMap.getCellFromMouse(mouseX, mouseY)
+    if (mouseCell is None or cell != mouseCell):
+        if (mouseFuture is not None):
+            mouseFuture.cancel()
+        mouseCell = cell
+        mouseFuture = pathService.findPath(theMap[4][0], cell, timeout=0.5)
+
+    pathService.update()
+    if (mouseFuture is not None and mouseFuture.done()):
+        if (not mouseFuture.cancelled() and mouseFuture.exception() is None):
+            path = mouseFuture.result()
+        mouseFuture = None
+
+
+def moveUnits(dt):
+    if (walking):
+        test.move(dt)
+
 
-    path = theMap.findPath(theMap[4][0], theMap.getCellFromMouse(mouseX, mouseY))
+def draw(alpha):
     theMap.draw()
-    test.draw(viewport)
+    for unit in units.queryRect(viewport.getRect()):
+        unit.draw(viewport)
 
     theMap.drawPath(path)
-    pygame.display.flip()
+    viewport.present()
+
+
+# the simulation runs at TICK_RATE, with the unit walking a little every
+# tick and pathfinding a few times a second, and drawing as often as it can
+loop = GameLoop()
+loop.addSystem('input', handleInput)
+loop.addSystem('paths', updatePaths, every=3, budget=0.004)
+loop.addSystem('units', moveUnits)
+loop.addRenderer('draw', draw)
+loop.run()
+
+# where the time went
+print(loop.report())
+pathService.shutdown()
+pygame.quit()